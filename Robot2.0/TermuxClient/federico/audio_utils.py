@@ -4,6 +4,8 @@
 # ====================================
 
 import os
+import queue
+import threading
 import time
 import wave
 import numpy as np
@@ -61,16 +63,28 @@ def _calibrate_threshold(stream, ms=700) -> float:
 # Grabación (con VAD mejorado)
 # ========================
 
+def _flush_frames(frames: list, streamed: int, on_frames) -> int:
+    """Entrega a on_frames los bloques aún no enviados; devuelve cuántos van."""
+    if on_frames:
+        for f in frames[streamed:]:
+            on_frames(np.asarray(f, dtype=np.int16).tobytes())
+    return len(frames)
+
+
 def record_audio(filename: str,
                  use_vad: bool = True,
                  force_recalibrate: bool = True,
-                 pre_silence_ms: int = 350) -> str:
+                 pre_silence_ms: int = 350,
+                 on_frames=None) -> str:
     """
     Graba audio desde el micro y lo guarda en WAV PCM16.
 
     - Si use_vad=True: detecta inicio de voz solo si ha habido
       'pre_silence_ms' de silencio previo (anti-eco del TTS).
     - force_recalibrate=True: recalibra el umbral antes de cada toma.
+    - on_frames(pcm): opcional, recibe los bloques PCM16 según se graban
+      (subida en streaming). Con VAD empieza al detectar voz, enviando de
+      golpe lo grabado hasta entonces.
 
     Devuelve la ruta del WAV (o el mismo filename si vacío en error).
     """
@@ -91,6 +105,7 @@ def record_audio(filename: str,
     )
 
     frames = []
+    streamed = 0  # bloques ya entregados a on_frames
     with stream:
         # Umbrales
         thr_on = _calibrate_threshold(stream, 700) if (use_vad and force_recalibrate) else float(VAD_RMS_THRESHOLD)
@@ -105,6 +120,7 @@ def record_audio(filename: str,
             while True:
                 data, _ = stream.read(CHUNK)
                 frames.append(data.copy())
+                streamed = _flush_frames(frames, streamed, on_frames)
                 if time.time() - start_time > RECORD_MAX_SECONDS:
                     break
 
@@ -144,7 +160,8 @@ def record_audio(filename: str,
                         talk_ms = 0.0
                         silence_ms = 0.0
                 else:
-                    # ya dentro de locución
+                    # ya dentro de locución: el audio sale hacia el servidor
+                    streamed = _flush_frames(frames, streamed, on_frames)
                     talk_ms += dt_ms
                     if level >= thr_off:
                         silence_ms = max(0.0, silence_ms - dt_ms/2)  # baja lentamente
@@ -164,6 +181,7 @@ def record_audio(filename: str,
     # Exportar WAV
     if len(frames) == 0:
         return filename
+    _flush_frames(frames, streamed, on_frames)
 
     # Unir en int16
     if isinstance(frames[0], np.ndarray):
@@ -232,3 +250,88 @@ def play_audio_file(path: str = RESPONSE_WAV):
             os.system(f"start {path}")
     except Exception as e:
         print("[Audio] No se pudo reproducir:", e)
+
+
+# ========================
+# Reproducción progresiva (respuesta frase a frase)
+# ========================
+
+class PcmStreamPlayer:
+    """
+    Reproduce la respuesta progresiva según llega: feed() encola cada frase
+    (PCM16) y un hilo la reproduce mientras la red sigue recibiendo.
+    Con sounddevice usa un OutputStream continuo; si no (Termux sin
+    sounddevice), escribe cada frase en un WAV y la pasa a play_audio_file().
+    """
+
+    def __init__(self):
+        self._q = queue.Queue()
+        self._thread = None
+        self.received = False
+
+    def feed(self, pcm: bytes, sample_rate: int, channels: int):
+        self.received = True
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._q.put((pcm, sample_rate, channels))
+
+    def _run(self):
+        if sd is not None:
+            self._run_sounddevice()
+        else:
+            self._run_files()
+
+    def _run_sounddevice(self):
+        stream = None
+        fmt = None
+        try:
+            while True:
+                item = self._q.get()
+                if item is None:
+                    break
+                pcm, sr, ch = item
+                if (sr, ch) != fmt:
+                    if stream is not None:
+                        stream.stop()
+                        stream.close()
+                    stream = sd.OutputStream(samplerate=sr, channels=ch, dtype="int16")
+                    stream.start()
+                    fmt = (sr, ch)
+                stream.write(np.frombuffer(pcm, dtype=np.int16).reshape(-1, ch))
+        except Exception as e:
+            print("[Audio] Error reproduciendo en streaming:", e)
+        finally:
+            if stream is not None:
+                try:
+                    stream.stop()  # espera a que suene lo pendiente
+                    stream.close()
+                except Exception:
+                    pass
+
+    def _run_files(self):
+        n = 0
+        while True:
+            item = self._q.get()
+            if item is None:
+                break
+            pcm, sr, ch = item
+            # Dos ficheros alternos: se escribe uno mientras suena el otro
+            base, ext = os.path.splitext(RESPONSE_WAV)
+            path = f"{base}_part{n % 2}{ext or '.wav'}"
+            n += 1
+            try:
+                with wave.open(path, "wb") as wf:
+                    wf.setnchannels(ch)
+                    wf.setsampwidth(2)
+                    wf.setframerate(sr)
+                    wf.writeframes(pcm)
+                play_audio_file(path)
+            except Exception as e:
+                print("[Audio] Error reproduciendo frase:", e)
+
+    def wait(self):
+        """Espera a que termine de sonar todo lo recibido."""
+        if self._thread is not None:
+            self._q.put(None)
+            self._thread.join()
@@ -7,10 +7,38 @@ SERVER_PORT = 5000
 # --- Timeouts de socket (segundos) ---
 CONNECT_TIMEOUT_S = 10
 SEND_TIMEOUT_S = 120
-RECV_TIMEOUT_S = 300
+RECV_TIMEOUT_S = 120
 
 # --- Tamaño de bloque para red ---
-BUFFER_SIZE = 4096
+BUFFER_SIZE = 256 * 1024  # bloque para leer/escribir WAV en disco
+SOCKET_BUFFER_BYTES = 0   # SO_SNDBUF/SO_RCVBUF; 0 => autoajuste del sistema
+
+# --- Subida en streaming ---
+# Enviar el audio por tramas mientras se graba (el servidor empieza a
+# transcribir antes). False => protocolo clásico: WAV completo al final.
+STREAM_UPLOAD = True
+# Con STREAM_UPLOAD, pedir la respuesta frase a frase y reproducirla según
+# llega (en vez de esperar al WAV completo).
+STREAM_RESPONSE = True
+
+# Sesión persistente: una sola conexión para todos los turnos (con ID de
+# sesión para que el servidor sepa qué dispositivo habla). Si se cae, se
+# reconecta y se reenvía el turno hasta SESSION_RETRIES veces.
+PERSISTENT_SESSION = True
+SESSION_RETRIES = 1
+
+# Códecs de audio en la red (codec.py), por preferencia. La subida usa el
+# primero que admita el servidor (lo dice al abrir la sesión; sin sesión va
+# en "pcm16") y la respuesta progresiva llega en el primero que admita él.
+#  "zlib": sin pérdidas, 1.4-2.4x menos bytes en voz (más con silencios)
+#  "ulaw": con pérdida, siempre 2x · "pcm16": sin comprimir
+# Para comparar CPU y transferencia en el móvil: benchmarks/bench_codec.py
+AUDIO_CODECS = ("zlib", "ulaw", "pcm16")
+
+# Pedir al servidor, tras cada respuesta, su request_id y cuánto tardó cada
+# etapa (recepción, ASR, LLM, TTS...). Solo con sesión y subida en streaming;
+# se muestra con PRINT_LEVEL = "DEBUG" y sirve para buscar el turno en sus trazas.
+SERVER_TRACE = True
 
 # --- Audio (grabación) ---
 SAMPLE_RATE = 16000    # Hz
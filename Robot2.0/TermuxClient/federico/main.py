@@ -1,6 +1,8 @@
 # main.py
 import os, sys, time, select
-from config import SERVER_HOST, SERVER_PORT, PRINT_LEVEL, debug_enabled, RECORDING_WAV, RESPONSE_WAV
+from config import (SERVER_HOST, SERVER_PORT, PRINT_LEVEL, debug_enabled,
+                    RECORDING_WAV, RESPONSE_WAV, STREAM_UPLOAD, STREAM_RESPONSE,
+                    PERSISTENT_SESSION)
 import audio_utils
 import network_utils
 
@@ -17,6 +19,8 @@ def main():
     print(f"Log level: {PRINT_LEVEL}\n")
 
     active = False
+    # Conexión persistente (se abre en el primer turno y se reutiliza)
+    session = network_utils.ServerSession() if PERSISTENT_SESSION else None
     try:
         while True:
             if not active:
@@ -29,23 +33,40 @@ def main():
 
             print("🎤 ACTIVO. Habla... (ENTER para desactivar)")
             user_wav = RECORDING_WAV
+            # En streaming el audio sale hacia el servidor mientras se graba
+            upload = network_utils.StreamingUpload(session) if STREAM_UPLOAD else None
             # >>> VAD con pre-silencio y recalibración en cada turno <<<
             wav_path = audio_utils.record_audio(
                 user_wav,
                 use_vad=True,
                 force_recalibrate=True,
-                pre_silence_ms=350
+                pre_silence_ms=350,
+                on_frames=upload.send_pcm if upload else None,
             )
 
             if not wav_path or _file_size(wav_path) == 0:
+                if upload:
+                    upload.abort()
                 i, _, _ = select.select([sys.stdin], [], [], 0.5)
                 if i:
                     _ = sys.stdin.readline()
                     active = False
                 continue
 
-            print("[NET] Enviando al servidor…")
-            ok = network_utils.send_audio_and_get_reply(wav_path, RESPONSE_WAV)
+            player = None
+            if upload:
+                print("[NET] Terminando envío al servidor…")
+                # Con respuesta progresiva la primera frase suena mientras llegan las demás
+                player = audio_utils.PcmStreamPlayer() if STREAM_RESPONSE else None
+                ok = upload.finish_and_get_reply(RESPONSE_WAV, on_pcm=player.feed if player else None)
+                if player:
+                    player.wait()
+            else:
+                print("[NET] Enviando al servidor…")
+                if session:
+                    ok = session.send_audio_and_get_reply(wav_path, RESPONSE_WAV)
+                else:
+                    ok = network_utils.send_audio_and_get_reply(wav_path, RESPONSE_WAV)
             if not ok:
                 print("⚠️  Error al comunicar con el servidor.")
                 i, _, _ = select.select([sys.stdin], [], [], 0.8)
@@ -54,8 +75,9 @@ def main():
                     active = False
                 continue
 
-            print("[Asistente] ▶ Respuesta...")
-            audio_utils.play_audio_file(RESPONSE_WAV)
+            if not (player and player.received):
+                print("[Asistente] ▶ Respuesta...")
+                audio_utils.play_audio_file(RESPONSE_WAV)
 
             # === anti-eco: espera corta tras reproducir ===
             time.sleep(0.6)
@@ -68,6 +90,8 @@ def main():
 
     except KeyboardInterrupt:
         print("\n👋 Cliente terminado.")
+        if session:
+            session.close()
         sys.exit(0)
 
 if __name__ == "__main__":
@@ -1,18 +1,104 @@
 # network_utils.py
 # ====================================
 # Funciones de red para comunicar con el servidor
+#  - send_audio_and_get_reply(): protocolo clásico (!Q tamaño + WAV)
+#  - StreamingUpload: envía el audio por tramas según se graba
+#    (STREAM_MAGIC + cabecera JSON + tramas !I + trama vacía de fin)
+#    y puede pedir la respuesta progresiva (RESP_STREAM_MAGIC + una trama
+#    !IIH + PCM16 por frase + trama vacía de fin)
+#  - ServerSession: conexión persistente (SESSION_MAGIC + saludo JSON con el
+#    ID de sesión) por la que van todos los turnos; si se cae, reconecta y
+#    reenvía el turno en curso. El saludo trae los códecs del servidor:
+#    la subida usa el primero de AUDIO_CODECS que admita, y la respuesta
+#    progresiva puede llegar comprimida (RESP_CODEC_MAGIC + JSON {"codec"})
+#  - Con SERVER_TRACE (y si el saludo trae "trace"), tras la respuesta llega
+#    TRACE_MAGIC + JSON con el request_id del turno y los ms por etapa
+# Las lecturas/escrituras de socket van por transport.py (recv_into,
+# sendfile, TCP_NODELAY) y los códecs por codec.py, los mismos módulos que
+# usa el servidor.
 # ====================================
 
+import json
+import queue
 import socket
 import struct
 import os
+import threading
+import time
 import traceback
+import wave
+from typing import Callable, Optional
 from config import (  # <- OJO: import absoluto, no relativo
     SERVER_HOST, SERVER_PORT,
     CONNECT_TIMEOUT_S, SEND_TIMEOUT_S, RECV_TIMEOUT_S,
-    BUFFER_SIZE,
+    BUFFER_SIZE, SOCKET_BUFFER_BYTES,
+    SAMPLE_RATE, CHANNELS, SAMPLE_WIDTH,
+    STREAM_RESPONSE, SESSION_RETRIES, AUDIO_CODECS, SERVER_TRACE,
     debug_enabled,
 )
+import codec
+import transport
+
+STREAM_MAGIC = b"FDSTRM01"
+RESP_STREAM_MAGIC = b"FDPCM001"
+RESP_CODEC_MAGIC = b"FDENC001"
+CHUNK_HDR_FMT = "!IIH"  # bytes PCM, sample_rate, canales (16 bits)
+SESSION_MAGIC = b"FDSESS01"
+TRACE_MAGIC = b"FDTRACE1"
+RESEND_FRAME_BYTES = 32 * 1024
+
+
+class _NoReply(ConnectionError):
+    """La conexión se cerró antes de que empezara la respuesta (se puede reintentar)."""
+
+
+def _retryable(e: Exception) -> bool:
+    # Errores de conexión antes de la respuesta, no timeouts (el servidor sigue trabajando)
+    return isinstance(e, OSError) and not isinstance(e, socket.timeout)
+
+
+def _open_socket() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(CONNECT_TIMEOUT_S)
+    try:
+        sock.connect((SERVER_HOST, SERVER_PORT))
+    except Exception:
+        sock.close()
+        raise
+    transport.tune_socket(sock, buffer_bytes=SOCKET_BUFFER_BYTES)
+    return sock
+
+
+def _send_wav(sock: socket.socket, audio_path: str):
+    """Subida clásica: !Q tamaño + WAV."""
+    filesize = os.path.getsize(audio_path)
+    sock.settimeout(SEND_TIMEOUT_S)
+    hdr = struct.pack("!Q", filesize)
+    sock.sendall(hdr)
+    if debug_enabled():
+        print(f"[NET] Cabecera enviada ({len(hdr)} bytes). Enviando datos…")
+
+    # sendfile del kernel donde se pueda
+    with open(audio_path, "rb") as f:
+        transport.send_file(sock, f, filesize)
+    if debug_enabled():
+        print("[NET] Audio enviado. Esperando respuesta…")
+
+
+def _stream_header(upload_codec: str = codec.PCM16, trace: bool = False) -> bytes:
+    info = {
+        "sample_rate": SAMPLE_RATE, "channels": CHANNELS, "sample_width": SAMPLE_WIDTH,
+        "response": "pcm_stream" if STREAM_RESPONSE else "wav",
+        "codec": upload_codec,
+        # Un servidor sin códecs ignora este campo y responde en PCM16
+        "accept_codecs": [c for c in AUDIO_CODECS if c in codec.CODECS],
+    }
+    if trace:
+        # Solo si el servidor lo anunció: si no, no sabría que va un trailer
+        info["trace"] = True
+    hdr = json.dumps(info).encode("utf-8")
+    return STREAM_MAGIC + struct.pack("!I", len(hdr)) + hdr
+
 
 def send_audio_and_get_reply(audio_path: str, save_path: str) -> bool:
     """
@@ -25,78 +111,418 @@ def send_audio_and_get_reply(audio_path: str, save_path: str) -> bool:
         if debug_enabled():
             print(f"[NET] Conectando con {SERVER_HOST}:{SERVER_PORT} (archivo {filesize} bytes)…")
 
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(CONNECT_TIMEOUT_S)
-
         # 1) Conexión
-        sock.connect((SERVER_HOST, SERVER_PORT))
+        sock = _open_socket()
         if debug_enabled():
             print("[NET] Conectado.")
 
-        # 2) Envío cabecera (tamaño del WAV)
-        sock.settimeout(SEND_TIMEOUT_S)
-        hdr = struct.pack("!Q", filesize)
-        sock.sendall(hdr)
-        if debug_enabled():
-            print(f"[NET] Cabecera enviada ({len(hdr)} bytes). Enviando datos…")
+        # 2-3) Envío cabecera (tamaño del WAV) y WAV
+        _send_wav(sock, audio_path)
 
-        # 3) Envío del WAV
-        with open(audio_path, "rb") as f:
-            while True:
-                chunk = f.read(BUFFER_SIZE)
-                if not chunk:
-                    break
-                sock.sendall(chunk)
+        # 4-5) Respuesta
+        return _receive_reply(sock, save_path)
+
+    except Exception as e:
+        print("[NET] Error en comunicación:", e)
         if debug_enabled():
-            print("[NET] Audio enviado. Esperando respuesta…")
+            traceback.print_exc()
+        return False
+    finally:
+        try:
+            if sock:
+                sock.close()
+        except Exception:
+            pass
 
-        # 4) Tamaño de respuesta
-        sock.settimeout(RECV_TIMEOUT_S)
-        raw_size = _recvall(sock, 8)
-        if not raw_size:
-            print("[NET] No se recibió tamaño de respuesta (conexión cerrada).")
+
+def _receive_reply(sock: socket.socket, save_path: str,
+                   on_pcm: Optional[Callable[[bytes, int, int], None]] = None,
+                   on_trace: Optional[Callable[[dict], None]] = None) -> bool:
+    """
+    Recibe la respuesta y la guarda en save_path. Si el servidor la envía
+    progresiva, cada frase se pasa a on_pcm(pcm, sample_rate, canales) en
+    cuanto llega (y al final se guarda todo en save_path igualmente).
+    Con on_trace (la subida pidió la traza) se lee después el trailer
+    TRACE_MAGIC y su JSON se pasa a on_trace.
+    Si la conexión se cierra antes de la cabecera lanza _NoReply; una vez
+    empezada la respuesta, los cortes devuelven False (no se reintenta).
+    """
+    ok = _receive_reply_body(sock, save_path, on_pcm)
+    if ok and on_trace is not None:
+        info = _receive_trace(sock)
+        if info is None:
+            # Sin el trailer la conexión queda desalineada para el turno siguiente
             return False
+        on_trace(info)
+    return ok
+
+
+def _receive_trace(sock: socket.socket) -> Optional[dict]:
+    """Trailer de traza: TRACE_MAGIC + !I longitud + JSON. None si no llega bien."""
+    try:
+        if _recvall(sock, 8) != TRACE_MAGIC:
+            print("[NET] Falta la traza del servidor tras la respuesta.")
+            return None
+        raw = _recvall(sock, 4)
+        body = _recvall(sock, struct.unpack("!I", raw)[0]) if raw else None
+        if body is None:
+            print("[NET] Traza del servidor incompleta.")
+            return None
+        return json.loads(bytes(body).decode("utf-8"))
+    except (OSError, ValueError) as e:
+        print("[NET] Error leyendo la traza del servidor:", e)
+        return None
+
+
+def _receive_reply_body(sock: socket.socket, save_path: str,
+                        on_pcm: Optional[Callable[[bytes, int, int], None]]) -> bool:
+    # 4) Tamaño de respuesta
+    sock.settimeout(RECV_TIMEOUT_S)
+    try:
+        raw_size = _recvall(sock, 8)
+    except ConnectionError as e:
+        raise _NoReply(str(e)) from e
+    if not raw_size:
+        raise _NoReply("no se recibió tamaño de respuesta (conexión cerrada)")
+    try:
+        if raw_size == RESP_STREAM_MAGIC:
+            return _receive_pcm_stream(sock, save_path, on_pcm)
+        if raw_size == RESP_CODEC_MAGIC:
+            raw = _recvall(sock, 4)
+            body = _recvall(sock, struct.unpack("!I", raw)[0]) if raw else None
+            if body is None:
+                print("[NET] Cabecera de respuesta comprimida incompleta.")
+                return False
+            audio_codec = json.loads(bytes(body).decode("utf-8"))["codec"]
+            return _receive_pcm_stream(sock, save_path, on_pcm, audio_codec)
         resp_size = struct.unpack("!Q", raw_size)[0]
         if debug_enabled():
             print(f"[NET] Tamaño de respuesta: {resp_size} bytes")
 
         # 5) Recepción de la respuesta
         with open(save_path, "wb") as f:
-            bytes_recv = 0
-            while bytes_recv < resp_size:
-                chunk = sock.recv(min(BUFFER_SIZE, resp_size - bytes_recv))
-                if not chunk:
-                    break
-                f.write(chunk)
-                bytes_recv += len(chunk)
+            bytes_recv = transport.recv_to_file(sock, f, resp_size, BUFFER_SIZE)
+    except OSError as e:
+        print("[NET] Respuesta cortada:", e)
+        return False
 
-        if bytes_recv != resp_size:
-            print(f"[NET] Respuesta incompleta: {bytes_recv}/{resp_size} bytes")
-            return False
+    if bytes_recv != resp_size:
+        print(f"[NET] Respuesta incompleta: {bytes_recv}/{resp_size} bytes")
+        return False
 
+    if debug_enabled():
+        print(f"[NET] Respuesta recibida y guardada en {save_path}")
+    return True
+
+
+def _receive_pcm_stream(sock: socket.socket, save_path: str,
+                        on_pcm: Optional[Callable[[bytes, int, int], None]],
+                        audio_codec: str = codec.PCM16) -> bool:
+    """Tramas de la respuesta progresiva hasta el terminador (decodificadas a PCM16)."""
+    hdr_size = struct.calcsize(CHUNK_HDR_FMT)
+    pcm_all = bytearray()
+    fmt = None
+    n = 0
+    while True:
+        hdr = _recvall(sock, hdr_size)
+        if not hdr:
+            print("[NET] Respuesta progresiva cortada.")
+            return False
+        size, sr, ch = struct.unpack(CHUNK_HDR_FMT, hdr)
+        if size == 0:
+            break
+        data = _recvall(sock, size)
+        if data is None:
+            print("[NET] Respuesta progresiva cortada.")
+            return False
+        pcm = codec.decode(audio_codec, data)
+        n += 1
         if debug_enabled():
-            print(f"[NET] Respuesta recibida y guardada en {save_path}")
-        return True
+            print(f"[NET] Frase {n}: {size} bytes ({audio_codec}) @ {sr} Hz")
+        if on_pcm:
+            on_pcm(pcm, sr, ch)
+        if fmt in (None, (sr, ch)):
+            fmt = (sr, ch)
+            pcm_all += pcm
 
-    except Exception as e:
-        print("[NET] Error en comunicación:", e)
+    # Copia en disco de la respuesta (útil para repetirla o depurar)
+    if fmt:
+        with wave.open(save_path, "wb") as wf:
+            wf.setnchannels(fmt[1])
+            wf.setsampwidth(2)
+            wf.setframerate(fmt[0])
+            wf.writeframes(bytes(pcm_all))
+    if debug_enabled():
+        print(f"[NET] Respuesta progresiva recibida ({n} frases).")
+    return True
+
+
+class ServerSession:
+    """
+    Conexión persistente con el servidor: se abre una vez, el saludo devuelve
+    un ID de sesión y por ella van todos los turnos. Si se cae (o el servidor
+    la cerró por inactividad), el siguiente turno reconecta solo con el mismo ID.
+    """
+
+    def __init__(self):
+        self.session_id: Optional[str] = None
+        self._sock: Optional[socket.socket] = None
+        self._idle_timeout_s: Optional[float] = None
+        self._server_codecs = ()
+        self._server_trace = False
+        self._last_used = 0.0
+
+    def connect(self) -> socket.socket:
+        """Socket listo para un turno (abre o reabre la sesión si hace falta)."""
+        idle = self._idle_timeout_s
+        if (self._sock is not None and idle
+                and time.monotonic() - self._last_used > idle - min(5.0, idle / 2)):
+            # El servidor ya la habrá cerrado por inactividad: no perder el turno en ella
+            self.reset()
+        if self._sock is None:
+            self._sock = self._open()
+            self._last_used = time.monotonic()
+        return self._sock
+
+    def _open(self) -> socket.socket:
         if debug_enabled():
-            traceback.print_exc()
+            print(f"[NET] Abriendo sesión con {SERVER_HOST}:{SERVER_PORT}…")
+        sock = _open_socket()
+        try:
+            hello = json.dumps({"session_id": self.session_id,
+                                "device": socket.gethostname()}).encode("utf-8")
+            sock.settimeout(SEND_TIMEOUT_S)
+            sock.sendall(SESSION_MAGIC + struct.pack("!I", len(hello)) + hello)
+            sock.settimeout(RECV_TIMEOUT_S)
+            if _recvall(sock, 8) != SESSION_MAGIC:
+                raise ConnectionError("el servidor no admite sesiones persistentes")
+            raw = _recvall(sock, 4)
+            body = _recvall(sock, struct.unpack("!I", raw)[0]) if raw else None
+            if body is None:
+                raise ConnectionError("saludo de sesión incompleto")
+            welcome = json.loads(bytes(body).decode("utf-8"))
+        except Exception:
+            sock.close()
+            raise
+        self.session_id = welcome["session_id"]
+        self._idle_timeout_s = welcome.get("idle_timeout_s")
+        self._server_codecs = tuple(welcome.get("codecs") or ())
+        self._server_trace = bool(welcome.get("trace"))
+        if debug_enabled():
+            estado = "reanudada" if welcome.get("resumed") else "nueva"
+            print(f"[NET] Sesión {self.session_id} ({estado}), "
+                  f"subida en {self.upload_codec()}.")
+        return sock
+
+    def upload_codec(self) -> str:
+        """Primer códec de AUDIO_CODECS que admite el servidor (anunciado en el saludo)."""
+        return codec.choose(AUDIO_CODECS, self._server_codecs)
+
+    def wants_trace(self) -> bool:
+        """Pedir la traza del turno: SERVER_TRACE y el servidor la ofrece."""
+        return SERVER_TRACE and self._server_trace
+
+    def turn_done(self, ok: bool):
+        """Tras cada turno: si algo falló a medias, la conexión no es reutilizable."""
+        if ok:
+            self._last_used = time.monotonic()
+        else:
+            self.reset()
+
+    def reset(self):
+        """Cierra la conexión (el ID se conserva para la siguiente)."""
+        try:
+            if self._sock:
+                self._sock.close()
+        except Exception:
+            pass
+        self._sock = None
+
+    close = reset
+
+    def send_audio_and_get_reply(self, audio_path: str, save_path: str) -> bool:
+        """Como send_audio_and_get_reply() pero por la sesión, reconectando si hace falta."""
+        for attempt in range(SESSION_RETRIES + 1):
+            try:
+                sock = self.connect()
+                _send_wav(sock, audio_path)
+                ok = _receive_reply(sock, save_path)
+                self.turn_done(ok)
+                return ok
+            except Exception as e:
+                self.reset()
+                if attempt < SESSION_RETRIES and _retryable(e):
+                    print(f"[NET] Conexión perdida ({e}); reconectando…")
+                    continue
+                print("[NET] Error en comunicación:", e)
+                if debug_enabled():
+                    traceback.print_exc()
+                return False
         return False
-    finally:
+
+
+class StreamingUpload:
+    """
+    Subida del audio en streaming mientras se graba.
+    La conexión se abre con la primera trama (send_pcm) y un hilo se encarga
+    de enviar, para que un Wi-Fi lento no frene la captura del micro.
+    Con 'session' se usa su conexión persistente y se guarda lo enviado para
+    reenviarlo entero si la conexión se cae antes de la respuesta.
+    Uso: send_pcm(bytes) por cada bloque -> finish_and_get_reply(save_path)
+         (o abort() si la grabación se cancela).
+    """
+
+    def __init__(self, session: Optional[ServerSession] = None):
+        self._q: "queue.Queue[bytes | None]" = queue.Queue()
+        self._session = session
+        self._sock = None
+        self._thread = None
+        self._error = None
+        self._sent = 0
+        self._codec = codec.PCM16  # sin sesión no sabemos qué admite el servidor
+        self._trace = False
+        self._pcm = bytearray()  # copia para reenviar (solo con sesión)
+        self.last_trace: Optional[dict] = None  # request_id y ms por etapa del servidor
+
+    def _connect(self):
+        if self._session is not None:
+            sock = self._session.connect()
+            self._codec = self._session.upload_codec()
+            self._trace = self._session.wants_trace()
+        else:
+            if debug_enabled():
+                print(f"[NET] Conectando con {SERVER_HOST}:{SERVER_PORT} (streaming)…")
+            sock = _open_socket()
+        self._sock = sock
+        sock.settimeout(SEND_TIMEOUT_S)
+        sock.sendall(_stream_header(self._codec, self._trace))
+
+    def _send_frame(self, sock: socket.socket, pcm):
+        # Se comprime aquí (hilo de envío), no en el callback del micro
+        data = codec.encode(self._codec, pcm)
+        transport.send_all(sock, struct.pack("!I", len(data)), data)
+        self._sent += len(data)
+
+    def _sender(self):
         try:
-            if sock:
-                sock.close()
+            self._connect()
+            while True:
+                pcm = self._q.get()
+                if pcm is None:
+                    break
+                self._send_frame(self._sock, pcm)
+            # Fin de locución (no si se abortó: el servidor descarta la subida)
+            if self._error is None:
+                self._sock.sendall(struct.pack("!I", 0))
+        except Exception as e:
+            self._error = e
+            # Vaciar la cola para no acumular audio que ya no se enviará
+            while True:
+                try:
+                    if self._q.get_nowait() is None:
+                        break
+                except queue.Empty:
+                    break
+
+    def send_pcm(self, pcm: bytes):
+        """Encola un bloque PCM16 para enviarlo (no bloquea)."""
+        if not pcm:
+            return
+        if self._session is not None:
+            self._pcm += pcm
+        if self._error is not None:
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._sender, daemon=True)
+            self._thread.start()
+        self._q.put(bytes(pcm))
+
+    def _resend(self, save_path: str,
+                on_pcm: Optional[Callable[[bytes, int, int], None]]) -> bool:
+        """Reenvía la locución completa por una conexión nueva de la sesión."""
+        self._connect()
+        sock = self._sock
+        self._sent = 0
+        view = memoryview(self._pcm)
+        for i in range(0, len(view), RESEND_FRAME_BYTES):
+            self._send_frame(sock, view[i:i + RESEND_FRAME_BYTES])
+        sock.sendall(struct.pack("!I", 0))
+        if debug_enabled():
+            print(f"[NET] Audio reenviado ({self._sent} bytes, {self._codec}). "
+                  "Esperando respuesta…")
+        return _receive_reply(sock, save_path, on_pcm, self._on_trace())
+
+    def _on_trace(self) -> Optional[Callable[[dict], None]]:
+        return self._store_trace if self._trace else None
+
+    def _store_trace(self, info: dict):
+        self.last_trace = info
+        if debug_enabled():
+            etapas = ", ".join(f"{k} {v:.0f}" for k, v in (info.get("timings_ms") or {}).items())
+            print(f"[NET] Servidor: petición {info.get('request_id')} en "
+                  f"{info.get('total_ms', 0):.0f} ms ({etapas})")
+
+    def finish_and_get_reply(self, save_path: str,
+                             on_pcm: Optional[Callable[[bytes, int, int], None]] = None) -> bool:
+        """
+        Cierra la locución y espera la respuesta. Con STREAM_RESPONSE las frases
+        llegan a on_pcm según se reciben; si no, WAV como en el protocolo clásico.
+        """
+        if self._thread is None:
+            return False
+        self._q.put(None)
+        self._thread.join()
+        retries = SESSION_RETRIES if self._session is not None else 0
+        try:
+            for attempt in range(retries + 1):
+                try:
+                    if attempt == 0:
+                        if self._error is not None:
+                            raise self._error
+                        if debug_enabled():
+                            print(f"[NET] Audio enviado en streaming ({self._sent} bytes, "
+                                  f"{self._codec}). Esperando respuesta…")
+                        ok = _receive_reply(self._sock, save_path, on_pcm, self._on_trace())
+                    else:
+                        ok = self._resend(save_path, on_pcm)
+                    if self._session is not None:
+                        self._session.turn_done(ok)
+                    return ok
+                except Exception as e:
+                    if self._session is not None:
+                        self._session.reset()
+                    if attempt < retries and _retryable(e):
+                        print(f"[NET] Conexión perdida ({e}); reconectando…")
+                        continue
+                    print("[NET] Error en comunicación:", e)
+                    if debug_enabled():
+                        traceback.print_exc()
+                    return False
+            return False
+        finally:
+            self.close()
+
+    def abort(self):
+        """Cancela la subida (grabación vacía o cancelada)."""
+        if self._thread is not None:
+            self._error = self._error or RuntimeError("cancelado")
+            self._q.put(None)
+            self._thread.join(timeout=1.0)
+            if self._session is not None:
+                # El servidor tiene una subida a medias: cerrar para que la descarte
+                self._session.reset()
+        self.close()
+
+    def close(self):
+        # La conexión de una sesión es de la sesión: no se cierra aquí
+        try:
+            if self._sock and self._session is None:
+                self._sock.close()
         except Exception:
             pass
+        self._sock = None
 
 
-def _recvall(sock: socket.socket, n: int) -> bytes | None:
+def _recvall(sock: socket.socket, n: int) -> bytearray | None:
     """Lee exactamente n bytes del socket o devuelve None si falla."""
-    data = b""
-    while len(data) < n:
-        packet = sock.recv(n - len(data))
-        if not packet:
-            return None
-        data += packet
-    return data
+    return transport.recv_exactly(sock, n)
@@ -0,0 +1,111 @@
+# transport.py
+# ====================================
+# Transporte TCP común a servidor y clientes
+# (el mismo fichero en server/, client/ y TermuxClient/federico/;
+#  no importa config para que valga tal cual en los tres sitios)
+#  - recv_exactly()/recv_into_exactly(): recv_into sobre buffers reservados,
+#    sin ir concatenando bytes (lo que era cuadrático en recvall)
+#  - recv_to_file(): recibe a disco reutilizando un único buffer
+#  - send_file(): socket.sendfile() (sendfile del kernel donde existe)
+#  - send_all(): cabecera + datos sin concatenarlos (sendmsg si existe)
+#  - tune_socket(): TCP_NODELAY, keepalive y buffers opcionales
+# ====================================
+
+from __future__ import annotations
+
+import socket
+from typing import Optional
+
+# Bloque por defecto para lecturas/escrituras a disco (antes 4 KB)
+CHUNK_SIZE = 256 * 1024
+
+
+def tune_socket(sock: socket.socket, nodelay: bool = True, keepalive: bool = True,
+                buffer_bytes: int = 0):
+    """
+    Ajustes de un socket conectado:
+      - TCP_NODELAY: cabeceras y tramas pequeñas salen sin esperar (Nagle)
+      - SO_KEEPALIVE: detectar conexiones muertas en el Wi-Fi
+      - buffer_bytes > 0 fija SO_SNDBUF/SO_RCVBUF; 0 deja el autoajuste del
+        sistema (en Linux fijarlo a mano lo desactiva)
+    Los fallos se ignoran: son optimizaciones, no requisitos.
+    """
+    opts = []
+    if nodelay:
+        opts.append((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1))
+    if keepalive:
+        opts.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    if buffer_bytes > 0:
+        opts.append((socket.SOL_SOCKET, socket.SO_SNDBUF, buffer_bytes))
+        opts.append((socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_bytes))
+    for level, opt, value in opts:
+        try:
+            sock.setsockopt(level, opt, value)
+        except OSError:
+            pass
+
+
+def recv_into_exactly(sock: socket.socket, view: memoryview) -> bool:
+    """Llena 'view' entera desde el socket. False si la conexión se corta."""
+    got = 0
+    n_total = len(view)
+    while got < n_total:
+        n = sock.recv_into(view[got:])
+        if not n:
+            return False
+        got += n
+    return True
+
+
+def recv_exactly(sock: socket.socket, n: int) -> Optional[bytearray]:
+    """Lee exactamente n bytes en un bytearray reservado, o None si la conexión se corta."""
+    buf = bytearray(n)
+    return buf if recv_into_exactly(sock, memoryview(buf)) else None
+
+
+def recv_to_file(sock: socket.socket, f, size: int, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Copia 'size' bytes del socket al fichero abierto 'f' con un único buffer
+    reutilizado. Devuelve los bytes recibidos (menos de 'size' si se cortó).
+    """
+    buf = memoryview(bytearray(min(chunk_size, max(size, 1))))
+    got = 0
+    while got < size:
+        n = sock.recv_into(buf[:min(len(buf), size - got)])
+        if not n:
+            break
+        f.write(buf[:n])
+        got += n
+    return got
+
+
+def send_file(sock: socket.socket, f, count: Optional[int] = None) -> int:
+    """
+    Envía el fichero abierto (binario) 'f' desde su posición actual.
+    socket.sendfile() usa os.sendfile (copia en el kernel) donde existe y
+    cae a send() por bloques en el resto (p. ej. Windows).
+    """
+    return sock.sendfile(f, count=count)
+
+
+def send_all(sock: socket.socket, *parts) -> int:
+    """
+    Envía varios buffers seguidos (p. ej. cabecera + PCM) sin concatenarlos.
+    Con sendmsg (POSIX) van en una sola llamada; si no, sendall() por partes.
+    """
+    views = [memoryview(p).cast("B") for p in parts if len(p)]
+    total = sum(len(v) for v in views)
+    if not hasattr(sock, "sendmsg"):
+        for v in views:
+            sock.sendall(v)
+        return total
+
+    while views:
+        sent = sock.sendmsg(views)
+        # Envío parcial: descartar lo ya enviado y seguir con el resto
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if views and sent:
+            views[0] = views[0][sent:]
+    return total
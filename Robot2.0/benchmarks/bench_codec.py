@@ -0,0 +1,115 @@
+# benchmarks/bench_codec.py
+# ====================================
+# Códecs de audio en la red (codec.py): CPU de codificar/decodificar frente
+# al tiempo de transferencia que ahorran.
+# Sobre una locución (un WAV con --wav o voz sintética de 20 s) y por tramas
+# del tamaño que manda StreamingUpload, mide para cada códec:
+#  - ratio de compresión y bytes en la red
+#  - ms de CPU para codificar y para decodificar
+#  - tiempo total (codificar + transferir + decodificar) a varias velocidades
+#    de enlace, y la velocidad a partir de la cual ya no compensa
+# Está pensado para el móvil, que es donde la CPU cuenta:
+#   desde Robot2.0/:                  python -m benchmarks.bench_codec [--wav x.wav]
+#   en Termux (junto a codec.py):     python bench_codec.py --wav recording_temp.wav
+# (copiando este fichero a TermuxClient/federico/)
+# ====================================
+
+from __future__ import annotations
+
+import argparse
+import time
+import wave
+
+import numpy as np
+
+try:
+    from client import codec
+except ImportError:
+    # en el móvil: junto a codec.py en federico/
+    import codec
+
+SAMPLE_RATE = 16000
+
+
+def _synthetic_speech(seconds: float, seed: int = 0) -> bytes:
+    """
+    Voz sintética PCM16 mono: sílabas sonoras (armónicos de un tono que
+    varía entre 110 y 220 Hz) de ~4 por segundo, pausas y ruido de micro.
+    El ruido puro no se comprime y un seno se comprime demasiado; esto
+    queda cerca de una grabación real.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * SAMPLE_RATE)
+    t = np.arange(n) / SAMPLE_RATE
+    f0 = 165 + 55 * np.sin(2 * np.pi * 0.3 * t) + 10 * rng.standard_normal(n).cumsum() / np.sqrt(n)
+    phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+    voice = sum(np.sin(k * phase) / k for k in range(1, 16))
+    syllables = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) ** 2
+    pauses = (np.sin(2 * np.pi * 0.15 * t + rng.uniform(0, 6)) > -0.5).astype(float)
+    x = 6000 * voice * syllables * pauses + 60 * rng.standard_normal(n)
+    return np.clip(x, -32768, 32767).astype("<i2").tobytes()
+
+
+def _read_wav(path: str) -> bytes:
+    with wave.open(path, "rb") as wf:
+        if wf.getsampwidth() != 2:
+            raise SystemExit(f"{path}: solo WAV PCM de 16 bits")
+        return wf.readframes(wf.getnframes())
+
+
+def _frames(pcm: bytes, frame_bytes: int):
+    view = memoryview(pcm)
+    return [view[i:i + frame_bytes] for i in range(0, len(view), frame_bytes)]
+
+
+def bench(pcm: bytes, frame_bytes: int, repeat: int) -> dict:
+    """{códec: (bytes en la red, s codificando, s decodificando)}, mejor de 'repeat'."""
+    frames = _frames(pcm, frame_bytes)
+    results = {}
+    for name in codec.CODECS:
+        best_enc = best_dec = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            encoded = [codec.encode(name, f) for f in frames]
+            t1 = time.perf_counter()
+            decoded = [codec.decode(name, e) for e in encoded]
+            t2 = time.perf_counter()
+            best_enc = min(best_enc, t1 - t0)
+            best_dec = min(best_dec, t2 - t1)
+        if name != "ulaw" and b"".join(bytes(d) for d in decoded) != pcm:
+            raise RuntimeError(f"{name}: el audio decodificado no coincide")
+        results[name] = (sum(len(e) for e in encoded), best_enc, best_dec)
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark de códecs de audio (codec.py)")
+    ap.add_argument("--wav", help="WAV PCM16 a usar (por defecto, voz sintética)")
+    ap.add_argument("--seconds", type=float, default=20.0, help="duración de la voz sintética")
+    ap.add_argument("--frame", type=int, default=2048, help="bytes PCM por trama (1024 muestras)")
+    ap.add_argument("--mbps", type=float, nargs="+", default=[0.5, 2, 10, 50],
+                    help="velocidades de enlace (Mbit/s) para estimar la transferencia")
+    ap.add_argument("--repeat", type=int, default=3, help="repeticiones (se queda la mejor)")
+    args = ap.parse_args()
+
+    pcm = _read_wav(args.wav) if args.wav else _synthetic_speech(args.seconds)
+    pcm = pcm[:len(pcm) // 2 * 2]
+    res = bench(pcm, args.frame, args.repeat)
+    raw = len(pcm)
+
+    print(f"Audio: {raw / 1024:.0f} KB PCM16, tramas de {args.frame} bytes")
+    head = "".join(f"{f'{m:g} Mb/s':>11}" for m in args.mbps)
+    print(f"{'códec':<7}{'ratio':>7}{'KB red':>9}{'cod. ms':>9}{'dec. ms':>9}{head}"
+          f"{'compensa hasta':>16}")
+    for name, (wire, enc, dec) in res.items():
+        cpu = enc + dec
+        totals = "".join(f"{cpu + wire * 8 / (m * 1e6):>10.2f}s" for m in args.mbps)
+        # Enlace al que el tiempo ahorrado en la red iguala a la CPU gastada
+        saved_bits = (raw - wire) * 8
+        limit = f"{saved_bits / cpu / 1e6:.0f} Mb/s" if saved_bits > 0 and cpu > 0 else "-"
+        print(f"{name:<7}{raw / wire:>7.2f}{wire / 1024:>9.1f}{enc * 1e3:>9.1f}{dec * 1e3:>9.1f}"
+              f"{totals}{limit:>16}")
+
+
+if __name__ == "__main__":
+    main()
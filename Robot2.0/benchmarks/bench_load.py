@@ -0,0 +1,375 @@
+# benchmarks/bench_load.py
+# ====================================
+# Prueba de carga de extremo a extremo, sin red ni modelos:
+#  - arranca server.main en otro proceso (load_server.py) con un Ollama de
+#    mentira en localhost y, por defecto, Whisper y edge-tts sustituidos por
+#    esperas de coste configurable (fake_backends.py)
+#  - N clientes simulados repiten un corpus de locuciones WAV por el
+#    protocolo clásico (!Q tamaño + WAV -> !Q tamaño + WAV), cada uno en
+#    bucle cerrado (la siguiente petición sale al llegar la respuesta)
+#  - para cada nivel de concurrencia (--clients 1 5 20) muestra:
+#    peticiones/s, tiempo hasta el primer byte de la respuesta (desde que
+#    termina la subida), latencia total, avisos de "ocupado" y p50/p95/p99
+#    de cada etapa del servidor (de sus trazas, tracing.py)
+#  - --save guarda los resultados en JSON y --baseline compara con otro
+#    JSON guardado antes (para ver qué cambia con cada commit)
+# Uso (desde Robot2.0/):
+#   python -m benchmarks.bench_load [--clients 1 5 20] [--requests 10]
+#       [--corpus carpeta_wavs] [--mode pool] [--llm-token-ms 30]
+#       [--save base.json | --baseline base.json] [--set NOMBRE=valor]
+# ====================================
+
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import os
+import re
+import shutil
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import wave
+
+from benchmarks.bench_codec import _synthetic_speech
+from benchmarks.fake_backends import FakeOllama
+from server import transport
+
+QUANTILES = (0.5, 0.95, 0.99)
+CLIENT_TIMEOUT_S = 120
+
+
+# ---------------------------------------------------------------
+# Corpus
+# ---------------------------------------------------------------
+def _wav_bytes(pcm: bytes, sample_rate: int = 16000) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm)
+    return buf.getvalue()
+
+
+def load_corpus(corpus: str | None, seconds: list[float]) -> list[tuple[str, bytes]]:
+    """[(nombre, WAV)] de una carpeta de WAVs, o voz sintética de 'seconds' s."""
+    if not corpus:
+        return [(f"sintetica_{s:g}s", _wav_bytes(_synthetic_speech(s, seed=i)))
+                for i, s in enumerate(seconds)]
+    names = sorted(n for n in os.listdir(corpus) if n.lower().endswith(".wav"))
+    if not names:
+        raise SystemExit(f"{corpus}: no hay ficheros .wav")
+    out = []
+    for name in names:
+        with open(os.path.join(corpus, name), "rb") as f:
+            out.append((name, f.read()))
+    return out
+
+
+# ---------------------------------------------------------------
+# Cliente (protocolo clásico)
+# ---------------------------------------------------------------
+def one_request(addr, wav: bytes) -> dict:
+    """Una petición !Q + WAV. Tiempos en segundos desde el inicio de la conexión."""
+    t0 = time.perf_counter()
+    sock = socket.create_connection(addr, timeout=CLIENT_TIMEOUT_S)
+    try:
+        transport.tune_socket(sock)
+        transport.send_all(sock, struct.pack("!Q", len(wav)), wav)
+        t_sent = time.perf_counter()
+        raw = transport.recv_exactly(sock, 8)
+        t_first = time.perf_counter()
+        if not raw:
+            raise ConnectionError("sin respuesta")
+        size = struct.unpack("!Q", raw)[0]
+        body = transport.recv_exactly(sock, size)
+        if body is None:
+            raise ConnectionError("respuesta incompleta")
+        t_end = time.perf_counter()
+    finally:
+        sock.close()
+    return {"ttfb": t_first - t_sent, "e2e": t_end - t0, "bytes": size}
+
+
+def run_level(addr, corpus: list[tuple[str, bytes]], clients: int, requests: int,
+              think_s: float) -> dict:
+    """'clients' hilos con 'requests' peticiones cada uno. Devuelve muestras y errores."""
+    samples: list[dict] = []
+    errors: list[str] = []
+    lock = threading.Lock()
+    start = threading.Barrier(clients)
+
+    def _client(idx: int):
+        start.wait()
+        for i in range(requests):
+            _, wav = corpus[(idx + i) % len(corpus)]
+            try:
+                res = one_request(addr, wav)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+                continue
+            with lock:
+                samples.append(res)
+            if think_s:
+                time.sleep(think_s)
+
+    threads = [threading.Thread(target=_client, args=(i,), daemon=True) for i in range(clients)]
+    wall0 = time.time()
+    t0 = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    return {"samples": samples, "errors": errors, "elapsed": time.perf_counter() - t0,
+            "wall": (wall0, time.time())}
+
+
+# ---------------------------------------------------------------
+# Lo que cuenta el servidor
+# ---------------------------------------------------------------
+def _pct(values: list[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(q * len(values) + 0.5)) - 1))]
+
+
+def summary_ms(values_s: list[float]) -> dict:
+    return {f"p{int(q * 100)}": round(_pct(values_s, q) * 1000, 1) for q in QUANTILES}
+
+
+def stage_percentiles(trace_file: str, wall: tuple[float, float]) -> dict:
+    """p50/p95/p99 (ms) de cada etapa en los registros 'request' del intervalo 'wall'."""
+    by_stage: dict[str, list[float]] = {}
+    try:
+        f = open(trace_file, encoding="utf-8")
+    except OSError:
+        return {}
+    with f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  # línea a medias (el servidor sigue escribiendo)
+            if rec.get("type") != "request" or not wall[0] <= rec.get("ts", 0) <= wall[1]:
+                continue
+            for stage, ms in (rec.get("timings_ms") or {}).items():
+                by_stage.setdefault(stage, []).append(ms / 1000)
+    return {stage: summary_ms(v) for stage, v in sorted(by_stage.items())}
+
+
+_REPLY_RE = re.compile(r'^federico_reply_total\{source="([^"]+)"\} (\d+)', re.M)
+
+
+def reply_counts(metrics_ports: list[int]) -> dict:
+    """Respuestas por origen (intent, llm, busy...) sumando los /metrics de todos los procesos."""
+    total: dict[str, int] = {}
+    for port in metrics_ports:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as r:
+                body = r.read().decode("utf-8")
+        except OSError:
+            continue
+        for source, n in _REPLY_RE.findall(body):
+            total[source] = total.get(source, 0) + int(n)
+    return total
+
+
+# ---------------------------------------------------------------
+# Servidor en otro proceso
+# ---------------------------------------------------------------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def add_server_args(ap: argparse.ArgumentParser, asr: str = "fake", tts: str = "fake"):
+    """Opciones del servidor bajo prueba (las comparte replay_capture.py)."""
+    ap.add_argument("--mode", choices=("serial", "pool", "prefork", "async"), default="pool")
+    ap.add_argument("--workers", type=int, default=0,
+                    help="SERVER_WORKERS (o PREFORK_PROCESSES en prefork); 0 => el de config.py")
+    ap.add_argument("--asr", choices=("fake", "real"), default=asr)
+    ap.add_argument("--asr-fixed-ms", type=float, default=50)
+    ap.add_argument("--asr-rtf", type=float, default=0.1, help="s de ASR por s de audio")
+    ap.add_argument("--tts", choices=("fake", "real"), default=tts)
+    ap.add_argument("--tts-fixed-ms", type=float, default=100)
+    ap.add_argument("--tts-char-ms", type=float, default=2)
+    ap.add_argument("--set", action="append", default=[], metavar="NOMBRE=valor",
+                    help="constante de server/config.py para el servidor (repetible)")
+    ap.add_argument("--startup-timeout", type=float, default=60)
+
+
+def start_server(args, ollama_url: str | None, workdir: str):
+    """
+    Lanza load_server.py con las opciones de add_server_args(). Devuelve
+    (proceso, (host, puerto), puertos de /metrics). Con ollama_url=None el
+    servidor usa el OLLAMA_URL de config.py.
+    """
+    port, metrics_port = _free_port(), _free_port()
+    cmd = [sys.executable, "-m", "benchmarks.load_server",
+           "--port", str(port), "--metrics-port", str(metrics_port),
+           "--trace-file", os.path.join(workdir, "trace.jsonl"),
+           "--asr", args.asr, "--asr-fixed-ms", str(args.asr_fixed_ms), "--asr-rtf", str(args.asr_rtf),
+           "--tts", args.tts, "--tts-fixed-ms", str(args.tts_fixed_ms),
+           "--tts-char-ms", str(args.tts_char_ms),
+           "--set", f"SERVER_MODE={args.mode!r}"]
+    if ollama_url:
+        cmd += ["--ollama-url", ollama_url]
+    if args.workers:
+        key = "PREFORK_PROCESSES" if args.mode == "prefork" else "SERVER_WORKERS"
+        cmd += ["--set", f"{key}={args.workers}"]
+    for item in args.set:
+        cmd += ["--set", item]
+    log = open(os.path.join(workdir, "server.log"), "wb")
+    proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    log.close()
+
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"El servidor terminó al arrancar; mira {workdir}/server.log")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.2)
+    else:
+        stop_server(proc)
+        raise SystemExit(f"El servidor no aceptó conexiones en {args.startup_timeout} s")
+
+    if args.mode == "prefork":
+        processes = args.workers or os.cpu_count() or 1
+        metrics_ports = [metrics_port + 1 + slot for slot in range(processes)]
+    else:
+        metrics_ports = [metrics_port]
+    return proc, ("127.0.0.1", port), metrics_ports
+
+
+def stop_server(proc: subprocess.Popen):
+    if proc.poll() is not None:
+        return
+    proc.send_signal(signal.SIGINT)
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+# ---------------------------------------------------------------
+# Informe
+# ---------------------------------------------------------------
+def summarize(clients: int, level: dict, replies: dict, stages: dict) -> dict:
+    samples = level["samples"]
+    return {
+        "clients": clients,
+        "ok": len(samples),
+        "errors": len(level["errors"]),
+        "throughput_rps": round(len(samples) / level["elapsed"], 3) if level["elapsed"] else 0.0,
+        "ttfb_ms": summary_ms([s["ttfb"] for s in samples]),
+        "e2e_ms": summary_ms([s["e2e"] for s in samples]),
+        "replies": replies,
+        "stages_ms": stages,
+    }
+
+
+def _delta(new: float, old: float | None) -> str:
+    if old is None or not old or old != old or new != new:
+        return ""
+    return f" ({(new - old) / old * 100:+.0f}%)"
+
+
+def print_report(results: list[dict], baseline: dict | None):
+    base = {r["clients"]: r for r in (baseline or {}).get("levels", [])}
+    for r in results:
+        b = base.get(r["clients"])
+        print(f"\n== {r['clients']} cliente(s): {r['ok']} ok, {r['errors']} errores, "
+              f"{r['throughput_rps']:.2f} pet/s"
+              f"{_delta(r['throughput_rps'], b and b['throughput_rps'])}")
+        for key, label in (("ttfb_ms", "primer byte"), ("e2e_ms", "total")):
+            cells = "  ".join(f"{q} {v:8.1f}{_delta(v, b and b[key].get(q))}"
+                              for q, v in r[key].items())
+            print(f"   {label:<12} ms  {cells}")
+        if r["replies"]:
+            print("   respuestas     " + ", ".join(f"{k} {v}" for k, v in sorted(r["replies"].items())))
+        for stage, pcts in r["stages_ms"].items():
+            old = b and b["stages_ms"].get(stage)
+            cells = "  ".join(f"{q} {v:8.1f}{_delta(v, old and old.get(q))}" for q, v in pcts.items())
+            print(f"   · {stage:<12} {cells}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Prueba de carga del servidor con backends locales de prueba")
+    ap.add_argument("--clients", type=int, nargs="+", default=[1, 5, 20], help="niveles de concurrencia")
+    ap.add_argument("--requests", type=int, default=10, help="peticiones por cliente y nivel")
+    ap.add_argument("--think-ms", type=float, default=0, help="pausa de cada cliente entre peticiones")
+    ap.add_argument("--corpus", help="carpeta con WAVs PCM16 (por defecto, voz sintética)")
+    ap.add_argument("--seconds", type=float, nargs="+", default=[2, 4, 8],
+                    help="duraciones de las locuciones sintéticas")
+    ap.add_argument("--llm-first-token-ms", type=float, default=200)
+    ap.add_argument("--llm-token-ms", type=float, default=30)
+    ap.add_argument("--llm-tokens", type=int, default=40)
+    ap.add_argument("--ollama-url", help="usar este Ollama en lugar del de prueba")
+    add_server_args(ap)
+    ap.add_argument("--save", help="guardar los resultados en este JSON")
+    ap.add_argument("--baseline", help="JSON de una ejecución anterior con el que comparar")
+    ap.add_argument("--keep", action="store_true", help="no borrar las trazas y el log del servidor")
+    args = ap.parse_args()
+
+    corpus = load_corpus(args.corpus, args.seconds)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    workdir = tempfile.mkdtemp(prefix="federico_load_")
+    ollama = None
+    if not args.ollama_url:
+        ollama = FakeOllama(args.llm_first_token_ms / 1000, args.llm_token_ms / 1000,
+                            args.llm_tokens).start()
+    proc, addr, metrics_ports = start_server(args, args.ollama_url or ollama.url, workdir)
+    results = []
+    try:
+        print(f"Servidor en {addr[0]}:{addr[1]} (modo {args.mode}), "
+              f"corpus de {len(corpus)} locución(es); calentando…")
+        one_request(addr, corpus[0][1])
+
+        for clients in args.clients:
+            before = reply_counts(metrics_ports)
+            level = run_level(addr, corpus, clients, args.requests, args.think_ms / 1000)
+            time.sleep(0.5)  # el servidor escribe sus trazas en segundo plano
+            after = reply_counts(metrics_ports)
+            replies = {k: after[k] - before.get(k, 0) for k in after if after[k] - before.get(k, 0)}
+            stages = stage_percentiles(os.path.join(workdir, "trace.jsonl"), level["wall"])
+            results.append(summarize(clients, level, replies, stages))
+            for err in sorted(set(level["errors"]))[:5]:
+                print(f"   [{clients} clientes] error: {err}")
+    finally:
+        stop_server(proc)
+        if ollama is not None:
+            ollama.stop()
+
+    print_report(results, baseline)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "levels": results}, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados guardados en {args.save}")
+    if args.keep:
+        print(f"Trazas y log del servidor en {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# benchmarks/bench_transport.py
+# ====================================
+# Rendimiento del transporte TCP: forma antigua vs transport.py
+#  - "antiguo": bloques de 4 KB leídos/escritos en Python, y recvall con
+#    data += packet para recibir en memoria
+#  - "nuevo": socket.sendfile() + recv_into sobre buffers reservados
+# Genera WAVs de varios MB, los manda por loopback (emisor y receptor corren
+# en este mismo proceso) y muestra los MB/s de cada variante.
+# Uso (desde Robot2.0/): python -m benchmarks.bench_transport [--sizes 2 8 32]
+# ====================================
+
+from __future__ import annotations
+
+import argparse
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+import wave
+
+from server import transport
+
+OLD_BUFFER_SIZE = 4096
+
+
+# ---------------------------------------------------------------
+# Implementación antigua (copiada de utils_net/network_utils)
+# ---------------------------------------------------------------
+def _old_recvall(sock: socket.socket, n: int):
+    data = b""
+    while len(data) < n:
+        packet = sock.recv(n - len(data))
+        if not packet:
+            return None
+        data += packet
+    return data
+
+
+def _old_send_file(sock: socket.socket, path: str):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(OLD_BUFFER_SIZE), b""):
+            sock.sendall(chunk)
+
+
+def _old_recv_file(sock: socket.socket, path: str, size: int) -> int:
+    got = 0
+    with open(path, "wb") as f:
+        while got < size:
+            chunk = sock.recv(min(OLD_BUFFER_SIZE, size - got))
+            if not chunk:
+                break
+            f.write(chunk)
+            got += len(chunk)
+    return got
+
+
+# ---------------------------------------------------------------
+# Implementación nueva (transport.py)
+# ---------------------------------------------------------------
+def _new_send_file(sock: socket.socket, path: str):
+    with open(path, "rb") as f:
+        transport.send_file(sock, f)
+
+
+def _new_recv_file(sock: socket.socket, path: str, size: int) -> int:
+    with open(path, "wb") as f:
+        return transport.recv_to_file(sock, f, size)
+
+
+def _make_wav(path: str, megabytes: float):
+    """WAV PCM16 mono 16 kHz de ~'megabytes' MB (ruido, para que no sea trivial)."""
+    n_bytes = int(megabytes * 1024 * 1024) // 2 * 2
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(16000)
+        wf.writeframes(os.urandom(n_bytes))
+
+
+def _pair(tune: bool):
+    """Par de sockets TCP conectados por loopback."""
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(1)
+    cli = socket.create_connection(srv.getsockname())
+    conn, _ = srv.accept()
+    srv.close()
+    if tune:
+        transport.tune_socket(cli)
+        transport.tune_socket(conn)
+    return cli, conn
+
+
+def _run(send, recv, tune: bool) -> float:
+    """Envía con send(sock) en un hilo y recibe con recv(sock). Devuelve segundos."""
+    cli, conn = _pair(tune)
+    try:
+        t0 = time.perf_counter()
+        th = threading.Thread(target=send, args=(cli,))
+        th.start()
+        recv(conn)
+        th.join()
+        return time.perf_counter() - t0
+    finally:
+        cli.close()
+        conn.close()
+
+
+def bench(path: str, out_path: str, repeat: int) -> dict:
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        payload = f.read()
+
+    def _check(got):
+        if got != size:
+            raise RuntimeError(f"recibidos {got}/{size} bytes")
+
+    cases = {
+        # fichero -> socket -> fichero (ruta clásica con WAV en disco)
+        "fichero antiguo": (
+            lambda s: (s.sendall(struct.pack("!Q", size)), _old_send_file(s, path)),
+            lambda s: _check(_old_recv_file(s, out_path, struct.unpack("!Q", _old_recvall(s, 8))[0])),
+            False,
+        ),
+        "fichero nuevo": (
+            lambda s: (s.sendall(struct.pack("!Q", size)), _new_send_file(s, path)),
+            lambda s: _check(_new_recv_file(s, out_path, struct.unpack("!Q", transport.recv_exactly(s, 8))[0])),
+            True,
+        ),
+        # memoria -> socket -> memoria (trama grande leída de una vez)
+        "memoria antiguo": (
+            lambda s: s.sendall(payload),
+            lambda s: _check(len(_old_recvall(s, size) or b"")),
+            False,
+        ),
+        "memoria nuevo": (
+            lambda s: transport.send_all(s, payload),
+            lambda s: _check(len(transport.recv_exactly(s, size) or b"")),
+            True,
+        ),
+    }
+
+    results = {}
+    for name, (send, recv, tune) in cases.items():
+        best = min(_run(send, recv, tune) for _ in range(repeat))
+        results[name] = size / best / 1e6
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark del transporte TCP (antiguo vs transport.py)")
+    ap.add_argument("--sizes", type=float, nargs="+", default=[2, 8, 32], help="tamaños de WAV en MB")
+    ap.add_argument("--repeat", type=int, default=3, help="repeticiones (se queda la mejor)")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="federico_bench_")
+    try:
+        print(f"{'WAV':>8}  {'variante':<16} {'MB/s':>9}  {'mejora':>7}")
+        for mb in args.sizes:
+            path = os.path.join(tmp, f"in_{mb:g}MB.wav")
+            out_path = os.path.join(tmp, "out.wav")
+            _make_wav(path, mb)
+            res = bench(path, out_path, args.repeat)
+            for kind in ("fichero", "memoria"):
+                old, new = res[f"{kind} antiguo"], res[f"{kind} nuevo"]
+                print(f"{mb:>6g}MB  {kind + ' antiguo':<16} {old:>9.1f}")
+                print(f"{'':>8}  {kind + ' nuevo':<16} {new:>9.1f}  {new / old:>6.1f}x")
+    finally:
+        for name in os.listdir(tmp):
+            os.remove(os.path.join(tmp, name))
+        os.rmdir(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# benchmarks/fake_backends.py
+# ====================================
+# Sustitutos locales de Ollama, Whisper y edge-tts para medir el servidor
+# sin red, sin GPU y sin descargar modelos:
+#  - FakeOllama: servidor HTTP en localhost con /api/chat y /api/generate
+#    (también "stream": true, NDJSON token a token). Tarda first_token_s
+#    en el primer token y token_s en cada uno de los siguientes
+#  - install_fake_asr(): asr_whisper transcribe con un coste fijo + un
+#    factor por segundo de audio (rtf) y devuelve un texto fijo (sin lotes
+#    y con el streaming por trozos, que son los que se pueden imitar)
+#  - install_fake_tts(): edge-tts tarda un coste fijo + uno por carácter y
+#    devuelve un WAV de duración proporcional al texto
+# Los costes son esperas (time.sleep / asyncio.sleep): sueltan el GIL como
+# CTranslate2 o un proceso externo, así que lo que se mide es el servidor.
+# ====================================
+
+from __future__ import annotations
+
+import asyncio
+import io
+import json
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import numpy as np
+
+DEFAULT_REPLY_WORDS = (
+    "claro", "que", "si", "te", "lo", "explico", "en", "pocas", "palabras",
+    "porque", "es", "bastante", "sencillo", "de", "entender", "al", "final",
+)
+
+
+def fake_reply(tokens: int) -> list[str]:
+    """Respuesta de 'tokens' palabras, con un punto cada 12 para que haya frases."""
+    out = []
+    for i in range(tokens):
+        word = DEFAULT_REPLY_WORDS[i % len(DEFAULT_REPLY_WORDS)]
+        if i == 0 or out[-1].endswith("."):
+            word = word.capitalize()
+        if (i + 1) % 12 == 0 or i == tokens - 1:
+            word += "."
+        out.append(word)
+    return out
+
+
+# ---------------------------------------------------------------
+# Ollama
+# ---------------------------------------------------------------
+class FakeOllama:
+    """Ollama de mentira en 127.0.0.1:<port> (0 => puerto libre). Ver .url."""
+
+    def __init__(self, first_token_s: float = 0.2, token_s: float = 0.03,
+                 tokens: int = 40, port: int = 0):
+        self.first_token_s = first_token_s
+        self.token_s = token_s
+        self.tokens = tokens
+        self.requests = 0
+        self._lock = threading.Lock()
+        fake = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    self.send_error(400)
+                    return
+                if self.path not in ("/api/chat", "/api/generate"):
+                    self.send_error(404)
+                    return
+                with fake._lock:
+                    fake.requests += 1
+                fake._answer(self, self.path == "/api/chat", payload)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeOllama":
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="fake-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _answer(self, handler: BaseHTTPRequestHandler, chat: bool, payload: dict):
+        words = fake_reply(self.tokens)
+        prompt = payload.get("messages") if chat else payload.get("prompt")
+        if prompt is None:
+            # Sin prompt Ollama solo carga el modelo (llm_ollama.preload)
+            body = json.dumps({"model": payload.get("model"), "done": True,
+                               "done_reason": "load"}).encode("utf-8")
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/json")
+            handler.send_header("Content-Length", str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+            return
+        usage = {"prompt_eval_count": len(json.dumps(prompt or "")) // 4,
+                 "eval_count": len(words)}
+
+        def _piece(text: str, done: bool) -> dict:
+            body = {"model": payload.get("model"), "done": done}
+            if chat:
+                body["message"] = {"role": "assistant", "content": text}
+            else:
+                body["response"] = text
+            if done:
+                body.update(usage)
+            return body
+
+        if payload.get("stream", True):
+            # NDJSON como Ollama: una línea por token y una final con done
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/x-ndjson")
+            handler.end_headers()
+            for i, word in enumerate(words):
+                time.sleep(self.first_token_s if i == 0 else self.token_s)
+                line = json.dumps(_piece(word if i == 0 else " " + word, False)) + "\n"
+                handler.wfile.write(line.encode("utf-8"))
+                handler.wfile.flush()
+            handler.wfile.write((json.dumps(_piece("", True)) + "\n").encode("utf-8"))
+            return
+
+        time.sleep(self.first_token_s + self.token_s * max(0, len(words) - 1))
+        body = json.dumps(_piece(" ".join(words), True)).encode("utf-8")
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+# ---------------------------------------------------------------
+# Whisper
+# ---------------------------------------------------------------
+def _audio_seconds(audio) -> float:
+    """Duración de lo que recibe asr_whisper._transcribe (array 16 kHz, ruta o BytesIO)."""
+    if isinstance(audio, np.ndarray):
+        return len(audio) / 16000
+    try:
+        with wave.open(audio if not isinstance(audio, io.BytesIO) else io.BytesIO(audio.getvalue()),
+                       "rb") as wf:
+            return wf.getnframes() / float(wf.getframerate() or 16000)
+    except (wave.Error, EOFError, OSError):
+        return 0.0
+
+
+def install_fake_asr(text: str, fixed_s: float = 0.05, rtf: float = 0.1):
+    """
+    Sustituye la inferencia de Whisper: tarda fixed_s + rtf * segundos de
+    audio y devuelve 'text'. El resto de asr_whisper (conversión de PCM,
+    transcripción por trozos en streaming) sigue siendo el real.
+    """
+    from server import asr_whisper
+    from server.tracing import span
+
+    def _transcribe(audio, language, size=None, out=None):
+        seconds = _audio_seconds(audio)
+        with span("whisper", language=language or "auto", model=size or asr_whisper.WHISPER_MODEL_SIZE,
+                  fake=True, audio_s=round(seconds, 2)):
+            time.sleep(fixed_s + rtf * seconds)
+        if out is not None:
+            # Autodetección: siempre español y seguro (para la caché de idioma)
+            out.update(language=language or "es", probability=0.99, avg_logprob=-0.2)
+        return text
+
+    asr_whisper._transcribe = _transcribe
+    asr_whisper.warm_up = lambda audio: _transcribe(audio, None)
+    # El coste de un lote no se imita con esperas: sin lotes (para medirlos, --asr real)
+    asr_whisper.WHISPER_BATCH_MAX = 1
+    # Un texto fijo no se puede ir confirmando por ventanas: streaming por trozos
+    asr_whisper.STREAM_ASR_MODE = "chunked"
+    # El modo prefork prepara los ficheros del modelo antes del fork
+    asr_whisper.preload_model_files = lambda: {}
+
+
+# ---------------------------------------------------------------
+# edge-tts
+# ---------------------------------------------------------------
+def install_fake_tts(fixed_s: float = 0.1, per_char_s: float = 0.002,
+                     audio_s_per_char: float = 0.06):
+    """
+    Sustituye el subproceso de edge-tts (síncrono y asíncrono): tarda
+    fixed_s + per_char_s por carácter y devuelve un WAV de 16 kHz mono de
+    audio_s_per_char segundos por carácter (un tono suave).
+    """
+    from server import tts_engine
+    from server.wav_utils import make_wav_bytes
+
+    def _wav(text: str) -> bytes:
+        n = int(16000 * audio_s_per_char * max(1, len(text)))
+        t = np.arange(n) / 16000
+        pcm = (800 * np.sin(2 * np.pi * 220 * t)).astype("<i2").tobytes()
+        return make_wav_bytes(pcm, 16000, 1)
+
+    def _cost(text: str) -> float:
+        return fixed_s + per_char_s * len(text)
+
+    def _edge_tts_bytes(text: str) -> Optional[bytes]:
+        time.sleep(_cost(text))
+        return _wav(text)
+
+    def _edge_tts_wav(text: str, out_wav_path: str) -> bool:
+        data = _edge_tts_bytes(text)
+        with open(out_wav_path, "wb") as f:
+            f.write(data)
+        return True
+
+    async def _run_edge_tts_async(text: str, out_wav_path: Optional[str]) -> Optional[bytes]:
+        await asyncio.sleep(_cost(text))
+        data = _wav(text)
+        if out_wav_path is None:
+            return data
+        with open(out_wav_path, "wb") as f:
+            f.write(data)
+        return b""
+
+    tts_engine.USE_EDGE_TTS = True
+    tts_engine._edge_tts_bytes = _edge_tts_bytes
+    tts_engine._edge_tts_wav = _edge_tts_wav
+    tts_engine._run_edge_tts_async = _run_edge_tts_async
@@ -0,0 +1,77 @@
+# benchmarks/load_server.py
+# ====================================
+# Arranca server.main con los sustitutos de fake_backends.py (lo lanza
+# bench_load.py en un proceso aparte, para que el generador de carga no le
+# quite el GIL al servidor).
+# Los valores de server/config.py se cambian ANTES de importar el resto del
+# servidor (los módulos copian las constantes al importarse), así que con
+# --set se puede probar cualquier ajuste sin tocar config.py:
+#   python -m benchmarks.load_server --port 5600 --ollama-url http://127.0.0.1:5601 \
+#       --set SERVER_MODE='"prefork"' --set PREFORK_PROCESSES=4
+# ====================================
+
+from __future__ import annotations
+
+import argparse
+import ast
+
+
+def _parse_set(items: list[str]) -> dict:
+    out = {}
+    for item in items:
+        name, sep, value = item.partition("=")
+        if not sep:
+            raise SystemExit(f"--set {item}: usa NOMBRE=valor (valor en sintaxis Python)")
+        try:
+            out[name.strip()] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            out[name.strip()] = value  # texto sin comillas
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Servidor con backends de prueba (para bench_load)")
+    ap.add_argument("--port", type=int, required=True)
+    ap.add_argument("--metrics-port", type=int, required=True)
+    ap.add_argument("--ollama-url", help="URL del FakeOllama (por defecto, OLLAMA_URL de config.py)")
+    ap.add_argument("--trace-file", required=True, help="JSONL donde el servidor deja sus trazas")
+    ap.add_argument("--asr", choices=("fake", "real"), default="fake")
+    ap.add_argument("--asr-text", default="¿Qué tiempo va a hacer mañana por la tarde?")
+    ap.add_argument("--asr-fixed-ms", type=float, default=50)
+    ap.add_argument("--asr-rtf", type=float, default=0.1, help="s de ASR por s de audio")
+    ap.add_argument("--tts", choices=("fake", "real"), default="fake")
+    ap.add_argument("--tts-fixed-ms", type=float, default=100)
+    ap.add_argument("--tts-char-ms", type=float, default=2)
+    ap.add_argument("--set", action="append", default=[], metavar="NOMBRE=valor",
+                    help="sobrescribe una constante de server/config.py")
+    args = ap.parse_args()
+
+    from server import config
+    overrides = {
+        "HOST": "127.0.0.1",
+        "PORT": args.port,
+        "METRICS_ENABLED": True,
+        "METRICS_PORT": args.metrics_port,
+        "TRACE_FILE": args.trace_file,
+        "LOG_LEVEL": "WARNING",
+    }
+    if args.ollama_url:
+        overrides["OLLAMA_URL"] = args.ollama_url
+    overrides.update(_parse_set(args.set))
+    for name, value in overrides.items():
+        if not hasattr(config, name):
+            raise SystemExit(f"server/config.py no tiene {name}")
+        setattr(config, name, value)
+
+    from benchmarks import fake_backends
+    if args.asr == "fake":
+        fake_backends.install_fake_asr(args.asr_text, args.asr_fixed_ms / 1000, args.asr_rtf)
+    if args.tts == "fake":
+        fake_backends.install_fake_tts(args.tts_fixed_ms / 1000, args.tts_char_ms / 1000)
+
+    from server import main as server_main
+    server_main.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+# benchmarks/replay_capture.py
+# ====================================
+# Repite contra el servidor un corpus capturado en producción
+# (CAPTURE_DIR, server/capture.py) y compara con lo que pasó entonces:
+#  - arranca el servidor como bench_load.py (otro proceso, --set para
+#    cambiar WHISPER_MODEL_SIZE, OLLAMA_MODEL, ...) y con la captura
+#    activada en una carpeta temporal, para saber qué hizo en cada turno
+#  - envía cada turno con su protocolo original: streaming (tramas al ritmo
+#    del audio, respuesta progresiva) o clásico (!Q + WAV), respetando los
+#    tiempos de llegada originales divididos por --speed
+#    (--speed 1: ritmo real · 10: diez veces más rápido · 0: uno tras otro)
+#  - cada turno repetido se empareja con el original por el puerto local de
+#    su conexión (el servidor lo guarda en "client")
+#    Cada turno va en su propia conexión y sin sesión: el LLM no ve el
+#    historial que tenía entonces, así que su respuesta puede cambiar igual
+#  - muestra cuántas transcripciones, decisiones (atajo/LLM/...) y
+#    respuestas cambiaron, y p50/p95 por etapa antes y ahora
+#  - --report guarda la comparación turno a turno en JSONL
+# Por defecto usa Whisper y Ollama de verdad (lo que se quiere comparar) y
+# edge-tts de prueba (no hace falta Internet); ver --asr/--tts/--llm.
+# Uso (desde Robot2.0/):
+#   python -m benchmarks.replay_capture capturas/ --speed 4 \
+#       --set WHISPER_MODEL_SIZE='"base"' [--report cambios.jsonl]
+# ====================================
+
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import os
+import re
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import time
+import wave
+
+from benchmarks.bench_load import add_server_args, start_server, stop_server, summary_ms
+from benchmarks.fake_backends import FakeOllama
+from server import capture, transport
+
+STREAM_MAGIC = b"FDSTRM01"
+RESP_STREAM_MAGIC = b"FDPCM001"
+CHUNK_HDR_FMT = "!IIH"
+FRAME_BYTES = 2048  # lo que manda StreamingUpload por trama (1024 muestras)
+CLIENT_TIMEOUT_S = 300
+
+_PORT_RE = re.compile(r"(\d+)\)?$")
+
+
+# ---------------------------------------------------------------
+# Envío de un turno
+# ---------------------------------------------------------------
+def _wav_bytes(pcm: bytes, sample_rate: int, channels: int) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(channels)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm)
+    return buf.getvalue()
+
+
+def _send_stream(sock: socket.socket, meta: dict, pcm: bytes, speed: float):
+    sr, ch = int(meta["sample_rate"]), int(meta["channels"])
+    hdr = json.dumps({"sample_rate": sr, "channels": ch, "sample_width": 2,
+                      "response": "pcm_stream", "codec": "pcm16"}).encode("utf-8")
+    transport.send_all(sock, STREAM_MAGIC, struct.pack("!I", len(hdr)), hdr)
+    frame_s = FRAME_BYTES / (2 * sr * ch)
+    t0 = time.perf_counter()
+    view = memoryview(pcm)
+    for n, i in enumerate(range(0, len(view), FRAME_BYTES)):
+        if speed > 0:
+            # Al ritmo al que se grabó (entre 'speed'): así el ASR por trozos trabaja igual
+            delay = t0 + n * frame_s / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        frame = view[i:i + FRAME_BYTES]
+        transport.send_all(sock, struct.pack("!I", len(frame)), frame)
+    sock.sendall(struct.pack("!I", 0))
+
+
+def _read_reply(sock: socket.socket) -> float:
+    """Lee la respuesta (WAV o progresiva). Devuelve el instante del primer byte."""
+    raw = transport.recv_exactly(sock, 8)
+    t_first = time.perf_counter()
+    if not raw:
+        raise ConnectionError("sin respuesta")
+    if raw == RESP_STREAM_MAGIC:
+        hdr_size = struct.calcsize(CHUNK_HDR_FMT)
+        while True:
+            hdr = transport.recv_exactly(sock, hdr_size)
+            if not hdr:
+                raise ConnectionError("respuesta progresiva cortada")
+            size = struct.unpack(CHUNK_HDR_FMT, hdr)[0]
+            if size == 0:
+                return t_first
+            if transport.recv_exactly(sock, size) is None:
+                raise ConnectionError("respuesta progresiva cortada")
+    size = struct.unpack("!Q", raw)[0]
+    if transport.recv_exactly(sock, size) is None:
+        raise ConnectionError("respuesta incompleta")
+    return t_first
+
+
+def replay_one(addr, meta: dict, audio: bytes, speed: float) -> dict:
+    """Un turno con su protocolo original. Devuelve puerto local y tiempos (s)."""
+    sock = socket.create_connection(addr, timeout=CLIENT_TIMEOUT_S)
+    try:
+        transport.tune_socket(sock)
+        port = sock.getsockname()[1]
+        t0 = time.perf_counter()
+        if meta.get("mode") == "stream" and meta.get("audio") != "file":
+            _send_stream(sock, meta, audio, speed)
+        else:
+            wav = audio if meta.get("audio") == "file" else _wav_bytes(
+                audio, int(meta["sample_rate"]), int(meta["channels"]))
+            transport.send_all(sock, struct.pack("!Q", len(wav)), wav)
+        t_sent = time.perf_counter()
+        t_first = _read_reply(sock)
+        t_end = time.perf_counter()
+    finally:
+        sock.close()
+    return {"port": port, "ttfb": t_first - t_sent, "e2e": t_end - t0}
+
+
+def replay(addr, records: list[tuple[dict, bytes]], speed: float) -> list[dict]:
+    """Lanza cada turno en su instante (relativo al primero, entre 'speed')."""
+    results: list[dict] = [{} for _ in records]
+    ts0 = records[0][0]["ts"]
+    start = time.perf_counter()
+
+    def _run(i: int):
+        meta, audio = records[i]
+        try:
+            results[i] = replay_one(addr, meta, audio, speed)
+        except Exception as e:
+            results[i] = {"error": f"{type(e).__name__}: {e}"}
+
+    if speed <= 0:
+        for i in range(len(records)):
+            _run(i)
+        return results
+
+    threads = []
+    for i, (meta, _) in enumerate(records):
+        delay = start + (meta["ts"] - ts0) / speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        th = threading.Thread(target=_run, args=(i,), daemon=True)
+        th.start()
+        threads.append(th)
+    for th in threads:
+        th.join()
+    return results
+
+
+# ---------------------------------------------------------------
+# Comparación
+# ---------------------------------------------------------------
+def _client_port(meta: dict) -> int | None:
+    m = _PORT_RE.search(str(meta.get("client") or ""))
+    return int(m.group(1)) if m else None
+
+
+def compare(records: list[tuple[dict, bytes]], results: list[dict], new_dir: str) -> list[dict]:
+    """Turno a turno: original frente a repetido (emparejados por puerto local)."""
+    by_port = {}
+    if os.path.isdir(new_dir):
+        for meta, _ in capture.read_records(new_dir):
+            by_port[_client_port(meta)] = meta
+    rows = []
+    for (old, _), res in zip(records, results):
+        new = by_port.get(res.get("port"), {})
+        rows.append({
+            "request_id": old.get("request_id"),
+            "replay_request_id": new.get("request_id"),
+            "error": res.get("error"),
+            "transcript": [old.get("transcript"), new.get("transcript")],
+            "decision": [old.get("decision"), new.get("decision")],
+            "reply_text": [old.get("reply_text"), new.get("reply_text")],
+            "total_ms": [old.get("total_ms"), new.get("total_ms")],
+            "timings_ms": [old.get("timings_ms") or {}, new.get("timings_ms") or {}],
+            "client_ttfb_ms": round(res["ttfb"] * 1000, 1) if "ttfb" in res else None,
+            "client_e2e_ms": round(res["e2e"] * 1000, 1) if "e2e" in res else None,
+        })
+    return rows
+
+
+def _norm(text) -> str:
+    return " ".join(str(text or "").lower().split())
+
+
+def print_report(rows: list[dict], show: int):
+    done = [r for r in rows if not r["error"] and r["replay_request_id"]]
+    print(f"\nTurnos: {len(rows)} · repetidos {len(done)} · errores "
+          f"{sum(1 for r in rows if r['error'])} · sin emparejar "
+          f"{sum(1 for r in rows if not r['error'] and not r['replay_request_id'])}")
+    if not done:
+        return
+    for key, label in (("transcript", "transcripción"), ("decision", "decisión"),
+                       ("reply_text", "respuesta")):
+        changed = [r for r in done if _norm(r[key][0]) != _norm(r[key][1])]
+        print(f"   {label:<14} cambia en {len(changed)}/{len(done)}")
+
+    stages = sorted({s for r in done for t in r["timings_ms"] for s in t})
+    print(f"\n   {'etapa':<14}{'p50 antes':>11}{'p50 ahora':>11}{'p95 antes':>11}{'p95 ahora':>11}")
+    for stage in ["total"] + stages:
+        if stage == "total":
+            old = [r["total_ms"][0] / 1000 for r in done if r["total_ms"][0] is not None]
+            new = [r["total_ms"][1] / 1000 for r in done if r["total_ms"][1] is not None]
+        else:
+            old = [r["timings_ms"][0][stage] / 1000 for r in done if stage in r["timings_ms"][0]]
+            new = [r["timings_ms"][1][stage] / 1000 for r in done if stage in r["timings_ms"][1]]
+        a, b = summary_ms(old), summary_ms(new)
+        print(f"   {stage:<14}{a['p50']:>11.1f}{b['p50']:>11.1f}{a['p95']:>11.1f}{b['p95']:>11.1f}")
+
+    diffs = [r for r in done if _norm(r["transcript"][0]) != _norm(r["transcript"][1])]
+    for r in diffs[:show]:
+        print(f"\n   [{r['request_id']}] antes: {r['transcript'][0]!r}")
+        print(f"   {'':>{len(r['request_id']) + 2}} ahora: {r['transcript'][1]!r}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Repite un corpus capturado y compara con el original")
+    ap.add_argument("corpus", help="carpeta (o fichero .fdcap) de CAPTURE_DIR")
+    ap.add_argument("--speed", type=float, default=1.0,
+                    help="1 = ritmo original, N = N veces más rápido, 0 = uno tras otro")
+    ap.add_argument("--limit", type=int, default=0, help="solo los N primeros turnos")
+    ap.add_argument("--llm", choices=("real", "fake"), default="real",
+                    help="Ollama de config.py (o --ollama-url) o el de prueba")
+    ap.add_argument("--ollama-url", help="Ollama con el que repetir (por defecto, el de config.py)")
+    add_server_args(ap, asr="real", tts="fake")
+    ap.add_argument("--report", help="JSONL con la comparación turno a turno")
+    ap.add_argument("--show", type=int, default=5, help="transcripciones distintas a mostrar")
+    ap.add_argument("--keep", action="store_true", help="no borrar la captura y el log del servidor")
+    args = ap.parse_args()
+
+    records = sorted(capture.read_records(args.corpus), key=lambda r: r[0].get("ts", 0))
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        raise SystemExit(f"{args.corpus}: no hay turnos capturados")
+    span_s = records[-1][0]["ts"] - records[0][0]["ts"]
+    print(f"{len(records)} turno(s) capturados en {span_s:.0f} s; "
+          f"repitiendo a {'máxima velocidad, uno tras otro' if args.speed <= 0 else f'x{args.speed:g}'}")
+
+    workdir = tempfile.mkdtemp(prefix="federico_replay_")
+    new_dir = os.path.join(workdir, "capture")
+    args.set = args.set + [f"CAPTURE_DIR={new_dir!r}"]
+    ollama = FakeOllama().start() if args.llm == "fake" else None
+    proc, addr, _ = start_server(args, ollama.url if ollama else args.ollama_url, workdir)
+    try:
+        results = replay(addr, records, args.speed)
+    finally:
+        stop_server(proc)  # al salir, el servidor vacía su captura
+        if ollama is not None:
+            ollama.stop()
+
+    rows = compare(records, results, new_dir)
+    print_report(rows, args.show)
+    for err in sorted({r["error"] for r in rows if r["error"]})[:5]:
+        print(f"   error: {err}")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            for r in rows:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        print(f"\nComparación guardada en {args.report}")
+    if args.keep:
+        print(f"Captura y log del servidor en {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# benchmarks/transcribe_bulk.py
+# ====================================
+# Transcripción masiva de WAVs grabados (para análisis), sin servidor
+#  - entrada: una carpeta (se buscan *.wav en subcarpetas) o un manifiesto:
+#    .txt con una ruta por línea o .jsonl con {"path": ...} (rutas relativas
+#    al manifiesto)
+#  - --processes procesos con --threads hilos de CTranslate2 cada uno; cada
+#    proceso carga su propio modelo y transcribe con server/asr_whisper.py
+#    (recorte de silencio incluido, como el servidor)
+#  - cada resultado se escribe en el JSONL de salida en cuanto termina; si
+#    se corta (Ctrl+C, caída), volver a lanzarlo con la misma salida sigue
+#    donde se quedó (--retry-errors repite también los que fallaron)
+#  - progreso y rendimiento en horas de audio por hora de reloj
+# Uso (desde Robot2.0/):
+#   python -m benchmarks.transcribe_bulk grabaciones/ -o transcripciones.jsonl \
+#       [--processes 4 --threads 2] [--set WHISPER_MODEL_SIZE='"base"']
+# ====================================
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import wave
+
+from benchmarks.load_server import _parse_set
+
+PROGRESS_EVERY_S = 10.0
+
+_language = None
+_init_error = None
+
+
+# ---------------------------------------------------------------
+# Entrada y reanudación
+# ---------------------------------------------------------------
+def list_inputs(source: str) -> list[str]:
+    """Rutas de los WAV de una carpeta (recursivo) o de un manifiesto .txt/.jsonl."""
+    if os.path.isdir(source):
+        paths = []
+        for root, _, names in os.walk(source):
+            paths += [os.path.join(root, n) for n in names if n.lower().endswith(".wav")]
+        return sorted(paths)
+
+    base = os.path.dirname(os.path.abspath(source))
+    paths = []
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            path = json.loads(line)["path"] if source.lower().endswith(".jsonl") else line
+            paths.append(path if os.path.isabs(path) else os.path.join(base, path))
+    return paths
+
+
+def done_paths(output: str, retry_errors: bool) -> set[str]:
+    """Rutas que ya están en 'output' (las que fallaron, solo sin --retry-errors)."""
+    done: set[str] = set()
+    if not os.path.isfile(output):
+        return done
+    with open(output, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue  # última línea a medias si se cortó escribiendo
+            if retry_errors and row.get("error"):
+                continue
+            done.add(row["path"])
+    return done
+
+
+def _open_output(output: str):
+    """Abre 'output' para añadir, empezando en línea nueva si la última quedó a medias."""
+    if os.path.isfile(output) and os.path.getsize(output):
+        with open(output, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            partial_line = f.read(1) != b"\n"
+        out = open(output, "a", encoding="utf-8")
+        if partial_line:
+            out.write("\n")
+        return out
+    return open(output, "a", encoding="utf-8")
+
+
+# ---------------------------------------------------------------
+# Procesos de trabajo
+# ---------------------------------------------------------------
+def _init_worker(overrides: dict, threads: int, language):
+    """
+    Configura y carga el modelo una vez por proceso. Un fallo aquí no se
+    lanza (Pool relanzaría el proceso sin fin): lo devuelve _transcribe_one().
+    """
+    global _language, _init_error
+    from server import config
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    config.WHISPER_MODEL_POOL = (config.WHISPER_MODEL_SIZE,)
+    config.WHISPER_WORKERS = 1
+    config.WHISPER_BATCH_MAX = 1
+    config.METRICS_ENABLED = False
+    config.TRACE_FILE = None
+    config.LOG_LEVEL = "WARNING"
+    _language = config.WHISPER_LANGUAGE if language is None else (None if language == "auto" else language)
+    try:
+        from server import asr_whisper
+        asr_whisper.set_cpu_threads(threads)
+        asr_whisper.get_model()
+    except Exception as e:
+        _init_error = f"{type(e).__name__}: {e}"
+
+
+def _transcribe_one(path: str) -> dict:
+    row = {"path": path, "worker": os.getpid()}
+    if _init_error:
+        return dict(row, error=_init_error, fatal=True)
+    from server import asr_whisper
+    try:
+        with wave.open(path, "rb") as wf:
+            row["audio_s"] = round(wf.getnframes() / float(wf.getframerate() or 1), 3)
+        t0 = time.perf_counter()
+        row["text"] = asr_whisper.transcribe_wav(path, _language)
+        row["compute_s"] = round(time.perf_counter() - t0, 3)
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+    return row
+
+
+# ---------------------------------------------------------------
+# Principal
+# ---------------------------------------------------------------
+def _rate(audio_s: float, wall_s: float) -> str:
+    return f"{audio_s / wall_s:.1f} h de audio/h" if wall_s > 0 else "-"
+
+
+def main():
+    cores = os.cpu_count() or 1
+    ap = argparse.ArgumentParser(description="Transcripción masiva de WAVs con varios procesos")
+    ap.add_argument("source", help="carpeta con WAVs o manifiesto (.txt / .jsonl)")
+    ap.add_argument("-o", "--output", required=True, help="JSONL de resultados (se reanuda si existe)")
+    ap.add_argument("--threads", type=int, default=2 if cores >= 4 else 1,
+                    help="hilos de CTranslate2 por proceso")
+    ap.add_argument("--processes", type=int, help="procesos (por defecto: núcleos / --threads)")
+    ap.add_argument("--language", help='idioma ("auto" => autodetección); por defecto WHISPER_LANGUAGE')
+    ap.add_argument("--retry-errors", action="store_true", help="repite los que fallaron la otra vez")
+    ap.add_argument("--set", action="append", default=[], metavar="NOMBRE=valor",
+                    help="sobrescribe una constante de server/config.py")
+    args = ap.parse_args()
+
+    from server import config
+    overrides = _parse_set(args.set)
+    for name in overrides:
+        if not hasattr(config, name):
+            raise SystemExit(f"server/config.py no tiene {name}")
+
+    paths = list_inputs(args.source)
+    done = done_paths(args.output, args.retry_errors)
+    todo = [p for p in paths if p not in done]
+    processes = max(1, min(args.processes or cores // max(1, args.threads), len(todo) or 1))
+    print(f"{len(paths)} WAV · {len(paths) - len(todo)} ya hechos · {len(todo)} pendientes · "
+          f"{processes} procesos x {args.threads} hilos")
+    if not todo:
+        return
+
+    ok = errors = 0
+    audio_s = 0.0
+    t0 = time.perf_counter()
+    last_report = t0
+    pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                initargs=(overrides, args.threads, args.language))
+    try:
+        with _open_output(args.output) as out:
+            for row in pool.imap_unordered(_transcribe_one, todo):
+                if row.get("fatal"):
+                    pool.terminate()
+                    raise SystemExit(f"No se pudo cargar el modelo: {row['error']}")
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                out.flush()
+                if row.get("error"):
+                    errors += 1
+                    print(f"   error en {row['path']}: {row['error']}")
+                else:
+                    ok += 1
+                    audio_s += row["audio_s"]
+                now = time.perf_counter()
+                if now - last_report >= PROGRESS_EVERY_S:
+                    last_report = now
+                    print(f"   {ok + errors}/{len(todo)} · {audio_s / 3600:.2f} h de audio · "
+                          f"{_rate(audio_s, now - t0)}", flush=True)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        print(f"\nInterrumpido: {ok + errors} escritos en {args.output}; relánzalo para seguir.")
+        return
+    finally:
+        pool.join()
+
+    wall_s = time.perf_counter() - t0
+    print(f"\nHecho: {ok} transcritos, {errors} errores, {audio_s / 3600:.2f} h de audio en "
+          f"{wall_s / 60:.1f} min ({_rate(audio_s, wall_s)}) -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+# benchmarks/tune_asr.py
+# ====================================
+# Afinador de Whisper sobre un corpus local de WAVs con su transcripción
+# (cada audio.wav con un audio.txt al lado):
+#  - recorre la rejilla de tamaño de modelo, compute_type, hilos, beam y VAD
+#    (--sizes, --compute-types, --threads, --beams, --vad-silence-ms,
+#    --vad-thresholds); cada modelo en su propio proceso (el pico de memoria
+#    es el suyo y los hilos de CTranslate2 no se heredan)
+#  - transcribe con server/asr_whisper.py tal cual lo usa el servidor
+#    (recorte de silencio incluido) y mide el factor de tiempo real (s de
+#    cálculo / s de audio), el pico de RSS del proceso y el WER
+#  - muestra el frente de Pareto (nadie es a la vez más rápido, más preciso
+#    y más ligero) y elige el más rápido con un WER de hasta --wer-slack por
+#    encima del mejor (y, si se pide, con RSS <= --max-rss-mb)
+#  - guarda la elección en server/asr_tuned.json (ASR_TUNED_FILE), que
+#    config.py carga al arrancar; --dry-run solo mide
+# Uso (desde Robot2.0/, con la máquina tranquila):
+#   python -m benchmarks.tune_asr corpus/ [--sizes tiny,base,small] \
+#       [--report resultados.jsonl] [--dry-run]
+# ====================================
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+import unicodedata
+import wave
+
+try:
+    import resource  # no existe en Windows: sin pico de RSS
+except ImportError:
+    resource = None
+
+_WORD_RE = re.compile(r"\w+")
+
+
+# ---------------------------------------------------------------
+# Corpus y WER
+# ---------------------------------------------------------------
+def load_corpus(folder: str) -> list[dict]:
+    """[{path, reference, seconds}] de los WAV de 'folder' que tienen su .txt."""
+    items = []
+    for name in sorted(os.listdir(folder)):
+        if not name.lower().endswith(".wav"):
+            continue
+        path = os.path.join(folder, name)
+        ref_path = os.path.splitext(path)[0] + ".txt"
+        if not os.path.isfile(ref_path):
+            print(f"   (sin {os.path.basename(ref_path)}: se salta {name})")
+            continue
+        with open(ref_path, encoding="utf-8") as f:
+            reference = f.read().strip()
+        with wave.open(path, "rb") as wf:
+            seconds = wf.getnframes() / float(wf.getframerate() or 1)
+        items.append({"path": path, "reference": reference, "seconds": seconds})
+    return items
+
+
+def words(text: str) -> list[str]:
+    """Palabras en minúsculas y sin puntuación (lo que compara el WER)."""
+    return _WORD_RE.findall(unicodedata.normalize("NFKC", text).lower())
+
+
+def edit_distance(ref: list[str], hyp: list[str]) -> int:
+    """Sustituciones + borrados + inserciones para pasar de 'ref' a 'hyp'."""
+    prev = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        cur = [i] + [0] * len(hyp)
+        for j, h in enumerate(hyp, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (r != h))
+        prev = cur
+    return prev[-1]
+
+
+# ---------------------------------------------------------------
+# Medida de un modelo (proceso hijo: --worker)
+# ---------------------------------------------------------------
+def _peak_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes en macOS, KB en Linux
+
+
+def run_worker(job: dict):
+    """
+    Carga un modelo (size, compute_type, threads) y transcribe el corpus con
+    cada combinación de beam y VAD. Una línea JSON por combinación en stdout.
+    """
+    from server import config
+    config.WHISPER_MODEL_SIZE = job["size"]
+    config.WHISPER_COMPUTE_TYPE = job["compute_type"]
+    config.WHISPER_MODEL_POOL = (job["size"],)
+    config.WHISPER_WORKERS = 1
+    config.WHISPER_BATCH_MAX = 1
+    config.METRICS_ENABLED = False
+    config.TRACE_FILE = None
+    config.LOG_LEVEL = "WARNING"
+
+    from server import asr_whisper
+    asr_whisper.set_cpu_threads(job["threads"])
+    corpus = job["corpus"]
+    language = job["language"]
+
+    t0 = time.perf_counter()
+    asr_whisper.get_model()
+    asr_whisper.transcribe_wav(corpus[0]["path"], language)  # sin contar: primera pasada en frío
+    load_s = time.perf_counter() - t0
+
+    audio_s = sum(item["seconds"] for item in corpus)
+    ref_words = sum(len(words(item["reference"])) for item in corpus) or 1
+    for beam, silence_ms, threshold in itertools.product(job["beams"], job["vad_silence_ms"],
+                                                         job["vad_thresholds"]):
+        asr_whisper.WHISPER_BEAM_SIZE = beam
+        asr_whisper.WHISPER_VAD_MIN_SILENCE_MS = silence_ms
+        asr_whisper.WHISPER_VAD_THRESHOLD = threshold
+        compute_s = 0.0
+        errors = 0
+        for item in corpus:
+            t0 = time.perf_counter()
+            text = asr_whisper.transcribe_wav(item["path"], language)
+            compute_s += time.perf_counter() - t0
+            errors += edit_distance(words(item["reference"]), words(text))
+        print(json.dumps({
+            "settings": {
+                "WHISPER_MODEL_SIZE": job["size"],
+                "WHISPER_COMPUTE_TYPE": job["compute_type"],
+                "WHISPER_CPU_THREADS": job["threads"],
+                "WHISPER_BEAM_SIZE": beam,
+                "WHISPER_VAD_MIN_SILENCE_MS": silence_ms,
+                "WHISPER_VAD_THRESHOLD": threshold,
+            },
+            "rtf": compute_s / audio_s if audio_s else 0.0,
+            "wer": errors / ref_words,
+            "rss_mb": _peak_rss_mb(),
+            "load_s": load_s,
+        }), flush=True)
+
+
+def measure(job: dict) -> list[dict]:
+    """Lanza run_worker() en otro proceso y recoge sus resultados."""
+    proc = subprocess.run(
+        [sys.executable, "-m", "benchmarks.tune_asr", "--worker", json.dumps(job)],
+        capture_output=True, text=True,
+    )
+    rows = [json.loads(line) for line in proc.stdout.splitlines() if line.startswith("{")]
+    if proc.returncode != 0:
+        last = (proc.stderr.strip().splitlines() or ["?"])[-1]
+        print(f"   error con {job['size']}/{job['compute_type']}/{job['threads']} hilos: {last}")
+    return rows
+
+
+# ---------------------------------------------------------------
+# Frente de Pareto y elección
+# ---------------------------------------------------------------
+def _costs(row: dict) -> tuple:
+    return row["rtf"], row["wer"], row["rss_mb"] or 0.0
+
+
+def pareto_front(rows: list[dict]) -> list[dict]:
+    """Filas que ninguna otra mejora en RTF, WER y RSS a la vez."""
+    front = []
+    for row in rows:
+        c = _costs(row)
+        dominated = any(
+            all(o <= m for o, m in zip(_costs(other), c)) and _costs(other) != c
+            for other in rows
+        )
+        if not dominated:
+            front.append(row)
+    return sorted(front, key=lambda r: r["rtf"])
+
+
+def choose(front: list[dict], wer_slack: float, max_rss_mb: float | None) -> dict | None:
+    """La más rápida del frente con WER <= mejor WER + wer_slack (y RSS <= max_rss_mb)."""
+    fits = [r for r in front if max_rss_mb is None or (r["rss_mb"] or 0.0) <= max_rss_mb]
+    if not fits:
+        return None
+    best_wer = min(r["wer"] for r in fits)
+    return min((r for r in fits if r["wer"] <= best_wer + wer_slack), key=lambda r: r["rtf"])
+
+
+def _label(row: dict) -> str:
+    s = row["settings"]
+    return (f"{s['WHISPER_MODEL_SIZE']:<9}{s['WHISPER_COMPUTE_TYPE']:<14}{s['WHISPER_CPU_THREADS']:>3} hilos"
+            f"  beam {s['WHISPER_BEAM_SIZE']}  vad {s['WHISPER_VAD_MIN_SILENCE_MS']} ms"
+            f"/{s['WHISPER_VAD_THRESHOLD']}")
+
+
+def _print_rows(rows: list[dict], front: list[dict], chosen: dict | None):
+    print(f"\n   {'':2}{'ajustes':<62}{'RTF':>7}{'WER':>8}{'RSS MB':>8}")
+    for row in sorted(rows, key=lambda r: r["rtf"]):
+        mark = "->" if row is chosen else (" *" if row in front else "  ")
+        rss = f"{row['rss_mb']:.0f}" if row["rss_mb"] is not None else "n/d"
+        print(f"   {mark}{_label(row):<62}{row['rtf']:>7.3f}{row['wer']:>8.3f}{rss:>8}")
+    print("   (* frente de Pareto · -> elegido)")
+
+
+def _csv(value: str, cast=str) -> list:
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Afinador de Whisper sobre un corpus de WAVs con transcripción")
+    ap.add_argument("corpus", nargs="?", help="carpeta con audio.wav + audio.txt")
+    ap.add_argument("--sizes", default="tiny,base,small")
+    ap.add_argument("--compute-types", default="int8,float32")
+    ap.add_argument("--threads", help="hilos de CTranslate2 (por defecto: todos los núcleos y la mitad)")
+    ap.add_argument("--beams", default="1,5")
+    ap.add_argument("--vad-silence-ms", default="300,500")
+    ap.add_argument("--vad-thresholds", default="0.5")
+    ap.add_argument("--language", help='idioma ("auto" => autodetección); por defecto WHISPER_LANGUAGE')
+    ap.add_argument("--max-files", type=int, help="solo los N primeros WAV (pruebas rápidas)")
+    ap.add_argument("--wer-slack", type=float, default=0.02,
+                    help="WER que se acepta perder frente al mejor a cambio de velocidad")
+    ap.add_argument("--max-rss-mb", type=float, help="descarta lo que pase de esta memoria")
+    ap.add_argument("--output", help="JSON con la elección (por defecto ASR_TUNED_FILE de config.py)")
+    ap.add_argument("--report", help="todas las medidas en JSONL")
+    ap.add_argument("--dry-run", action="store_true", help="mide y muestra, sin escribir la elección")
+    ap.add_argument("--worker", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        run_worker(json.loads(args.worker))
+        return
+    if not args.corpus:
+        ap.error("falta la carpeta del corpus")
+
+    from server import config
+    corpus = load_corpus(args.corpus)[: args.max_files]
+    if not corpus:
+        raise SystemExit(f"{args.corpus}: no hay WAVs con su .txt")
+    language = config.WHISPER_LANGUAGE if args.language is None else args.language
+    language = None if language == "auto" else language
+    cores = os.cpu_count() or 1
+    threads = _csv(args.threads, int) if args.threads else sorted({cores, max(1, cores // 2)})
+    audio_s = sum(item["seconds"] for item in corpus)
+    print(f"Corpus: {len(corpus)} WAV, {audio_s / 60:.1f} min · idioma {language or 'auto'} · "
+          f"{cores} núcleos")
+
+    rows: list[dict] = []
+    for size, compute_type, n in itertools.product(_csv(args.sizes), _csv(args.compute_types), threads):
+        print(f"   {size} / {compute_type} / {n} hilos ...", flush=True)
+        rows += measure({
+            "size": size, "compute_type": compute_type, "threads": n, "language": language,
+            "beams": _csv(args.beams, int), "vad_silence_ms": _csv(args.vad_silence_ms, int),
+            "vad_thresholds": _csv(args.vad_thresholds, float), "corpus": corpus,
+        })
+    if not rows:
+        raise SystemExit("Ninguna combinación se pudo medir.")
+
+    front = pareto_front(rows)
+    chosen = choose(front, args.wer_slack, args.max_rss_mb)
+    _print_rows(rows, front, chosen)
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(dict(row, pareto=row in front), ensure_ascii=False) + "\n")
+        print(f"\nMedidas guardadas en {args.report}")
+    if chosen is None:
+        raise SystemExit(f"\nNada cabe en --max-rss-mb {args.max_rss_mb}: no se escribe nada.")
+    if args.dry_run:
+        return
+
+    output = args.output or config.ASR_TUNED_FILE
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "settings": chosen["settings"],
+            "measured": {k: chosen[k] for k in ("rtf", "wer", "rss_mb")},
+            "corpus": {"files": len(corpus), "audio_s": round(audio_s, 1), "language": language},
+            "machine": {"cpus": cores, "platform": platform.platform()},
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+    print(f"\nElección guardada en {output}: el servidor la carga al arrancar.")
+
+
+if __name__ == "__main__":
+    main()
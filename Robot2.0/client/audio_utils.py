@@ -3,6 +3,8 @@
 # Utilidades de grabación y reproducción de audio
 # ====================================
 
+import queue
+import threading
 import time
 import numpy as np
 import sounddevice as sd
@@ -28,12 +30,24 @@ def _rms(audio_chunk: np.ndarray) -> float:
     audio = audio_chunk.astype(np.float32) / 32768.0
     return float(np.sqrt(np.mean(np.square(audio))))
 
+def _flush_frames(frames: list, streamed: int,
+                  on_frames: Optional[Callable[[bytes], None]]) -> int:
+    """Entrega a on_frames los bloques aún no enviados; devuelve cuántos van."""
+    if on_frames:
+        for f in frames[streamed:]:
+            on_frames(f.tobytes())
+    return len(frames)
+
 def record_audio(filename: str, use_vad: bool = False,
-                 should_stop: Optional[Callable[[], bool]] = None) -> str:
+                 should_stop: Optional[Callable[[], bool]] = None,
+                 on_frames: Optional[Callable[[bytes], None]] = None) -> str:
     """
     Graba audio desde el micro y lo guarda en WAV PCM16.
     - use_vad=True: corta por silencio (VAD simple).
     - should_stop(): función opcional que, si devuelve True, cancela de inmediato.
+    - on_frames(pcm): función opcional que recibe los bloques PCM16 según se
+      graban (subida en streaming). Con VAD empieza al detectar voz, enviando
+      de golpe lo grabado hasta entonces.
     Devuelve la ruta del WAV o cadena vacía si se canceló sin datos.
     """
     msg_lim = f"máx {RECORD_MAX_SECONDS} s" if not use_vad else "corta por silencio"
@@ -44,6 +58,7 @@ def record_audio(filename: str, use_vad: bool = False,
         blocksize=CHUNK, device=INPUT_DEVICE_INDEX
     )
     frames = []
+    streamed = 0  # bloques ya entregados a on_frames
     with stream:
         start_time = time.time()
         voiced = False
@@ -59,6 +74,8 @@ def record_audio(filename: str, use_vad: bool = False,
 
             data, _ = stream.read(CHUNK)
             frames.append(data.copy())
+            if on_frames and (voiced or not use_vad):
+                streamed = _flush_frames(frames, streamed, on_frames)
 
             if use_vad:
                 level = _rms(data)
@@ -93,6 +110,8 @@ def record_audio(filename: str, use_vad: bool = False,
     # Si no hay muestras, devolvemos vacío (cancelado o fallo)
     if not frames:
         return ""
+    if on_frames:
+        _flush_frames(frames, streamed, on_frames)
 
     # Convertimos a WAV
     wav_path = filename
@@ -144,3 +163,57 @@ def play_audio_file(path: str = RESPONSE_WAV):
             os.system(f'start "" "{path}"')
     except Exception as e:
         print("[Audio] No se pudo reproducir:", e)
+
+
+class PcmStreamPlayer:
+    """
+    Reproduce la respuesta progresiva según llega: feed() encola cada frase
+    (PCM16) y un hilo la escribe en un OutputStream de sounddevice, así la red
+    puede seguir recibiendo mientras suena la primera frase.
+    """
+
+    def __init__(self):
+        self._q: "queue.Queue" = queue.Queue()
+        self._thread = None
+        self.received = False
+
+    def feed(self, pcm: bytes, sample_rate: int, channels: int):
+        self.received = True
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._q.put((pcm, sample_rate, channels))
+
+    def _run(self):
+        stream = None
+        fmt = None
+        try:
+            while True:
+                item = self._q.get()
+                if item is None:
+                    break
+                pcm, sr, ch = item
+                if (sr, ch) != fmt:
+                    # Cambio de formato (p. ej. una frase por pyttsx3): reabrir
+                    if stream is not None:
+                        stream.stop()
+                        stream.close()
+                    stream = sd.OutputStream(samplerate=sr, channels=ch, dtype="int16")
+                    stream.start()
+                    fmt = (sr, ch)
+                stream.write(np.frombuffer(pcm, dtype=np.int16).reshape(-1, ch))
+        except Exception as e:
+            print("[Audio] Error reproduciendo en streaming:", e)
+        finally:
+            if stream is not None:
+                try:
+                    stream.stop()  # espera a que suene lo pendiente
+                    stream.close()
+                except Exception:
+                    pass
+
+    def wait(self):
+        """Espera a que termine de sonar todo lo recibido."""
+        if self._thread is not None:
+            self._q.put(None)
+            self._thread.join()
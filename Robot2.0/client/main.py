@@ -10,7 +10,8 @@ import platform
 
 from .config import (
     RESPONSE_WAV, SERVER_HOST, SERVER_PORT,
-    PRINT_LEVEL, debug_enabled, RECORDING_WAV
+    PRINT_LEVEL, debug_enabled, RECORDING_WAV, STREAM_UPLOAD, STREAM_RESPONSE,
+    PERSISTENT_SESSION,
 )
 from . import audio_utils
 from . import network_utils
@@ -45,10 +46,11 @@ def _enter_pressed_nonblocking() -> bool:
     except Exception:
         return False
 
-def _process_one_turn(active_flag_ref) -> bool:
+def _process_one_turn(active_flag_ref, session=None) -> bool:
     """
     Captura 1 locución (VAD), la envía al servidor y reproduce la respuesta.
     active_flag_ref: dict con {"active": bool} para poder desactivar desde el callback.
+    session: network_utils.ServerSession para reutilizar la conexión (o None).
     """
     def should_stop_cb():
         # Si se pulsa ENTER durante la grabación -> desactivar y cortar ya
@@ -58,14 +60,23 @@ def _process_one_turn(active_flag_ref) -> bool:
         return False
 
     user_wav = RECORDING_WAV
-    wav_path = audio_utils.record_audio(user_wav, use_vad=True, should_stop=should_stop_cb)
+    # En streaming el audio sale hacia el servidor mientras se graba
+    upload = network_utils.StreamingUpload(session) if STREAM_UPLOAD else None
+    wav_path = audio_utils.record_audio(
+        user_wav, use_vad=True, should_stop=should_stop_cb,
+        on_frames=upload.send_pcm if upload else None,
+    )
 
     # Si nos desactivamos durante la grabación, no seguimos
     if not active_flag_ref.get("active", False):
+        if upload:
+            upload.abort()
         print("\n⏸️  Estado: INACTIVO. Pulsa ENTER para ACTIVAR la escucha.\n")
         return False
 
     if not wav_path:
+        if upload:
+            upload.abort()
         print("⚠️  Grabación vacía/cancelada. Reintentando…\n")
         time.sleep(0.2)
         return False
@@ -74,15 +85,28 @@ def _process_one_turn(active_flag_ref) -> bool:
     if debug_enabled():
         print(f"[🎛️] WAV capturado: {user_wav} ({size} bytes)")
 
-    print("[NET] Enviando al servidor…")
-    ok = network_utils.send_audio_and_get_reply(user_wav, RESPONSE_WAV)
+    player = None
+    if upload:
+        print("[NET] Terminando envío al servidor…")
+        # Con respuesta progresiva la primera frase suena mientras llegan las demás
+        player = audio_utils.PcmStreamPlayer() if STREAM_RESPONSE else None
+        ok = upload.finish_and_get_reply(RESPONSE_WAV, on_pcm=player.feed if player else None)
+        if player:
+            player.wait()
+    else:
+        print("[NET] Enviando al servidor…")
+        if session:
+            ok = session.send_audio_and_get_reply(user_wav, RESPONSE_WAV)
+        else:
+            ok = network_utils.send_audio_and_get_reply(user_wav, RESPONSE_WAV)
     if not ok:
         print("⚠️  Error al comunicar con el servidor.\n")
         time.sleep(0.4)
         return False
 
-    print("[Asistente] ▶ Reproduciendo respuesta…")
-    audio_utils.play_audio_file(RESPONSE_WAV)
+    if not (player and player.received):
+        print("[Asistente] ▶ Reproduciendo respuesta…")
+        audio_utils.play_audio_file(RESPONSE_WAV)
     print()
     return True
 
@@ -94,6 +118,8 @@ def main():
 
     # Arranca en INACTIVO
     state = {"active": False}
+    # Conexión persistente (se abre en el primer turno y se reutiliza)
+    session = network_utils.ServerSession() if PERSISTENT_SESSION else None
     print("⏸️  Estado: INACTIVO. Pulsa ENTER para ACTIVAR la escucha.")
 
     try:
@@ -117,12 +143,14 @@ def main():
 
             # Activo: un turno (captura -> envía -> reproduce).
             # Durante la captura también podrás pulsar ENTER para parar.
-            _process_one_turn(state)
+            _process_one_turn(state, session)
 
             # Si se desactivó durante la captura, ya imprimió el mensaje y aquí seguimos inactivos
 
     except KeyboardInterrupt:
         print("\n👋 Cliente terminado.")
+        if session:
+            session.close()
         sys.exit(0)
 
 if __name__ == "__main__":
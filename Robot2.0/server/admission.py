@@ -0,0 +1,194 @@
+# server/admission.py
+# ====================================
+# Control de admisión para las etapas pesadas (Whisper y LLM)
+#  - ADMISSION_MAX_ACTIVE plazas; quien llega sin plaza espera en una cola
+#    de ADMISSION_MAX_QUEUE como mucho ADMISSION_MAX_WAIT_S
+#  - la cola es por prioridad: PRIORITY_ASR antes que PRIORITY_LLM, así una
+#    petición que resuelve commands.handle_intents (solo necesita el ASR)
+#    adelanta a las que esperan al LLM
+#  - cola llena o espera agotada => Busy al momento, para contestar con el
+#    audio de "estoy ocupado" en vez de dejar que el cliente agote su timeout
+#  - stats(): plazas ocupadas, profundidad de la cola y descartes
+# Sirve para hilos (slot) y para asyncio (slot_async) con el mismo estado.
+# ====================================
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Dict, Optional
+
+try:
+    from .config import ADMISSION_MAX_ACTIVE, ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT_S
+    from .tracing import log
+except ImportError:
+    from config import ADMISSION_MAX_ACTIVE, ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT_S
+    from tracing import log
+
+PRIORITY_ASR = 0
+PRIORITY_LLM = 1
+
+
+class Busy(Exception):
+    """No hay plaza: cola llena o se agotó la espera."""
+
+
+class _Waiter:
+    __slots__ = ("notify", "granted", "cancelled", "since")
+
+    def __init__(self, notify: Callable[[], None]):
+        self.notify = notify
+        self.granted = False
+        self.cancelled = False
+        self.since = time.monotonic()
+
+
+class AdmissionController:
+    """Semáforo con cola acotada, prioridades y espera máxima."""
+
+    def __init__(self, max_active: int = ADMISSION_MAX_ACTIVE,
+                 max_queue: int = ADMISSION_MAX_QUEUE,
+                 max_wait_s: float = ADMISSION_MAX_WAIT_S):
+        self.max_active = max(1, max_active)
+        self.max_queue = max(0, max_queue)
+        self.max_wait_s = max_wait_s
+        self._lock = threading.Lock()
+        self._heap = []  # (prioridad, orden de llegada, _Waiter)
+        self._seq = itertools.count()
+        self._active = 0
+        self._queued = 0
+        self._counts = {"admitted": 0, "queued_total": 0, "shed_full": 0,
+                        "shed_timeout": 0, "peak_queued": 0}
+        self._wait_s_total = 0.0
+
+    # --- núcleo común ---
+    def _enqueue(self, priority: int, notify: Callable[[], None]) -> Optional[_Waiter]:
+        """Plaza libre => None (ya concedida). Si no, el _Waiter en cola. Busy si está llena."""
+        with self._lock:
+            if self._active < self.max_active:
+                self._active += 1
+                self._counts["admitted"] += 1
+                return None
+            if self._queued >= self.max_queue:
+                self._counts["shed_full"] += 1
+                raise Busy(f"cola llena ({self._queued}/{self.max_queue})")
+            waiter = _Waiter(notify)
+            heapq.heappush(self._heap, (priority, next(self._seq), waiter))
+            self._queued += 1
+            self._counts["queued_total"] += 1
+            self._counts["peak_queued"] = max(self._counts["peak_queued"], self._queued)
+            return waiter
+
+    def release(self):
+        """Libera una plaza: pasa directamente al siguiente de la cola, si hay."""
+        with self._lock:
+            while self._heap:
+                _, _, waiter = heapq.heappop(self._heap)
+                if waiter.cancelled:
+                    continue
+                waiter.granted = True
+                self._queued -= 1
+                self._counts["admitted"] += 1
+                self._wait_s_total += time.monotonic() - waiter.since
+                waiter.notify()
+                return
+            self._active -= 1
+
+    def try_acquire(self) -> bool:
+        """Plaza solo si hay una libre ahora mismo (sin cola). Para trabajo opcional."""
+        with self._lock:
+            if self._active < self.max_active:
+                self._active += 1
+                self._counts["admitted"] += 1
+                return True
+            return False
+
+    def _give_up(self, waiter: _Waiter) -> bool:
+        """Sale de la cola. True si la plaza llegó a concederse (hay que liberarla)."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            waiter.cancelled = True
+            self._queued -= 1
+            return False
+
+    def _timed_out(self):
+        with self._lock:
+            self._counts["shed_timeout"] += 1
+        raise Busy(f"sin plaza tras {self.max_wait_s:.0f} s en cola")
+
+    # --- hilos ---
+    def acquire(self, priority: int):
+        """Espera una plaza (como mucho max_wait_s). Lanza Busy si no la hay."""
+        event = threading.Event()
+        waiter = self._enqueue(priority, event.set)
+        if waiter is None or event.wait(self.max_wait_s):
+            return
+        if self._give_up(waiter):
+            return  # concedida justo al vencer el plazo
+        self._timed_out()
+
+    @contextmanager
+    def slot(self, priority: int):
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    # --- asyncio ---
+    async def acquire_async(self, priority: int):
+        """Como acquire(), sin bloquear el bucle de eventos."""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def _notify():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        waiter = self._enqueue(priority, _notify)
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), self.max_wait_s)
+        except asyncio.TimeoutError:
+            if self._give_up(waiter):
+                return
+            self._timed_out()
+        except asyncio.CancelledError:
+            # Cliente desconectado mientras esperaba: que la plaza no se pierda
+            if self._give_up(waiter):
+                self.release()
+            raise
+
+    @asynccontextmanager
+    async def slot_async(self, priority: int):
+        await self.acquire_async(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    # --- métricas ---
+    def stats(self) -> Dict[str, float]:
+        """Estado y contadores (para logs y para dimensionar el hardware)."""
+        with self._lock:
+            out = dict(self._counts)
+            out.update(active=self._active, queued=self._queued,
+                       max_active=self.max_active, max_queue=self.max_queue,
+                       wait_s_total=round(self._wait_s_total, 3))
+        return out
+
+    def describe(self) -> str:
+        s = self.stats()
+        return (f"plazas {s['active']}/{s['max_active']}, cola {s['queued']}/{s['max_queue']} "
+                f"(pico {s['peak_queued']}), descartadas {s['shed_full']} por cola llena "
+                f"y {s['shed_timeout']} por espera")
+
+
+def log_busy(controller: AdmissionController, reason: Exception, addr=None):
+    """Aviso de descarte (siempre: es justo lo que hay que vigilar)."""
+    log.warning(f"[ADM] Ocupado{f' para {addr}' if addr else ''}: {reason} — {controller.describe()}")
@@ -1,81 +1,977 @@
 # server/asr_whisper.py
 # ====================================
 # Transcripción de audio a texto con Faster-Whisper
+# Cada modelo tiene WHISPER_WORKERS réplicas con sus propios hilos (reparto
+# de cpu_budget.py); cada transcripción va a la réplica menos ocupada.
+# Con WHISPER_BATCH_MAX > 1 las locuciones que llegan casi a la vez (varios
+# clientes hablando) se transcriben en un solo lote: ver _Batcher.
+# Antes de Whisper se recorta el silencio (silence.py); sin voz no se le llama.
+# Con autodetección, el idioma de cada hablante se recuerda (language_cache.py).
+# Subidas en streaming: open_stream() da un ChunkedTranscriber (trozos
+# cerrados) o un StreamingTranscriber (ventana móvil con hipótesis parciales).
 # ====================================
 
 from __future__ import annotations
 
+import io
+import os
+import queue
 import threading
-from typing import Optional
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
-from faster_whisper import WhisperModel
+import numpy as np
+from faster_whisper import WhisperModel, decode_audio
+from faster_whisper.audio import pad_or_trim
+from faster_whisper.tokenizer import Tokenizer
+from faster_whisper.transcribe import get_ctranslate2_storage
+from faster_whisper.vad import VadOptions, get_speech_timestamps
 
 from .config import (
     WHISPER_MODEL_SIZE,
+    WHISPER_MODEL_POOL,
+    WHISPER_POOL_MEMORY_MB,
+    WHISPER_SHORT_S,
+    WHISPER_BUSY_QUEUE,
+    WHISPER_RETRY_LOGPROB,
     WHISPER_DEVICE,
     WHISPER_COMPUTE_TYPE,
     WHISPER_LANGUAGE,
-    debug_enabled,
+    WHISPER_BEAM_SIZE,
+    WHISPER_VAD_MIN_SILENCE_MS,
+    WHISPER_VAD_THRESHOLD,
+    WHISPER_WORKERS,
+    WHISPER_BATCH_MAX,
+    WHISPER_BATCH_WINDOW_MS,
+    WHISPER_BATCH_TIMEOUT_S,
+    ASR_TRIM_SILENCE,
+    ASR_LANG_CACHE,
+    ASR_LANG_RECHECK_LOGPROB,
+    STREAM_ASR_MODE,
+    STREAM_ASR_SEGMENT_S,
+    STREAM_ASR_SEARCH_S,
+    STREAM_ASR_THREADS,
+    STREAM_ASR_STEP_S,
+    STREAM_ASR_WINDOW_S,
 )
+from . import cpu_budget, metrics, silence
+from .admission import AdmissionController, Busy
+from .language_cache import LanguageCache
+from .tracing import bind, log, span
 
-# Carga perezosa en singleton (un único modelo compartido por hilos)
+# Memoria aproximada (MB) de cada modelo en int8; float16 ocupa el doble y
+# float32 el cuádruple. Un modelo en una carpeta local se mide por sus ficheros.
+MODEL_MEMORY_MB = {
+    "tiny": 75, "base": 145, "small": 480, "medium": 1500,
+    "large-v1": 3100, "large-v2": 3100, "large-v3": 3100,
+    "distil-small.en": 330, "distil-medium.en": 790, "distil-large-v3": 1500,
+}
+_COMPUTE_FACTOR = {"int8": 1, "int8_float16": 2, "int8_float32": 1, "float16": 2, "float32": 4}
+
+# Réplicas cargadas (perezosas; WHISPER_WORKERS por tamaño, compartidas por los hilos)
 _model_lock = threading.Lock()
-_model: Optional[WhisperModel] = None
+_workers: Dict[str, List["_Worker"]] = {}
+# Rutas locales de los modelos ya resueltas con preload_model_files()
+_model_paths: Dict[str, str] = {}
+# Hilos de CTranslate2 por réplica; None => cpu_budget.whisper_threads()
+_cpu_threads: Optional[int] = None
+
+
+def set_cpu_threads(n: int):
+    """Fija los hilos de CTranslate2 de cada réplica. Solo tiene efecto antes de cargarlas."""
+    global _cpu_threads
+    _cpu_threads = max(0, int(n))
+
+
+def _memory_mb(size: str) -> float:
+    if os.path.isdir(size):
+        return sum(os.path.getsize(os.path.join(size, n)) for n in os.listdir(size)) / 1e6
+    base = MODEL_MEMORY_MB.get(size, MODEL_MEMORY_MB["small"])
+    return base * _COMPUTE_FACTOR.get(WHISPER_COMPUTE_TYPE, 1)
+
+
+def _pool_sizes() -> List[str]:
+    """
+    Modelos de WHISPER_MODEL_POOL menores que el principal que caben (con sus
+    WHISPER_WORKERS réplicas) en WHISPER_POOL_MEMORY_MB, del más rápido
+    (el que menos ocupa) al más preciso.
+    WHISPER_MODEL_SIZE entra siempre y se cuenta primero.
+    """
+    sizes = [WHISPER_MODEL_SIZE]
+    used = _memory_mb(WHISPER_MODEL_SIZE) * WHISPER_WORKERS
+    for size in WHISPER_MODEL_POOL:
+        # Solo sirven los más rápidos que el principal (p. ej. si tune_asr.py lo cambió)
+        if size in sizes or _memory_mb(size) >= _memory_mb(WHISPER_MODEL_SIZE):
+            continue
+        need = _memory_mb(size) * WHISPER_WORKERS
+        if used + need > WHISPER_POOL_MEMORY_MB:
+            log.warning(f"[ASR] {size} no cabe en WHISPER_POOL_MEMORY_MB "
+                        f"({used:.0f} + {need:.0f} > {WHISPER_POOL_MEMORY_MB} MB); no se usará.")
+            continue
+        sizes.append(size)
+        used += need
+    return sorted(sizes, key=_memory_mb)
 
 
-def get_model() -> WhisperModel:
+POOL_SIZES = _pool_sizes()
+
+
+def preload_model_files() -> Dict[str, str]:
     """
-    Devuelve una instancia única de WhisperModel cargada según config.
-    Reutilizar el modelo evita tiempos de carga repetidos.
+    Descarga los modelos del pool si faltan y lee sus ficheros una vez para
+    dejarlos en la caché de páginas del sistema. Pensado para el proceso padre
+    del modo prefork: los hijos cargan después desde memoria y no desde
+    disco/Internet. (No se crea el WhisperModel aquí: CTranslate2 arranca sus
+    hilos al crearlo y esos hilos no sobreviven a un fork().)
     """
-    global _model
-    if _model is not None:
-        return _model
+    for size in POOL_SIZES:
+        if os.path.isdir(size):
+            path = size
+        else:
+            from faster_whisper.utils import download_model
+            path = download_model(size)
+
+        total = 0
+        for name in sorted(os.listdir(path)):
+            full = os.path.join(path, name)
+            if not os.path.isfile(full):
+                continue
+            with open(full, "rb") as f:
+                for chunk in iter(lambda: f.read(8 * 1024 * 1024), b""):
+                    total += len(chunk)
+        log.debug(f"[ASR] Ficheros del modelo precargados: {path} ({total / 1e6:.0f} MB)")
+        _model_paths[size] = path
+    return dict(_model_paths)
+
+
+class _Worker:
+    """Una réplica de un modelo y cuánto trabajo lleva (para repartir y para /metrics)."""
+    __slots__ = ("size", "index", "model", "active", "calls", "busy_s", "busy_since", "loaded_at")
+
+    def __init__(self, size: str, index: int, model: WhisperModel):
+        self.size = size
+        self.index = index
+        self.model = model
+        self.active = 0          # transcripciones en curso en esta réplica
+        self.calls = 0
+        self.busy_s = 0.0        # tiempo con al menos una en curso
+        self.busy_since = 0.0
+        self.loaded_at = time.monotonic()
+
+
+def _replicas(size: str) -> List[_Worker]:
+    workers = _workers.get(size)
+    if workers is not None:
+        return workers
 
     with _model_lock:
-        if _model is None:
-            if debug_enabled():
-                print(
-                    f"[ASR] Cargando Faster-Whisper: size={WHISPER_MODEL_SIZE}, "
-                    f"device={WHISPER_DEVICE}, compute_type={WHISPER_COMPUTE_TYPE}"
-                )
-            _model = WhisperModel(
-                WHISPER_MODEL_SIZE,
-                device=WHISPER_DEVICE,
-                compute_type=WHISPER_COMPUTE_TYPE,
+        if size not in _workers:
+            threads = _cpu_threads if _cpu_threads is not None else cpu_budget.whisper_threads()
+            log.debug(
+                f"[ASR] Cargando Faster-Whisper: size={size}, device={WHISPER_DEVICE}, "
+                f"compute_type={WHISPER_COMPUTE_TYPE}, {WHISPER_WORKERS} x {threads} hilos"
             )
-            if debug_enabled():
-                print("[ASR] Modelo cargado.")
-    return _model
+            _workers[size] = [
+                _Worker(size, i, WhisperModel(
+                    _model_paths.get(size) or size,
+                    device=WHISPER_DEVICE,
+                    compute_type=WHISPER_COMPUTE_TYPE,
+                    cpu_threads=threads,
+                ))
+                for i in range(max(1, WHISPER_WORKERS))
+            ]
+            log.debug("[ASR] Modelo cargado.")
+    return _workers[size]
+
+
+def get_model(size: Optional[str] = None) -> WhisperModel:
+    """
+    Devuelve el WhisperModel de 'size' (por defecto WHISPER_MODEL_SIZE),
+    cargado una sola vez. Reutilizar el modelo evita tiempos de carga repetidos.
+    Para transcribir, mejor _worker(): reparte entre las réplicas.
+    """
+    return _replicas(size or WHISPER_MODEL_SIZE)[0].model
+
+
+_dispatch_lock = threading.Lock()
+
+
+@contextmanager
+def _worker(size: Optional[str] = None) -> Iterator[_Worker]:
+    """La réplica de 'size' con menos transcripciones en curso (empate: la menos usada)."""
+    workers = _replicas(size or WHISPER_MODEL_SIZE)
+    with _dispatch_lock:
+        w = min(workers, key=lambda w: (w.active, w.busy_s))
+        if w.active == 0:
+            w.busy_since = time.monotonic()
+        w.active += 1
+    try:
+        yield w
+    finally:
+        with _dispatch_lock:
+            w.active -= 1
+            w.calls += 1
+            if w.active == 0:
+                w.busy_s += time.monotonic() - w.busy_since
+
+
+def _pool_samples():
+    now = time.monotonic()
+    with _dispatch_lock:
+        workers = [w for ws in _workers.values() for w in ws]
+        busy = sum(w.busy_s + (now - w.busy_since if w.active else 0.0) for w in workers)
+        alive = sum(now - w.loaded_at for w in workers)
+        return [
+            ("asr_workers", "gauge", "Réplicas de Whisper cargadas (todos los tamaños).",
+             len(workers)),
+            ("asr_workers_busy", "gauge", "Réplicas de Whisper transcribiendo ahora.",
+             sum(1 for w in workers if w.active)),
+            ("asr_worker_busy_seconds_total", "counter",
+             "Segundos de réplica con alguna transcripción en curso.", busy),
+            ("asr_worker_utilization", "gauge",
+             "Fracción del tiempo que las réplicas han estado ocupadas desde que se cargaron.",
+             busy / alive if alive else 0.0),
+        ]
+
+
+metrics.register_collector(_pool_samples)
+
+
+def warm_up(audio: np.ndarray):
+    """
+    Carga los modelos del pool (todas sus réplicas) y los hace trabajar una
+    vez con 'audio' (float32, 16 kHz): con VAD (carga también el modelo de VAD) y sin él (el
+    VAD podría descartar todo el audio de prueba y el codificador/decodificador
+    quedarían en frío).
+    """
+    for size in POOL_SIZES:
+        for w in _replicas(size):
+            for vad in (True, False):
+                segments, _ = w.model.transcribe(audio, language=WHISPER_LANGUAGE,
+                                                 vad_filter=vad, beam_size=WHISPER_BEAM_SIZE)
+                for _ in segments:
+                    pass
+        if WHISPER_BATCH_MAX > 1 and WHISPER_LANGUAGE:
+            _transcribe_batch([audio] * min(2, WHISPER_BATCH_MAX), WHISPER_LANGUAGE, size)
+
+
+# -------------------------------------------------------------------
+# Qué modelo para cada locución
+#  - locución corta (<= WHISPER_SHORT_S): el más rápido del pool (órdenes
+#    como "cállate" o "noticias")
+#  - con WHISPER_BUSY_QUEUE transcripciones o más en curso/espera: un
+#    modelo por debajo del principal, para vaciar la cola antes
+#  - si un modelo menor que el principal responde con una confianza media
+#    (avg_logprob) por debajo de WHISPER_RETRY_LOGPROB, se repite con el
+#    principal
+# -------------------------------------------------------------------
+_inflight = 0
+_inflight_lock = threading.Lock()
+
+
+def choose_model(duration_s: float, queued: Optional[int] = None) -> str:
+    """Tamaño de modelo para 'duration_s' s de voz con 'queued' transcripciones en marcha."""
+    if len(POOL_SIZES) == 1:
+        return WHISPER_MODEL_SIZE
+    if duration_s <= WHISPER_SHORT_S:
+        return POOL_SIZES[0]
+    main = POOL_SIZES.index(WHISPER_MODEL_SIZE)
+    if (_inflight if queued is None else queued) >= WHISPER_BUSY_QUEUE and main > 0:
+        return POOL_SIZES[main - 1]
+    return WHISPER_MODEL_SIZE
+
+
+def _should_retry(size: str, avg_logprob: float) -> bool:
+    return (WHISPER_RETRY_LOGPROB is not None and size != WHISPER_MODEL_SIZE
+            and POOL_SIZES.index(size) < POOL_SIZES.index(WHISPER_MODEL_SIZE)
+            and avg_logprob < WHISPER_RETRY_LOGPROB)
+
+
+def _transcribe(audio, language: Optional[str], size: Optional[str] = None,
+                out: Optional[dict] = None) -> str:
+    """
+    Llama al modelo 'size' con 'audio' (ruta, fichero en memoria o array
+    float32 a 16 kHz) y une los segmentos. Con poca confianza y un modelo
+    menor que el principal, repite con el principal. En 'out' deja el idioma
+    detectado, su probabilidad y la confianza media (avg_logprob).
+    """
+    size = size or WHISPER_MODEL_SIZE
+
+    # VAD interno y beam de config.py (benchmarks/tune_asr.py los mide en esta máquina)
+    with _worker(size) as w, span("whisper", language=language or "auto", model=size,
+                                  worker=w.index) as sp:
+        segments, info = w.model.transcribe(
+            audio,
+            language=language,       # None -> autodetect
+            vad_filter=True,
+            vad_parameters=_vad_parameters(),
+            beam_size=WHISPER_BEAM_SIZE,
+        )
+        # Los segmentos se decodifican al recorrerlos: dentro del span
+        segments = list(segments)
+        text = "".join(seg.text for seg in segments).strip()
+        # Confianza media ponderada por la duración de cada segmento
+        total = sum(seg.end - seg.start for seg in segments) or 1.0
+        avg_logprob = sum(seg.avg_logprob * (seg.end - seg.start) for seg in segments) / total
+        sp["detected"] = getattr(info, "language", None)
+        sp["audio_s"] = round(getattr(info, "duration", 0.0) or 0.0, 2)
+        sp["avg_logprob"] = round(avg_logprob, 3)
+
+    log.debug(f"[ASR] Info idioma: {getattr(info, 'language', '?')} "
+              f"(p={getattr(info, 'language_probability', 0.0):.2f})")
+    log.debug(f"[ASR] Texto ({size}): {text}")
+    metrics.count("asr_model", size=size)
+    if segments and _should_retry(size, avg_logprob):
+        log.debug(f"[ASR] Confianza baja con {size} ({avg_logprob:.2f}); repito con {WHISPER_MODEL_SIZE}.")
+        metrics.count("asr_retry", size=size)
+        return _transcribe(audio, language, WHISPER_MODEL_SIZE, out)
+    if out is not None:
+        out["language"] = getattr(info, "language", None)
+        out["probability"] = getattr(info, "language_probability", 0.0)
+        out["avg_logprob"] = avg_logprob if segments else None
+    return text
+
+
+# -------------------------------------------------------------------
+# Transcripción por lotes
+# Un hilo por réplica recoge las locuciones que llegan a la vez: la primera
+# espera como mucho WHISPER_BATCH_WINDOW_MS a que lleguen más (hasta
+# WHISPER_BATCH_MAX) y todas pasan juntas por el codificador y el
+# decodificador (una llamada a CTranslate2 con un lote, como
+# BatchedInferencePipeline de faster-whisper >= 1.1). Mientras los lotes
+# están en marcha, las que llegan se acumulan para el siguiente sin esperar
+# más. Solo con idioma fijo y locuciones de hasta 30 s (una ventana de
+# Whisper); el resto va por _transcribe().
+# -------------------------------------------------------------------
+BATCH_MAX_SAMPLES = 30 * 16000
+
+
+def _vad_parameters() -> dict:
+    """VAD de Whisper según config.py (lo comparten _transcribe() y los lotes)."""
+    return dict(min_silence_duration_ms=WHISPER_VAD_MIN_SILENCE_MS, threshold=WHISPER_VAD_THRESHOLD)
+
+
+def _speech_only(audio: np.ndarray) -> np.ndarray:
+    """Solo los tramos con voz de 'audio' (float32, 16 kHz), seguidos (mismo VAD que _transcribe())."""
+    stamps = get_speech_timestamps(audio, VadOptions(**_vad_parameters()))
+    if not stamps:
+        return audio[:0]
+    return np.concatenate([audio[s["start"]:s["end"]] for s in stamps])
+
+
+def _transcribe_batch(audios: List[np.ndarray], language: str,
+                      size: Optional[str] = None) -> List[Tuple[str, Optional[float]]]:
+    """
+    (texto, avg_logprob) de cada locución de 'audios' (float32, 16 kHz,
+    <= 30 s), en orden, con el modelo 'size' (avg_logprob None si no hubo
+    voz). Sin reintentos por temperatura, como el pipeline por lotes de
+    faster-whisper; las de poca confianza de un modelo menor se repiten
+    juntas con el principal.
+    """
+    size = size or WHISPER_MODEL_SIZE
+    model = get_model(size)
+    speech = [_speech_only(a) for a in audios]
+    todo = [i for i, a in enumerate(speech) if len(a)]
+    texts: List[Tuple[str, Optional[float]]] = [("", None)] * len(audios)
+    if not todo:
+        return texts
+
+    fe = model.feature_extractor
+    features = np.stack([
+        pad_or_trim(fe(speech[i])[:, : len(speech[i]) // fe.hop_length], fe.nb_max_frames)
+        for i in todo
+    ])
+    tokenizer = Tokenizer(model.hf_tokenizer, model.model.is_multilingual,
+                          task="transcribe", language=language)
+    prompt = model.get_prompt(tokenizer, [], without_timestamps=True)
+    with _worker(size) as w:
+        results = w.model.model.generate(
+            get_ctranslate2_storage(features), [prompt] * len(todo),
+            beam_size=WHISPER_BEAM_SIZE, max_length=model.max_length,
+            return_scores=True, return_no_speech_prob=True,
+        )
+    metrics.count("asr_model", size=size)
+    retry = []
+    for i, res in zip(todo, results):
+        tokens = res.sequences_ids[0]
+        avg_logprob = res.scores[0] * len(tokens) / (len(tokens) + 1)
+        # Igual que transcribe(): silencio si no_speech_prob > 0.6 y logprob < -1
+        if res.no_speech_prob > 0.6 and avg_logprob < -1.0:
+            continue
+        if _should_retry(size, avg_logprob):
+            retry.append(i)
+            continue
+        texts[i] = (tokenizer.decode(tokens).strip(), avg_logprob)
+    if retry:
+        log.debug(f"[ASR] Confianza baja con {size} en {len(retry)} de {len(audios)}; "
+                  f"repito con {WHISPER_MODEL_SIZE}.")
+        metrics.count("asr_retry", size=size)
+        again = _transcribe_batch([audios[i] for i in retry], language, WHISPER_MODEL_SIZE)
+        for i, result in zip(retry, again):
+            texts[i] = result
+    return texts
+
+
+class _Batcher:
+    """Cola de locuciones y los hilos (uno por réplica) que las transcriben por lotes."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending: deque = deque()  # (audio, (idioma, modelo), Future, llegada)
+        self._threads: List[threading.Thread] = []
+
+    def submit(self, audio: np.ndarray, language: str, size: str) -> Future:
+        fut: Future = Future()
+        with self._cond:
+            self._pending.append((audio, (language, size), fut, time.monotonic()))
+            # Un hilo muerto no vuelve: se sustituye
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < max(1, WHISPER_WORKERS):
+                t = threading.Thread(target=self._loop, daemon=True,
+                                     name=f"federico-asr-batch-{len(self._threads)}")
+                self._threads.append(t)
+                t.start()
+            self._cond.notify()
+        return fut
+
+    def withdraw(self, fut: Future) -> bool:
+        """Saca de la cola la locución de 'fut'. False si ya va en un lote."""
+        with self._cond:
+            for i, item in enumerate(self._pending):
+                if item[2] is fut:
+                    del self._pending[i]
+                    return True
+        return False
+
+    def _next_batch(self) -> list:
+        window = WHISPER_BATCH_WINDOW_MS / 1000
+        with self._cond:
+            while True:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = self._pending[0][3] + window
+                while len(self._pending) < WHISPER_BATCH_MAX:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._cond.wait(left)
+                # Otro hilo (otra réplica) pudo llevarse el lote durante la espera
+                if self._pending:
+                    break
+            # Un lote es de un solo idioma y modelo: los de la más antigua
+            key = self._pending[0][1]
+            batch, rest = [], deque()
+            while self._pending:
+                item = self._pending.popleft()
+                if item[1] == key and len(batch) < WHISPER_BATCH_MAX:
+                    batch.append(item)
+                else:
+                    rest.append(item)
+            self._pending = rest
+            return batch
+
+    def _loop(self):
+        while True:
+            batch = []
+            try:
+                batch = self._next_batch()
+                metrics.count("asr_batch", size=str(len(batch)))
+                texts = _transcribe_batch([a for a, _, _, _ in batch], *batch[0][1])
+                for (_, _, fut, _), (text, avg_logprob) in zip(batch, texts):
+                    fut.batch_size = len(batch)
+                    fut.avg_logprob = avg_logprob
+                    fut.set_result(text)
+            except Exception as e:
+                log.warning("[ASR] Error en un lote:", e)
+                for _, _, fut, _ in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+
+_batcher = _Batcher()
+
+
+def _after_fork_in_child():
+    global _batcher
+    _batcher = _Batcher()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
 
+# Segundos de audio que llegaron al ASR y cuántos se quitaron por silencio
+_trim_stats = {"audio_s": 0.0, "removed_s": 0.0}
+_trim_lock = threading.Lock()
 
-def transcribe_wav(path_wav: str, language: Optional[str] = WHISPER_LANGUAGE) -> str:
+
+def _trim_silence(audio: np.ndarray) -> Optional[np.ndarray]:
+    """'audio' sin el silencio de los extremos (una vista), o None si no hay voz."""
+    with span("trim", audio_s=round(len(audio) / 16000, 2)) as sp:
+        bounds = silence.speech_bounds(audio)
+        kept = audio[bounds[0]:bounds[1]] if bounds else audio[:0]
+        removed = (len(audio) - len(kept)) / 16000
+        sp["removed_s"] = round(removed, 2)
+    with _trim_lock:
+        _trim_stats["audio_s"] += len(audio) / 16000
+        _trim_stats["removed_s"] += removed
+    if bounds is None:
+        metrics.count("asr_skipped", reason="no_speech")
+        log.debug(f"[ASR] Sin voz en {len(audio) / 16000:.2f} s de audio: no se llama a Whisper.")
+        return None
+    log.debug(f"[ASR] Silencio recortado: {removed:.2f} de {len(audio) / 16000:.2f} s")
+    return kept
+
+
+metrics.register_collector(lambda: [
+    ("asr_audio_seconds_total", "counter", "Segundos de audio recibidos por el ASR.",
+     _trim_stats["audio_s"]),
+    ("asr_trimmed_seconds_total", "counter", "Segundos de silencio quitados antes de Whisper.",
+     _trim_stats["removed_s"]),
+])
+
+
+def _run(audio: np.ndarray, language: Optional[str], out: dict) -> str:
+    """
+    Elige modelo (choose_model) y transcribe: por lotes si se puede (ver
+    arriba); si no, una llamada a Whisper sola.
+    """
+    global _inflight
+    with _inflight_lock:
+        size = choose_model(len(audio) / 16000)
+        _inflight += 1
+    try:
+        if WHISPER_BATCH_MAX <= 1 or not language or len(audio) > BATCH_MAX_SAMPLES:
+            return _transcribe(audio, language, size, out)
+        with span("whisper", language=language, model=size,
+                  audio_s=round(len(audio) / 16000, 2)) as sp:
+            fut = _batcher.submit(audio, language, size)
+            try:
+                text = fut.result(timeout=WHISPER_BATCH_TIMEOUT_S)
+            except FutureTimeout:
+                text = None
+            sp["batch"] = getattr(fut, "batch_size", 1)
+        if text is None:
+            # Los hilos de lotes no contestan: no dejar la petición colgada
+            metrics.count("asr_batch_timeout")
+            if _batcher.withdraw(fut):
+                log.warning(f"[ASR] Sin lote en {WHISPER_BATCH_TIMEOUT_S} s; transcribo sin lote.")
+                return _transcribe(audio, language, size, out)
+            # Ya va en un lote en curso: repetirla sería hacer el trabajo dos veces
+            raise Busy(f"Whisper no terminó el lote en {WHISPER_BATCH_TIMEOUT_S} s")
+        out["avg_logprob"] = getattr(fut, "avg_logprob", None)
+        log.debug(f"[ASR] Texto ({size}, lote de {sp['batch']}): {text}")
+        return text
+    finally:
+        with _inflight_lock:
+            _inflight -= 1
+
+
+# Idioma recordado por hablante (solo con language=None y un 'speaker')
+languages = LanguageCache()
+
+metrics.register_collector(lambda: [
+    ("asr_language_cache_entries", "gauge", "Hablantes con el idioma ya detectado.",
+     languages.stats()["entries"]),
+])
+
+
+def _asr(audio, language: Optional[str], speaker: Optional[str] = None) -> str:
+    """
+    Recorta el silencio y transcribe (_run). Sin voz devuelve "" sin tocar el
+    modelo. Con autodetección y 'speaker', usa y mantiene su idioma en
+    'languages'.
+    """
+    if not isinstance(audio, np.ndarray):
+        audio = decode_audio(audio)
+    if ASR_TRIM_SILENCE:
+        audio = _trim_silence(audio)
+        if audio is None:
+            return ""
+    if language is not None or not speaker or not ASR_LANG_CACHE:
+        return _run(audio, language, {})
+
+    out: dict = {}
+    cached = languages.lookup(speaker)
+    if cached is not None:
+        metrics.count("asr_language", source="cache")
+        text = _run(audio, cached, out)
+        avg_logprob = out.get("avg_logprob")
+        if avg_logprob is None or avg_logprob >= ASR_LANG_RECHECK_LOGPROB:
+            return text
+        # Poca confianza con el idioma recordado: quizá cambió; se repite detectando
+        log.debug(f"[ASR] avg_logprob {avg_logprob:.2f} con {cached} para {speaker}; detecto de nuevo.")
+        languages.forget(speaker)
+        metrics.count("asr_language", source="recheck")
+        out = {}
+    else:
+        metrics.count("asr_language", source="detect")
+    text = _run(audio, None, out)
+    languages.learn(speaker, out.get("language"), out.get("probability", 0.0))
+    return text
+
+
+def transcribe_wav(path_wav: str, language: Optional[str] = WHISPER_LANGUAGE,
+                   speaker: Optional[str] = None) -> str:
     """
     Transcribe un WAV mono PCM16 a texto.
     - language: "es" para forzar español, o None para autodetección.
+    - speaker: quién habla (sesión o IP); con autodetección se recuerda su idioma.
     Devuelve el texto concatenado de todos los segmentos.
     """
-    model = get_model()
-
-    # Ajustes razonables: VAD interno y beam pequeño para latencia
-    # Puedes tunear estos parámetros si necesitas más precisión/menos latencia.
-    if debug_enabled():
-        print(f"[ASR] Transcribiendo: {path_wav} (lang={language or 'auto'})")
-
-    segments, info = model.transcribe(
-        path_wav,
-        language=language,       # None -> autodetect
-        vad_filter=True,
-        vad_parameters=dict(min_silence_duration_ms=300),
-        beam_size=1,             # 1 para velocidad; >1 mejora precisión
-    )
-
-    if debug_enabled():
-        lang = getattr(info, "language", "?")
-        prob = getattr(info, "language_probability", 0.0)
-        print(f"[ASR] Info idioma: {lang} (p={prob:.2f})")
-
-    text = "".join(seg.text for seg in segments).strip()
-    if debug_enabled():
-        print(f"[ASR] Texto: {text}")
-    return text
+    log.debug(f"[ASR] Transcribiendo: {path_wav} (lang={language or 'auto'})")
+    return _asr(path_wav, language, speaker)
+
+
+def pcm16_to_float32(pcm, sample_rate: int = 16000, channels: int = 1) -> np.ndarray:
+    """
+    PCM16 (bytes o array int16) -> float32 mono a 16 kHz, que es lo que espera
+    Whisper. Mezcla canales y remuestrea (lineal) si hace falta.
+    """
+    samples = np.frombuffer(pcm, dtype=np.int16) if not isinstance(pcm, np.ndarray) else pcm
+    audio = samples.astype(np.float32) / 32768.0
+    if channels > 1:
+        audio = audio[: len(audio) - len(audio) % channels].reshape(-1, channels).mean(axis=1)
+    if sample_rate != 16000 and len(audio):
+        n_out = int(round(len(audio) * 16000 / sample_rate))
+        audio = np.interp(
+            np.linspace(0, len(audio) - 1, n_out), np.arange(len(audio)), audio
+        ).astype(np.float32)
+    return audio
+
+
+def transcribe_pcm(pcm, sample_rate: int = 16000, channels: int = 1,
+                   language: Optional[str] = WHISPER_LANGUAGE, speaker: Optional[str] = None) -> str:
+    """
+    Como transcribe_wav() pero desde PCM16 en memoria (bytes, bytearray,
+    memoryview o array int16). El PCM se ve como int16 sin copiarlo.
+    """
+    audio = pcm16_to_float32(pcm, sample_rate, channels)
+    log.debug(f"[ASR] Transcribiendo PCM: {len(audio) / 16000:.2f} s (lang={language or 'auto'})")
+    if len(audio) == 0:
+        return ""
+    return _asr(audio, language, speaker)
+
+
+def transcribe_wav_bytes(data, language: Optional[str] = WHISPER_LANGUAGE,
+                         speaker: Optional[str] = None) -> str:
+    """
+    Transcribe un fichero de audio completo que ya está en memoria. Solo para
+    lo que no es WAV PCM16 (ése va por transcribe_pcm()): faster-whisper lo
+    decodifica con PyAV desde un BytesIO, sin tocar disco.
+    """
+    log.debug(f"[ASR] Transcribiendo audio en memoria: {len(data)} bytes (lang={language or 'auto'})")
+    return _asr(io.BytesIO(bytes(data)), language, speaker)
+
+
+# -------------------------------------------------------------------
+# Transcripción anticipada para subidas en streaming
+# -------------------------------------------------------------------
+_stream_executor = ThreadPoolExecutor(max_workers=STREAM_ASR_THREADS, thread_name_prefix="federico-asr-stream")
+
+
+class ChunkedTranscriber:
+    """
+    Recibe el PCM de una subida en streaming trama a trama (feed) y, mientras
+    el usuario sigue hablando, va mandando a Whisper trozos ya cerrados,
+    cortados en el punto más silencioso para no partir palabras.
+    finish() transcribe solo lo que falta y devuelve el texto completo;
+    close() abandona la locución (petición descartada) sin transcribir más.
+    """
+
+    def __init__(self, sample_rate: int = 16000, channels: int = 1,
+                 language: Optional[str] = WHISPER_LANGUAGE, speaker: Optional[str] = None):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.language = language
+        self.speaker = speaker
+        self._buf = bytearray()
+        self._cut = 0  # bytes ya enviados a transcribir
+        self._parts: List[Future] = []
+        self._closed = False
+        self._lock = threading.Lock()
+        self._bytes_per_s = sample_rate * channels * 2
+
+    def feed(self, pcm: bytes):
+        with self._lock:
+            if self._closed:
+                return
+            self._buf += pcm
+            pending = len(self._buf) - self._cut
+            if pending < STREAM_ASR_SEGMENT_S * self._bytes_per_s:
+                return
+            cut = self._quietest_cut()
+            self._submit(self._cut, cut)
+            self._cut = cut
+
+    def _quietest_cut(self) -> int:
+        """Posición (en bytes) del tramo de 20 ms más silencioso en la ventana final."""
+        frame = max(1, int(self.sample_rate * 0.02)) * self.channels
+        search = int(STREAM_ASR_SEARCH_S * self.sample_rate) * self.channels
+        end = len(self._buf) // 2  # en muestras
+        start = max(self._cut // 2, end - search)
+        window = np.frombuffer(self._buf, dtype=np.int16, count=end - start, offset=start * 2)
+        n = len(window) // frame
+        if n == 0:
+            return len(self._buf) - len(self._buf) % (2 * self.channels)
+        energy = np.square(window[: n * frame].astype(np.float32)).reshape(n, frame).mean(axis=1)
+        return (start + int(np.argmin(energy)) * frame) * 2
+
+    def _submit(self, a: int, b: int):
+        chunk = bytes(self._buf[a:b])
+        log.debug(f"[ASR] Trozo anticipado: {len(chunk) / self._bytes_per_s:.2f} s")
+        # bind(): el trozo se transcribe en otro hilo pero con el request_id del turno
+        self._parts.append(_stream_executor.submit(
+            bind(transcribe_pcm), chunk, self.sample_rate, self.channels, self.language, self.speaker
+        ))
+
+    def finish(self) -> str:
+        """Transcribe el resto y devuelve el texto de toda la locución, en orden."""
+        with self._lock:
+            if len(self._buf) > self._cut:
+                self._submit(self._cut, len(self._buf))
+                self._cut = len(self._buf)
+            parts = list(self._parts)
+        texts = [f.result() for f in parts]
+        return " ".join(t.strip() for t in texts if t and t.strip())
+
+    def close(self):
+        """Descarta la locución: los trozos que aún no empezaron no se transcriben."""
+        with self._lock:
+            self._closed = True
+            parts = list(self._parts)
+        for f in parts:
+            f.cancel()
+
+
+# -------------------------------------------------------------------
+# Transcripción incremental con prefijo estable (STREAM_ASR_MODE = "incremental")
+# Cada STREAM_ASR_STEP_S s de audio nuevo se vuelve a decodificar la ventana
+# que aún no está confirmada. Las palabras en las que coinciden dos pasadas
+# seguidas se confirman (ya no cambian) y el resto queda como hipótesis. La
+# ventana se recorta por el final del último segmento confirmado, así que al
+# acabar la locución solo queda por decodificar un trozo corto.
+# -------------------------------------------------------------------
+Partial = Tuple[str, str]  # (texto confirmado, hipótesis todavía provisional)
+_WORD_STRIP = ".,;:!?¡¿…\"'()[]«»-"
+
+
+def _norm(word: str) -> str:
+    return word.strip(_WORD_STRIP).lower()
+
+
+def _decode_window(audio: np.ndarray, language: Optional[str],
+                   prompt: str) -> List[Tuple[str, float]]:
+    """
+    Una pasada de Whisper sobre la ventana: [(texto del segmento, fin en s)].
+    Sin el VAD de Whisper (movería los tiempos) y con el texto ya confirmado
+    como prompt para que la continuación sea coherente.
+    """
+    # El silencio de los extremos no se decodifica: un segmento sin palabras
+    # hasta donde empieza la voz (o toda la ventana) deja que _trim() lo quite
+    start, end = 0, len(audio)
+    if ASR_TRIM_SILENCE:
+        bounds = silence.speech_bounds(audio)
+        if bounds is None:
+            return [("", len(audio) / 16000)]
+        start, end = bounds
+    lead = start / 16000
+    with _worker() as w, span("whisper", language=language or "auto", stream=True, worker=w.index,
+                              audio_s=round((end - start) / 16000, 2)):
+        segments, _ = w.model.transcribe(
+            audio[start:end],
+            language=language,
+            beam_size=WHISPER_BEAM_SIZE,
+            initial_prompt=prompt or None,
+            condition_on_previous_text=False,
+        )
+        out = [(seg.text, lead + seg.end) for seg in segments]
+    return ([("", lead)] if start else []) + out
+
+
+class StreamingTranscriber:
+    """
+    Misma interfaz que ChunkedTranscriber (feed/finish) con hipótesis
+    parciales: on_partial(confirmado, provisional) en cada pasada, o
+    partials() como generador (termina al llamar a finish() o close()).
+    Con 'admission', cada pasada intermedia toma una plaza libre o no se hace
+    (es opcional: finish() decodifica lo que falte dentro de la plaza del turno).
+    """
+
+    def __init__(self, sample_rate: int = 16000, channels: int = 1,
+                 language: Optional[str] = WHISPER_LANGUAGE,
+                 on_partial: Optional[Callable[[str, str], None]] = None,
+                 admission: Optional[AdmissionController] = None):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.language = language
+        self.on_partial = on_partial
+        self.admission = admission
+        self._audio: List[np.ndarray] = []  # float32 16 kHz desde _offset
+        self._samples = 0                   # muestras en _audio
+        self._decoded = 0                   # muestras que vio la última pasada
+        self._offset_s = 0.0                # inicio de la ventana en la locución
+        self._committed: List[str] = []     # palabras confirmadas
+        self._in_window = 0                 # de ellas, cuántas caen dentro de la ventana
+        self._tentative: List[str] = []     # hipótesis de la última pasada
+        self._pending: Optional[Future] = None
+        self._finished = False
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[Partial]]" = queue.Queue()
+        self._step = int(STREAM_ASR_STEP_S * 16000)
+
+    # --- entrada ---
+    def feed(self, pcm: bytes):
+        audio = pcm16_to_float32(pcm, self.sample_rate, self.channels)
+        with self._lock:
+            if self._finished:
+                return
+            self._audio.append(audio)
+            self._samples += len(audio)
+            self._maybe_schedule()
+
+    def _maybe_schedule(self):
+        if self._pending is None and not self._finished \
+                and self._samples - self._decoded >= self._step:
+            self._pending = _stream_executor.submit(bind(self._run_pass))
+
+    def _run_pass(self):
+        if self.admission is not None and not self.admission.try_acquire():
+            # Sin plaza libre: se salta y se prueba tras otros STREAM_ASR_STEP_S de audio
+            metrics.count("asr_stream_pass_skipped")
+            with self._lock:
+                self._decoded = self._samples
+                self._pending = None
+            return
+        try:
+            self._pass(final=False)
+        except Exception as e:
+            log.warning("[ASR] Pasada incremental fallida:", e)
+        finally:
+            if self.admission is not None:
+                self.admission.release()
+        with self._lock:
+            self._pending = None
+            self._maybe_schedule()
+
+    # --- una pasada ---
+    def _window(self) -> Tuple[np.ndarray, str]:
+        with self._lock:
+            if len(self._audio) > 1:
+                self._audio = [np.concatenate(self._audio)]
+            window = self._audio[0] if self._audio else np.zeros(0, np.float32)
+            self._decoded = self._samples
+            prompt = " ".join(self._committed[-50:])
+        return window, prompt
+
+    def _pass(self, final: bool):
+        window, prompt = self._window()
+        if not len(window):
+            return
+        segments = _decode_window(window, self.language, prompt)
+        words, ends = [], []  # palabras de la pasada y, por segmento, (nº palabras acumuladas, fin)
+        for text, end in segments:
+            words.extend(text.split())
+            ends.append((len(words), end))
+
+        with self._lock:
+            # Lo ya confirmado que sigue dentro de la ventana no se vuelve a contar
+            new = words[self._in_window:]
+            if final:
+                agreed = len(new)
+            else:
+                agreed = 0
+                for a, b in zip(new, self._tentative):
+                    if _norm(a) != _norm(b):
+                        break
+                    agreed += 1
+                # Ventana demasiado larga sin acuerdo: se confirma todo menos el último segmento
+                if len(window) > STREAM_ASR_WINDOW_S * 16000 and len(ends) > 1:
+                    agreed = max(agreed, ends[-2][0] - self._in_window)
+            self._committed.extend(new[:agreed])
+            self._in_window += agreed
+            self._tentative = new[agreed:]
+            self._trim(ends)
+            partial = (" ".join(self._committed), " ".join(self._tentative))
+
+        log.debug(f"[ASR] Parcial ({self._offset_s:.1f} s): {partial[0]!r} + {partial[1]!r}")
+        if self.on_partial is not None:
+            try:
+                self.on_partial(*partial)
+            except Exception as e:
+                log.warning("[ASR] Error en on_partial:", e)
+        self._queue.put(partial)
+
+    def _trim(self, ends: List[Tuple[int, float]]):
+        """Quita de la ventana los segmentos cuyas palabras ya están todas confirmadas."""
+        cut_words, cut_s = 0, 0.0
+        for n_words, end in ends:
+            if n_words > self._in_window:
+                break
+            cut_words, cut_s = n_words, end
+        if not self._audio:
+            return
+        # _audio[0] es la ventana de la pasada; lo que llegó durante ella va detrás
+        cut = min(int(cut_s * 16000), len(self._audio[0]))
+        if cut <= 0:
+            return
+        self._audio[0] = self._audio[0][cut:]
+        self._samples -= cut
+        self._decoded = max(0, self._decoded - cut)
+        self._offset_s += cut / 16000
+        self._in_window -= cut_words
+
+    # --- salida ---
+    def partials(self) -> Iterator[Partial]:
+        """(confirmado, provisional) de cada pasada, hasta el resultado final."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            yield item
+
+    def finish(self) -> str:
+        """Última pasada sobre lo que queda sin confirmar y texto completo."""
+        with self._lock:
+            self._finished = True
+            pending = self._pending
+        if pending is not None:
+            pending.result()
+        try:
+            self._pass(final=True)
+        finally:
+            self._queue.put(None)
+        return " ".join(self._committed)
+
+    def close(self):
+        """Descarta la locución sin la pasada final (no hace nada tras finish())."""
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+            pending = self._pending
+        if pending is not None:
+            pending.cancel()
+        self._queue.put(None)
+
+
+def open_stream(sample_rate: int = 16000, channels: int = 1,
+                on_partial: Optional[Callable[[str, str], None]] = None,
+                speaker: Optional[str] = None,
+                admission: Optional[AdmissionController] = None):
+    """
+    Transcriptor para una subida en streaming según STREAM_ASR_MODE. Con
+    autodetección, los trozos usan y mantienen el idioma de 'speaker'; la
+    ventana incremental solo lo usa (si ya se conoce). Las pasadas
+    incrementales solo se hacen con plaza libre en 'admission'.
+    """
+    if STREAM_ASR_MODE == "incremental":
+        language = WHISPER_LANGUAGE
+        if language is None and speaker and ASR_LANG_CACHE:
+            language = languages.lookup(speaker)
+        return StreamingTranscriber(sample_rate, channels, language, on_partial=on_partial,
+                                    admission=admission)
+    return ChunkedTranscriber(sample_rate, channels, speaker=speaker)
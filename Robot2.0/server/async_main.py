@@ -0,0 +1,451 @@
+# server/async_main.py
+# ====================================
+# Servidor del asistente de voz con asyncio
+# Mismo protocolo (incluidas las sesiones persistentes) y mismas etapas
+# que server/main.py, pero:
+#  - red, Ollama (HTTP) y edge-tts (subproceso) no bloquean el bucle
+#  - Whisper (CPU) corre en un pool de ASYNC_ASR_THREADS hilos
+#  - si el cliente se desconecta, la petición se cancela
+#  - con LLM_STREAM, cada frase del LLM va al TTS mientras sigue generando
+# Uso: python -m server.async_main   (o SERVER_MODE = "async")
+# ====================================
+
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from typing import Callable, Optional, Tuple
+
+try:
+    from .config import (
+        HOST, PORT, ACCEPT_BACKLOG, ASYNC_ASR_THREADS, PIPELINE_IN_MEMORY, SOCKET_BUFFER_BYTES,
+        SESSION_IDLE_TIMEOUT_S, RECV_TIMEOUT_S, LLM_STREAM,
+    )
+    from . import transport, utils_net, asr_whisper, llm_ollama, tts_engine, commands, metrics, tracing
+    from . import capture
+    from .tracing import log
+    from .admission import Busy, PRIORITY_ASR, PRIORITY_LLM, log_busy
+    from .history_store import HistoryStore
+    from .wav_utils import make_wav_bytes, silent_wav_bytes
+    from .main import (
+        REPLY_NOT_UNDERSTOOD, REPLY_LLM_ERROR, SILENT_PCM_CHUNK,
+        admission, busy_reply_chunk, busy_reply_wav, start_metrics, warm_up,
+        _count_reply, _history_key, _remember_turn, _request_tmp_paths, _make_silent_wav, _transcribe_upload,
+        _StreamedReply,
+    )
+except ImportError:
+    sys.path.append(os.path.dirname(__file__))
+    from config import (
+        HOST, PORT, ACCEPT_BACKLOG, ASYNC_ASR_THREADS, PIPELINE_IN_MEMORY, SOCKET_BUFFER_BYTES,
+        SESSION_IDLE_TIMEOUT_S, RECV_TIMEOUT_S, LLM_STREAM,
+    )
+    import transport, utils_net, asr_whisper, llm_ollama, tts_engine, commands, metrics, tracing
+    import capture
+    from tracing import log
+    from admission import Busy, PRIORITY_ASR, PRIORITY_LLM, log_busy
+    from history_store import HistoryStore
+    from wav_utils import make_wav_bytes, silent_wav_bytes
+    from main import (
+        REPLY_NOT_UNDERSTOOD, REPLY_LLM_ERROR, SILENT_PCM_CHUNK,
+        admission, busy_reply_chunk, busy_reply_wav, start_metrics, warm_up,
+        _count_reply, _history_key, _remember_turn, _request_tmp_paths, _make_silent_wav, _transcribe_upload,
+        _StreamedReply,
+    )
+
+
+# Whisper no libera el bucle: va a su propio pool para no ocupar el pool por defecto
+_asr_executor = ThreadPoolExecutor(max_workers=ASYNC_ASR_THREADS, thread_name_prefix="federico-asr")
+
+
+async def _reply_text(transcribe: Callable[[], str], histories: HistoryStore,
+                      history_key: str, stream: bool = False) -> str | _StreamedReply:
+    """
+    ASR -> atajos/LLM. Devuelve el texto de la respuesta.
+    'transcribe' hace el ASR de la subida (en streaming, solo lo que falta);
+    el LLM solo ve el historial de 'history_key'.
+    Con 'stream', si responde el LLM devuelve un _StreamedReply que aún se
+    está generando (con la plaza del LLM tomada; el historial, al enviarla).
+    Lanza Busy si el control de admisión no da plaza a Whisper o al LLM.
+    """
+    loop = asyncio.get_running_loop()
+
+    # 1) Transcribir (CPU) en el pool de ASR
+    try:
+        async with admission.slot_async(PRIORITY_ASR):
+            with tracing.stage("asr"):
+                text = await loop.run_in_executor(_asr_executor, tracing.bind(transcribe))
+    except Busy:
+        raise
+    except Exception:
+        log.exception("[SERV] Error en transcripción:")
+        text = ""
+    capture.note(transcript=text)
+
+    if not text.strip():
+        reply_text = REPLY_NOT_UNDERSTOOD
+        _count_reply("not_understood")
+    else:
+        log.debug(f"[SERV] Usuario dijo: {text}")
+
+        # 2) Atajos (algunos hacen HTTP con requests -> a un hilo)
+        with tracing.stage("intents"):
+            handled, short_reply = await asyncio.to_thread(commands.handle_intents, text)
+        if handled and short_reply:
+            reply_text = short_reply
+            _count_reply("intent")
+        elif stream:
+            await admission.acquire_async(PRIORITY_LLM)
+            _count_reply("llm")
+            return _StreamedReply(
+                llm_ollama.stream_llm_async(text, history=histories.get(history_key)), text
+            )
+        else:
+            try:
+                async with admission.slot_async(PRIORITY_LLM):
+                    with tracing.stage("llm"):
+                        reply_text = await llm_ollama.ask_llm_async(
+                            text, history=histories.get(history_key)
+                        )
+                _count_reply("llm")
+            except (asyncio.CancelledError, Busy):
+                raise
+            except Exception:
+                log.exception("[SERV] Error llamando al LLM:")
+                reply_text = REPLY_LLM_ERROR
+                _count_reply("llm_error")
+
+    capture.note(reply_text=reply_text)
+    _remember_turn(histories, history_key, text, reply_text)
+    return reply_text
+
+
+async def _pcm_or_silence_async(chunks):
+    """Reenvía las tramas del TTS; si no sale ninguna, 1 s de silencio."""
+    sent = False
+    try:
+        async for chunk in chunks:
+            sent = True
+            yield chunk
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        log.exception("[SERV] Error en TTS:")
+    if not sent:
+        log.warning("[SERV] TTS falló; devolviendo silencio con texto impreso en consola.")
+        yield SILENT_PCM_CHUNK
+
+
+async def _send_busy_reply_async(writer: asyncio.StreamWriter, stream_fmt: dict | None) -> bool:
+    """Como _send_busy_reply() de main.py."""
+    _count_reply("busy")
+    if utils_net.wants_pcm_stream(stream_fmt):
+        async def _chunks():
+            yield busy_reply_chunk()
+        return await utils_net.send_pcm_stream_async(
+            writer, _chunks(), utils_net.response_codec(stream_fmt)
+        )
+    return await utils_net.send_bytes_async(writer, busy_reply_wav())
+
+
+async def _send_streamed_reply_async(writer: asyncio.StreamWriter, streamed: _StreamedReply,
+                                     stream_fmt: dict | None, t_received: float) -> bool:
+    """Como _send_streamed_reply() de main.py."""
+    if utils_net.wants_pcm_stream(stream_fmt):
+        chunks = _pcm_or_silence_async(tts_engine.iter_tts_pcm_stream_async(streamed))
+        with tracing.stage("stream_reply"):
+            return await utils_net.send_pcm_stream_async(
+                writer, tracing.observe_first_async(chunks, "first_audio", t_received),
+                utils_net.response_codec(stream_fmt),
+            )
+
+    pcm = []
+    fmt = None
+    try:
+        with tracing.stage("tts"):
+            async for data, sr, ch in tts_engine.iter_tts_pcm_stream_async(streamed):
+                if fmt is None:
+                    fmt = (sr, ch)
+                if (sr, ch) == fmt:
+                    pcm.append(data)
+                else:
+                    log.warning(f"[SERV] Frase descartada: el TTS cambió de formato ({sr} Hz, {ch} canales).")
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        log.exception("[SERV] Error en TTS:")
+    if pcm:
+        wav = make_wav_bytes(b"".join(pcm), *fmt)
+    else:
+        log.warning("[SERV] TTS falló; devolviendo WAV vacío con texto impreso en consola.")
+        wav = silent_wav_bytes(1.0)
+    tracing.observe("first_audio", time.perf_counter() - t_received)
+    with tracing.stage("send"):
+        return await utils_net.send_bytes_async(writer, wav)
+
+
+async def _process(writer: asyncio.StreamWriter, transcribe: Callable[[], str],
+                   out_wav: Optional[str], histories: HistoryStore, history_key: str,
+                   stream_fmt: dict | None = None, t_received: float | None = None) -> bool:
+    """
+    Petición completa tras la subida: respuesta, TTS y envío. Devuelve si se envió.
+    Con out_wav=None el WAV de respuesta se queda en memoria.
+    't_received' (perf_counter al acabar la subida) es el origen de "first_audio".
+    """
+    if t_received is None:
+        t_received = time.perf_counter()
+    stream = LLM_STREAM and (out_wav is None or utils_net.wants_pcm_stream(stream_fmt))
+    try:
+        reply_text = await _reply_text(transcribe, histories, history_key, stream)
+    except Busy as e:
+        log_busy(admission, e, writer.get_extra_info("peername"))
+        return await _send_busy_reply_async(writer, stream_fmt)
+    if isinstance(reply_text, _StreamedReply):
+        streamed = reply_text
+        try:
+            ok = await _send_streamed_reply_async(writer, streamed, stream_fmt, t_received)
+        finally:
+            streamed.release()
+        capture.note(reply_text=streamed.text)
+        _remember_turn(histories, history_key, streamed.user_text, streamed.text)
+        return ok
+
+    # 3) Respuesta progresiva: cada frase sale en cuanto está sintetizada
+    if utils_net.wants_pcm_stream(stream_fmt):
+        chunks = _pcm_or_silence_async(tts_engine.iter_tts_pcm_async(reply_text))
+        with tracing.stage("stream_reply"):
+            return await utils_net.send_pcm_stream_async(
+                writer, tracing.observe_first_async(chunks, "first_audio", t_received),
+                utils_net.response_codec(stream_fmt),
+            )
+
+    if out_wav is None:
+        # 3) TTS a WAV en memoria y envío directo
+        wav = None
+        try:
+            with tracing.stage("tts"):
+                wav = await tts_engine.tts_to_wav_bytes_async(reply_text)
+            if not wav:
+                log.warning("[SERV] TTS falló; devolviendo WAV vacío con texto impreso en consola.")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("[SERV] Error en TTS:")
+        tracing.observe("first_audio", time.perf_counter() - t_received)
+        with tracing.stage("send"):
+            return await utils_net.send_bytes_async(writer, wav or silent_wav_bytes(1.0))
+
+    # 3) TTS a WAV y envío
+    try:
+        with tracing.stage("tts"):
+            wav = await tts_engine.tts_to_wav_async(reply_text, out_wav)
+        if not wav or not os.path.exists(out_wav) or os.path.getsize(out_wav) == 0:
+            log.warning("[SERV] TTS falló; devolviendo WAV vacío con texto impreso en consola.")
+            _make_silent_wav(out_wav, 16000, 1, 1.0)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        log.exception("[SERV] Error en TTS:")
+        _make_silent_wav(out_wav, 16000, 1, 1.0)
+
+    tracing.observe("first_audio", time.perf_counter() - t_received)
+    with tracing.stage("send"):
+        return await utils_net.send_file_async(writer, out_wav)
+
+
+async def _handle_turn_async(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                             histories: HistoryStore, header: bytes,
+                             session_id: str | None = None) -> Tuple[bool, bytes]:
+    """
+    Un turno (subida + respuesta). Mientras se procesa se vigila el socket: el
+    cliente no envía nada más tras el audio, así que un EOF significa que se
+    ha ido y la petición se cancela (se mata edge-tts, se corta la llamada a
+    Ollama). Devuelve (respuesta enviada, bytes del turno siguiente que el
+    vigilante haya llegado a leer).
+    """
+    addr = writer.get_extra_info("peername")
+    with tracing.request(client=str(addr), session=session_id) as req, capture.turn(req):
+        ok, carry = await _run_turn_async(reader, writer, histories, header, session_id, addr)
+        if ok and req.reply_trace:
+            ok = await utils_net.send_trace_async(writer, req.summary())
+        metrics.observe("turn", req.elapsed_ms() / 1000)
+        return ok, carry
+
+
+async def _run_turn_async(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                          histories: HistoryStore, header: bytes,
+                          session_id: str | None, addr) -> Tuple[bool, bytes]:
+    log.debug(f"[SERV] Petición de {addr}" + (f" (sesión {session_id})" if session_id else ""))
+
+    history_key = _history_key(addr, session_id)
+    paths = nullcontext((None, None)) if PIPELINE_IN_MEMORY else _request_tmp_paths()
+    with paths as (in_wav, out_wav):
+        transcriber = None
+        stream_fmt = None
+
+        def _on_stream(fmt):
+            nonlocal transcriber, stream_fmt
+            stream_fmt = fmt
+            tracing.current().reply_trace = utils_net.wants_trace(fmt)
+            transcriber = asr_whisper.open_stream(fmt["sample_rate"], fmt["channels"],
+                                                  speaker=history_key, admission=admission)
+            return transcriber.feed
+
+        with tracing.stage("receive"):
+            if PIPELINE_IN_MEMORY:
+                upload = await utils_net.receive_upload_buffer_async(
+                    reader, on_stream=_on_stream, header=header
+                )
+                mode = upload[0] if upload else None
+            else:
+                mode = await utils_net.receive_upload_async(
+                    reader, in_wav, on_stream=_on_stream, header=header
+                )
+        t_received = time.perf_counter()
+        if not mode:
+            log.warning("[SERV] Error recibiendo audio. Cerrando conexión.")
+            if transcriber is not None:
+                transcriber.close()
+            return False, b""
+        if capture.enabled():
+            if PIPELINE_IN_MEMORY:
+                capture.note_upload(upload)
+            else:
+                capture.note_wav_file(mode, in_wav)
+
+        if mode == "stream" and transcriber is not None:
+            transcribe = transcriber.finish
+        elif PIPELINE_IN_MEMORY:
+            transcribe = partial(_transcribe_upload, upload, history_key)
+        else:
+            transcribe = partial(asr_whisper.transcribe_wav, in_wav, speaker=history_key)
+
+        work = asyncio.create_task(_process(
+            writer, transcribe, out_wav, histories, history_key, stream_fmt,
+            t_received,
+        ))
+        watch = asyncio.create_task(reader.read(1))
+        done, _ = await asyncio.wait({work, watch}, return_when=asyncio.FIRST_COMPLETED)
+
+        if work not in done:
+            work.cancel()
+            try:
+                await work
+            except asyncio.CancelledError:
+                pass
+        # Si el turno no llegó a transcribir (ocupado, cancelado), que sus
+        # pasadas no sigan gastando CPU; tras finish() no hace nada
+        if transcriber is not None:
+            transcriber.close()
+        if work not in done:
+            log.info(f"[SERV] Cliente {addr} desconectado; petición cancelada.")
+            return False, b""
+
+        # En una sesión el turno siguiente puede llegar justo al terminar este:
+        # si el vigilante ya leyó su primer byte, se devuelve para no perderlo.
+        carry = b""
+        if watch.done() and not watch.cancelled():
+            carry = watch.result()
+        else:
+            watch.cancel()
+        ok = work.result()
+        if not ok:
+            log.warning("[SERV] Error enviando respuesta al cliente.")
+        log.debug("[SERV] Petición completada.")
+        return ok, carry
+
+
+async def _read_turn_header(reader: asyncio.StreamReader, carry: bytes,
+                            timeout_s: float) -> bytes | None:
+    """8 primeros bytes de un turno (o del saludo de sesión); None si se cerró o venció."""
+    try:
+        rest = await asyncio.wait_for(reader.readexactly(8 - len(carry)), timeout_s)
+        return carry + rest
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+        return None
+
+
+async def handle_client_async(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                              histories: HistoryStore):
+    """
+    Una conexión: un solo turno, o muchos si el cliente abre una sesión
+    persistente (hasta que la cierra o pasa SESSION_IDLE_TIMEOUT_S sin hablar).
+    """
+    addr = writer.get_extra_info("peername")
+    sock = writer.get_extra_info("socket")
+    if sock is not None:
+        transport.tune_socket(sock, buffer_bytes=SOCKET_BUFFER_BYTES)
+    log.debug(f"[SERV] Conexión de {addr}")
+
+    try:
+        header = await _read_turn_header(reader, b"", RECV_TIMEOUT_S)
+        if header is None:
+            return
+        if header != utils_net.SESSION_MAGIC:
+            await _handle_turn_async(reader, writer, histories, header)
+            return
+
+        session_id = await utils_net.accept_session_async(reader, writer, SESSION_IDLE_TIMEOUT_S)
+        if session_id is None:
+            return
+        turns = 0
+        carry = b""
+        while True:
+            header = await _read_turn_header(reader, carry, SESSION_IDLE_TIMEOUT_S)
+            if header is None:
+                break
+            ok, carry = await _handle_turn_async(reader, writer, histories, header, session_id)
+            if not ok:
+                break
+            turns += 1
+        log.debug(f"[SERV] Sesión {session_id} cerrada tras {turns} turno(s).")
+    except Exception:
+        log.exception("[SERV] Excepción manejando cliente:")
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+
+async def serve_async():
+    # Historiales de conversación en memoria (uno por sesión)
+    histories = HistoryStore()
+    start_metrics(histories)
+
+    # Modelos cargados antes de abrir el puerto (mientras, /ready da 503)
+    await asyncio.to_thread(warm_up)
+
+    server = await asyncio.start_server(
+        lambda r, w: handle_client_async(r, w, histories),
+        HOST, PORT, backlog=ACCEPT_BACKLOG, reuse_address=True,
+    )
+    metrics.set_ready()
+    print(f"Modo async: Whisper en {ASYNC_ASR_THREADS} hilo(s)")
+    async with server:
+        await server.serve_forever()
+
+
+def run():
+    """Arranca el bucle de eventos hasta Ctrl+C."""
+    try:
+        asyncio.run(serve_async())
+    except KeyboardInterrupt:
+        print("\n👋 Servidor detenido por usuario.")
+    finally:
+        _asr_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    print("=== Servidor Asistente de Voz (asyncio) ===")
+    print(f"Escuchando en {HOST}:{PORT} (Ctrl+C para salir)")
+    run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+# server/capture.py
+# ====================================
+# Captura de peticiones reales (opcional, CAPTURE_DIR en config.py)
+# Por cada turno se guarda el audio recibido, la transcripción, qué se
+# decidió (atajo, LLM, ocupado...), el texto de la respuesta y los ms por
+# etapa, para reproducirlo después contra el servidor con
+# benchmarks/replay_capture.py (otro Whisper, otro beam, otro modelo...).
+#  - turn(): abre la captura de un turno (en handle_client, junto a la traza)
+#  - note()/note_upload()/note_wav_file(): lo que se va sabiendo del turno
+#  - read_records(): lee un corpus capturado
+# Formato: ficheros capture-<fecha>-<pid>-<n>.fdcap que empiezan por
+# CAPTURE_MAGIC y siguen con registros !II (bytes JSON, bytes audio) + JSON
+# + audio. El PCM va con el códec "zlib" de codec.py (sin pérdidas); lo que
+# no es WAV PCM16 se guarda tal cual. Cuando un fichero pasa de
+# CAPTURE_SEGMENT_BYTES se abre otro, y si la carpeta pasa de
+# CAPTURE_MAX_BYTES se borran los más antiguos.
+# Lo escribe un hilo de fondo (compresión incluida); si la cola se llena,
+# el turno no se captura (y se cuenta).
+# ====================================
+
+from __future__ import annotations
+
+import atexit
+import contextvars
+import itertools
+import json
+import os
+import queue
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+try:
+    from .config import CAPTURE_DIR, CAPTURE_SEGMENT_BYTES, CAPTURE_MAX_BYTES, CAPTURE_QUEUE_MAX
+    from . import codec, metrics
+    from .tracing import RequestTrace, log
+    from .wav_utils import parse_wav_pcm16
+except ImportError:
+    from config import CAPTURE_DIR, CAPTURE_SEGMENT_BYTES, CAPTURE_MAX_BYTES, CAPTURE_QUEUE_MAX
+    import codec, metrics
+    from tracing import RequestTrace, log
+    from wav_utils import parse_wav_pcm16
+
+CAPTURE_MAGIC = b"FDCAP001"
+RECORD_FMT = "!II"  # bytes del JSON, bytes del audio
+SEGMENT_SUFFIX = ".fdcap"
+AUDIO_CODEC = "zlib"
+
+_turn: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    "federico_capture", default=None)
+
+
+def enabled() -> bool:
+    return bool(CAPTURE_DIR)
+
+
+# ---------------------------------------------------------------
+# Lo que se anota durante el turno
+# ---------------------------------------------------------------
+@contextmanager
+def turn(req: RequestTrace):
+    """Captura del turno de 'req': al salir se encola con sus tiempos."""
+    if not CAPTURE_DIR:
+        yield
+        return
+    notes: Dict[str, Any] = {}
+    token = _turn.set(notes)
+    try:
+        yield
+    finally:
+        _turn.reset(token)
+        _submit(req, notes)
+
+
+def note(**fields):
+    """Añade datos al turno en captura (nada si la captura está apagada)."""
+    notes = _turn.get()
+    if notes is not None:
+        notes.update(fields)
+
+
+def note_upload(upload):
+    """Audio de una subida en memoria (utils_net.Upload). Se copia: el buffer es del turno."""
+    notes = _turn.get()
+    if notes is None or upload is None:
+        return
+    mode, audio, fmt = upload
+    notes["mode"] = mode
+    if fmt is None:
+        notes["_audio"] = (bytes(audio), None)
+    else:
+        notes["_audio"] = (bytes(audio), (int(fmt["sample_rate"]), int(fmt["channels"])))
+
+
+def note_wav_file(mode: str, path: str):
+    """Audio de una subida que quedó en disco (PIPELINE_IN_MEMORY = False)."""
+    notes = _turn.get()
+    if notes is None or not mode:
+        return
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        log.debug("[CAP] No se pudo leer la subida:", e)
+        return
+    parsed = parse_wav_pcm16(data)
+    notes["mode"] = mode
+    if parsed is None:
+        notes["_audio"] = (data, None)
+    else:
+        pcm, sr, ch = parsed
+        notes["_audio"] = (bytes(pcm), (sr, ch))
+
+
+def _submit(req: RequestTrace, notes: Dict[str, Any]):
+    audio = notes.pop("_audio", None)
+    if audio is None:
+        return  # la subida no llegó: no hay nada que reproducir
+    meta = {"request_id": req.id, "ts": round(req.wall, 6),
+            "total_ms": round(req.elapsed_ms(), 3),
+            "timings_ms": {k: round(v, 3) for k, v in req.timings.items()}}
+    meta.update(req.attrs)
+    meta.update(notes)
+    if _writer is None:
+        _start_writer()
+    try:
+        _queue.put_nowait((meta, audio))
+    except queue.Full:
+        global _dropped
+        _dropped += 1
+
+
+# ---------------------------------------------------------------
+# Escritura en segundo plano con rotación
+# ---------------------------------------------------------------
+_queue: "queue.Queue" = queue.Queue(maxsize=CAPTURE_QUEUE_MAX)
+_writer: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+_dropped = 0
+_STOP = object()
+
+
+def _encode(meta: dict, audio: Tuple[bytes, Optional[Tuple[int, int]]]) -> bytes:
+    data, fmt = audio
+    if fmt is None:
+        meta["audio"] = "file"
+        payload = data
+    else:
+        meta["audio"] = AUDIO_CODEC
+        meta["sample_rate"], meta["channels"] = fmt
+        meta["audio_s"] = round(len(data) / (2 * fmt[0] * fmt[1]), 3)
+        meta["pcm_bytes"] = len(data)
+        payload = codec.encode(AUDIO_CODEC, data)
+    head = json.dumps(meta, ensure_ascii=False, default=str).encode("utf-8")
+    return struct.pack(RECORD_FMT, len(head), len(payload)) + head + payload
+
+
+def _segments(directory: str):
+    """[(ruta, tamaño, mtime)] de los ficheros de captura, del más antiguo al más nuevo."""
+    out = []
+    for name in os.listdir(directory):
+        if name.endswith(SEGMENT_SUFFIX):
+            path = os.path.join(directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            out.append((path, st.st_size, st.st_mtime))
+    out.sort(key=lambda s: (s[2], s[0]))
+    return out
+
+
+def _enforce_cap(keep: Optional[str]):
+    """Borra los ficheros más antiguos hasta quedar por debajo de CAPTURE_MAX_BYTES."""
+    segments = _segments(CAPTURE_DIR)
+    total = sum(size for _, size, _ in segments)
+    for path, size, _ in segments:
+        if total <= CAPTURE_MAX_BYTES:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+            log.debug(f"[CAP] Borrado {os.path.basename(path)} (tope de {CAPTURE_MAX_BYTES} bytes)")
+        except OSError:
+            pass
+
+
+_segment_ids = itertools.count(1)
+
+
+def _open_segment():
+    os.makedirs(CAPTURE_DIR, exist_ok=True)
+    name = (f"capture-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-"
+            f"{next(_segment_ids)}{SEGMENT_SUFFIX}")
+    path = os.path.join(CAPTURE_DIR, name)
+    f = open(path, "wb")
+    f.write(CAPTURE_MAGIC)
+    _enforce_cap(keep=path)
+    return path, f
+
+
+def _write_loop(q: "queue.Queue"):
+    path, f, size = None, None, 0
+    while True:
+        item = q.get()
+        if item is _STOP:
+            if f is not None:
+                f.close()
+            return
+        try:
+            rec = _encode(*item)
+            if f is None or size + len(rec) > CAPTURE_SEGMENT_BYTES:
+                if f is not None:
+                    f.close()
+                path, f = _open_segment()
+                size = len(CAPTURE_MAGIC)
+            f.write(rec)
+            f.flush()
+            size += len(rec)
+        except Exception as e:
+            log.warning("[CAP] Error guardando la captura:", e)
+
+
+def _start_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_loop, args=(_queue,),
+                                       name="federico-capture", daemon=True)
+            _writer.start()
+
+
+def flush(timeout: float = 5.0):
+    """Escribe lo pendiente y cierra el fichero actual (al salir)."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is None:
+        return
+    try:
+        _queue.put(_STOP, timeout=timeout)
+    except queue.Full:
+        return
+    writer.join(timeout)
+
+
+def _after_fork_in_child():
+    global _queue, _writer, _writer_lock, _dropped
+    _queue = queue.Queue(maxsize=CAPTURE_QUEUE_MAX)
+    _writer = None
+    _writer_lock = threading.Lock()
+    _dropped = 0
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+atexit.register(flush)
+metrics.register_collector(lambda: [
+    ("capture_dropped_total", "counter", "Turnos sin capturar por cola llena.", _dropped),
+] if CAPTURE_DIR else [])
+
+
+# ---------------------------------------------------------------
+# Lectura del corpus
+# ---------------------------------------------------------------
+def read_records(path: str) -> Iterator[Tuple[dict, bytes]]:
+    """
+    (meta, audio) de cada turno capturado en 'path' (un fichero .fdcap o una
+    carpeta). 'audio' es PCM16 si meta["audio"] != "file", o el fichero
+    recibido tal cual. Un registro cortado al final (proceso matado) se ignora.
+    """
+    if os.path.isdir(path):
+        files = [p for p, _, _ in _segments(path)]
+    else:
+        files = [path]
+    hdr_size = struct.calcsize(RECORD_FMT)
+    for name in files:
+        with open(name, "rb") as f:
+            if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+                log.warning(f"[CAP] {name} no es un fichero de captura.")
+                continue
+            while True:
+                hdr = f.read(hdr_size)
+                if len(hdr) < hdr_size:
+                    break
+                head_len, audio_len = struct.unpack(RECORD_FMT, hdr)
+                head = f.read(head_len)
+                payload = f.read(audio_len)
+                if len(head) < head_len or len(payload) < audio_len:
+                    break
+                meta = json.loads(head.decode("utf-8"))
+                if meta.get("audio") != "file":
+                    payload = bytes(codec.decode(meta.get("audio", AUDIO_CODEC), payload,
+                                                 meta.get("pcm_bytes")))
+                yield meta, payload
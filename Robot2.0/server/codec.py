@@ -0,0 +1,131 @@
+# codec.py
+# ====================================
+# Códecs de audio para la red, comunes a servidor y clientes
+# (el mismo fichero en server/, client/ y TermuxClient/federico/;
+#  no importa config para que valga tal cual en los tres sitios)
+#  - "pcm16": PCM16 crudo, sin comprimir (lo de siempre, ~32 KB/s a 16 kHz)
+#  - "zlib":  sin pérdidas: diferencia entre muestras consecutivas, bytes
+#             bajos y altos por separado y zlib nivel 1 (barato en el móvil)
+#  - "ulaw":  G.711 mu-law, 8 bits por muestra (la mitad exacta); con
+#             pérdida, pero de sobra para voz y para Whisper
+# Cada trama se codifica sola (sin estado entre tramas): se decodifica
+# según llega y cualquier trama se puede reenviar suelta.
+# Entrada y salida siempre PCM16 little-endian; todo en memoria con NumPy.
+# ====================================
+
+from __future__ import annotations
+
+import zlib
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+PCM16 = "pcm16"
+# Todos los que sabe este fichero (el orden es la preferencia por defecto)
+CODECS: Tuple[str, ...] = ("zlib", "ulaw", PCM16)
+
+ZLIB_LEVEL = 1  # más nivel apenas comprime más voz y cuesta bastante CPU
+
+_ULAW_BIAS = 0x84
+_ULAW_CLIP = 32635
+
+
+def _samples(pcm) -> np.ndarray:
+    """Vista int16 (sin copia) de un buffer PCM16."""
+    return np.frombuffer(pcm, dtype="<i2", count=len(pcm) // 2)
+
+
+# ---------------------------------------------------------------
+# zlib sobre diferencias (sin pérdidas)
+# ---------------------------------------------------------------
+def _zlib_encode(pcm) -> bytes:
+    x = _samples(pcm)
+    d = np.empty_like(x)
+    if len(x):
+        # La resta desborda igual que la suma de decode(): el ciclo es exacto
+        d[0] = x[0]
+        np.subtract(x[1:], x[:-1], out=d[1:])
+    # [bytes bajos..., bytes altos...]: los altos son casi todos 0x00/0xFF
+    planes = d.view(np.uint8).reshape(-1, 2).T
+    return zlib.compress(planes.tobytes(), ZLIB_LEVEL)
+
+
+def _zlib_decode(data, max_bytes: Optional[int]) -> bytes:
+    dec = zlib.decompressobj()
+    raw = dec.decompress(data, max_bytes or 0)
+    if dec.unconsumed_tail:
+        raise ValueError(f"trama zlib de más de {max_bytes} bytes")
+    n = len(raw) // 2
+    planes = np.frombuffer(raw, dtype=np.uint8, count=2 * n).reshape(2, n)
+    d = np.ascontiguousarray(planes.T).view("<i2").ravel()
+    return np.cumsum(d, dtype="<i2").tobytes()
+
+
+# ---------------------------------------------------------------
+# G.711 mu-law (con pérdida, 2:1)
+# ---------------------------------------------------------------
+# Exponente = posición del bit más alto de (magnitud >> 7)
+_ULAW_EXP = np.array([0] + [int(i).bit_length() - 1 for i in range(1, 256)], dtype=np.int32)
+
+
+def _ulaw_table() -> np.ndarray:
+    u = ~np.arange(256, dtype=np.int32) & 0xFF
+    exp = (u >> 4) & 0x07
+    mag = (((u & 0x0F) << 3) + _ULAW_BIAS << exp) - _ULAW_BIAS
+    return np.where(u & 0x80, -mag, mag).astype("<i2")
+
+
+_ULAW_DECODE = _ulaw_table()
+
+
+def _ulaw_encode(pcm) -> bytes:
+    x = _samples(pcm).astype(np.int32)
+    sign = (x < 0).astype(np.int32) << 7
+    mag = np.minimum(np.abs(x), _ULAW_CLIP) + _ULAW_BIAS
+    exp = _ULAW_EXP[mag >> 7]
+    mant = (mag >> (exp + 3)) & 0x0F
+    return (~(sign | (exp << 4) | mant) & 0xFF).astype(np.uint8).tobytes()
+
+
+def _ulaw_decode(data, max_bytes: Optional[int]) -> bytes:
+    if max_bytes and 2 * len(data) > max_bytes:
+        raise ValueError(f"trama mu-law de más de {max_bytes} bytes")
+    return _ULAW_DECODE[np.frombuffer(data, dtype=np.uint8)].tobytes()
+
+
+# ---------------------------------------------------------------
+# API
+# ---------------------------------------------------------------
+def encode(codec: str, pcm):
+    """PCM16 -> trama codificada. Con "pcm16" devuelve 'pcm' tal cual."""
+    if codec == PCM16:
+        return pcm
+    if codec == "zlib":
+        return _zlib_encode(pcm)
+    if codec == "ulaw":
+        return _ulaw_encode(pcm)
+    raise ValueError(f"códec desconocido: {codec!r}")
+
+
+def decode(codec: str, data, max_bytes: Optional[int] = None):
+    """
+    Trama codificada -> PCM16. Con "pcm16" devuelve 'data' tal cual.
+    'max_bytes' limita el PCM resultante (ValueError si se pasa), para que
+    una trama pequeña no se convierta en cientos de MB al descomprimir.
+    """
+    if codec == PCM16:
+        return data
+    if codec == "zlib":
+        return _zlib_decode(data, max_bytes)
+    if codec == "ulaw":
+        return _ulaw_decode(data, max_bytes)
+    raise ValueError(f"códec desconocido: {codec!r}")
+
+
+def choose(preferred: Iterable[str], supported: Iterable[str]) -> str:
+    """Primer códec de 'preferred' que también está en 'supported' (o "pcm16")."""
+    supported = set(supported or ()) & set(CODECS)
+    for name in preferred or ():
+        if name in supported:
+            return name
+    return PCM16
@@ -23,8 +23,8 @@ from .config import (
     INTENT_FRIENDS_KEYWORDS,
     INTENT_SHUTUP_KEYWORDS,
     NEWS_FEEDS,
-    debug_enabled,
 )
+from .tracing import log, span
 
 # -----------------------
 # Normalización sencilla
@@ -62,8 +62,9 @@ def is_shutup(text: str) -> bool:
 # -----------------------
 def _rss_items(url: str, limit: int = 5) -> list[str]:
     try:
-        r = requests.get(url, timeout=6)
-        r.raise_for_status()
+        with span("rss", url=url):
+            r = requests.get(url, timeout=6)
+            r.raise_for_status()
         root = ET.fromstring(r.content)
         items = []
         # RSS <channel><item>
@@ -84,8 +85,7 @@ def _rss_items(url: str, limit: int = 5) -> list[str]:
                     items.append(tit)
         return items
     except Exception as e:
-        if debug_enabled():
-            print("[NEWS] Error leyendo feed:", url, e)
+        log.debug("[NEWS] Error leyendo feed:", url, e)
         return []
 
 def get_news(limit_total: int = 6) -> str:
@@ -162,8 +162,7 @@ def list_friends() -> str:
             return "La lista de amigos está vacía."
         return "Tus amigos: " + ", ".join(lines) + "."
     except Exception as e:
-        if debug_enabled():
-            print("[FRIENDS] Error:", e)
+        log.debug("[FRIENDS] Error:", e)
         return "No pude leer la lista de amigos."
 
 # -----------------------
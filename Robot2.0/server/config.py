@@ -3,6 +3,9 @@
 # Configuración del SERVIDOR
 # ============================
 
+import json
+import os
+
 # --- Red / Escucha ---
 HOST = "0.0.0.0"     # escucha en todas las interfaces de la LAN
 PORT = 5000
@@ -11,11 +14,73 @@ PORT = 5000
 ACCEPT_BACKLOG = 5
 RECV_TIMEOUT_S = 120
 SEND_TIMEOUT_S = 120
-BUFFER_SIZE = 4096
+BUFFER_SIZE = 256 * 1024               # bloque para leer/escribir WAV en disco
+SOCKET_BUFFER_BYTES = 0                # SO_SNDBUF/SO_RCVBUF; 0 => autoajuste del sistema
+
+# --- Concurrencia ---
+# "serial": atiende una conexión cada vez (comportamiento original)
+# "pool":   pool de hilos, hasta SERVER_WORKERS peticiones en paralelo
+# "prefork": PREFORK_PROCESSES procesos (solo Linux) aceptando en el mismo
+#            puerto con SO_REUSEPORT; cada uno con PREFORK_THREADS hilos
+# "async":  servidor asyncio (server/async_main.py); Whisper en ASYNC_ASR_THREADS hilos
+SERVER_MODE = "pool"
+SERVER_WORKERS = 4
+SHUTDOWN_GRACE_S = 30                  # espera máx. a peticiones en curso al parar
+
+PREFORK_PROCESSES = 0                  # 0 => uno por núcleo
+PREFORK_THREADS = 2                    # hilos por proceso (solapa red/LLM con ASR)
+PREFORK_RESTART_DELAY_S = 1.0          # pausa antes de relanzar un worker caído
+
+ASYNC_ASR_THREADS = 2                  # hilos para la inferencia de Whisper en modo async
+
+# Control de admisión (server/admission.py) para Whisper y el LLM, en todos
+# los modos: ADMISSION_MAX_ACTIVE a la vez; el resto espera en una cola de
+# ADMISSION_MAX_QUEUE como mucho ADMISSION_MAX_WAIT_S (muy por debajo del
+# RECV_TIMEOUT_S de los clientes). Si no hay sitio se responde al momento con
+# el audio pregrabado de REPLY_BUSY. Los atajos no esperan a la cola del LLM.
+# En streaming, las pasadas incrementales solo usan una plaza si está libre
+# (si no, se saltan); los trozos anticipados (STREAM_ASR_MODE = "chunked")
+# quedan fuera del control: como mucho STREAM_ASR_THREADS más a la vez.
+ADMISSION_MAX_ACTIVE = 4                # >= WHISPER_BATCH_MAX para que se llenen los lotes
+ADMISSION_MAX_QUEUE = 8
+ADMISSION_MAX_WAIT_S = 30
+
+# Sesiones persistentes: el cliente abre una conexión y hace muchos turnos.
+# Se cierran si pasan SESSION_IDLE_TIMEOUT_S sin un turno nuevo.
+SESSION_IDLE_TIMEOUT_S = 600
 
-# --- Rutas temporales ---
+# Códecs de audio en la red (codec.py) que acepta el servidor, por preferencia.
+# Se anuncian al abrir la sesión; la subida usa el que elija el cliente y la
+# respuesta progresiva el primero de los que acepta el cliente.
+#  "zlib": sin pérdidas · "ulaw": con pérdida, la mitad · "pcm16": sin comprimir
+AUDIO_CODECS = ("zlib", "ulaw", "pcm16")
+
+# --- Audio en memoria ---
+# True: el audio recibido y el de TTS viajan en memoria de punta a punta
+# (sin escribir ni leer WAV en disco). False: ruta clásica con ficheros,
+# útil para depurar (los WAV quedan en disco para escucharlos).
+PIPELINE_IN_MEMORY = True
+UPLOAD_PREALLOC_BYTES = 1024 * 1024    # reserva inicial para subidas en streaming (~32 s a 16 kHz mono)
+MAX_UPLOAD_BYTES = 64 * 1024 * 1024    # subidas más grandes se rechazan
+
+# --- Rutas temporales (solo con PIPELINE_IN_MEMORY = False) ---
 IN_AUDIO_WAV = "input_server.wav"      # audio recibido del cliente
 OUT_TTS_WAV  = "output_server.wav"     # respuesta TTS a enviar
+# En modo "pool" cada petición usa sus propios ficheros en una carpeta temporal.
+# None => carpeta temporal del sistema.
+REQUEST_TMP_DIR = None
+
+# --- Reparto de CPU (server/cpu_budget.py) ---
+# Whisper, la voz offline (pyttsx3) y Ollama comparten máquina: sin reparto,
+# cada uno lanza un hilo por núcleo y se pisan. CPU_BUDGET núcleos se reparten así:
+#  - TTS: CPU_TTS_CORES (pyttsx3 sintetiza de una en una: con uno basta)
+#  - Ollama: CPU_OLLAMA_SHARE de lo que queda, como "num_thread" (solo si
+#    OLLAMA_URL es esta máquina; OLLAMA_NUM_THREAD lo fija a mano)
+#  - Whisper: el resto, a partes iguales entre sus réplicas (WHISPER_WORKERS)
+CPU_BUDGET = 0                         # 0 => todos los núcleos de la máquina
+CPU_TTS_CORES = 1
+CPU_OLLAMA_SHARE = 0.5
+OLLAMA_NUM_THREAD = None               # None => según el reparto; 0 => no se envía (decide Ollama)
 
 # --- Whisper (STT) ---
 # Modelos posibles: "tiny", "base", "small", "medium", "large-v3"
@@ -23,11 +88,84 @@ WHISPER_MODEL_SIZE = "small"
 WHISPER_DEVICE = "cpu"                 # "cpu" o "cuda"
 WHISPER_COMPUTE_TYPE = "int8"          # en CPU: "int8" o "int8_float16"
 WHISPER_LANGUAGE = "es"                # None para autodetección
+WHISPER_BEAM_SIZE = 1                  # 1 para velocidad; >1 mejora precisión
+WHISPER_VAD_MIN_SILENCE_MS = 300       # silencio que separa dos tramos de voz (VAD de Whisper)
+WHISPER_VAD_THRESHOLD = 0.5            # probabilidad de voz a partir de la que un tramo cuenta
+# Réplicas de cada modelo: hasta WHISPER_WORKERS transcripciones (o lotes) a
+# la vez sin repartirse un mismo modelo; cada una va a la réplica menos
+# ocupada. Cada réplica ocupa su memoria (cuenta en WHISPER_POOL_MEMORY_MB).
+WHISPER_WORKERS = 1
+WHISPER_CPU_THREADS = 0                # hilos por réplica; 0 => núcleos de Whisper / WHISPER_WORKERS
+
+# Con WHISPER_LANGUAGE = None, idioma detectado por hablante (sesión, o IP si
+# no hay sesión; server/language_cache.py). Si la detección llega a
+# ASR_LANG_CACHE_MIN_PROB, sus turnos siguientes van con ese idioma: sin
+# detección y por lotes, como con idioma fijo. Se vuelve a detectar cada
+# ASR_LANG_PROBE_EVERY turnos y cuando un turno con el idioma recordado sale
+# con avg_logprob < ASR_LANG_RECHECK_LOGPROB (ese turno se repite detectando).
+ASR_LANG_CACHE = True
+ASR_LANG_CACHE_MIN_PROB = 0.8
+ASR_LANG_PROBE_EVERY = 20              # 0 => sin sondeo periódico
+ASR_LANG_RECHECK_LOGPROB = -1.0
+ASR_LANG_CACHE_MAX = 1024              # hablantes recordados (se olvida el menos reciente)
+
+# Pool de modelos (del más rápido al más preciso). WHISPER_MODEL_SIZE es el
+# principal y se carga siempre; los demás solo si caben en
+# WHISPER_POOL_MEMORY_MB (estimación en server/asr_whisper.py:MODEL_MEMORY_MB).
+#  - locuciones de hasta WHISPER_SHORT_S s: el modelo más rápido
+#  - con WHISPER_BUSY_QUEUE transcripciones o más en marcha: el anterior al principal
+#  - si un modelo menor responde con avg_logprob < WHISPER_RETRY_LOGPROB, se
+#    repite con el principal (None => nunca)
+# WHISPER_MODEL_POOL = (WHISPER_MODEL_SIZE,) deja un solo modelo, como antes.
+WHISPER_MODEL_POOL = ("tiny", "small")
+WHISPER_POOL_MEMORY_MB = 1024
+WHISPER_SHORT_S = 2.0
+WHISPER_BUSY_QUEUE = 4
+WHISPER_RETRY_LOGPROB = -0.8
+
+# Recorte de silencio por energía antes de Whisper (server/silence.py): se
+# quitan el silencio inicial (calibración del micro incluida) y la cola; una
+# grabación sin voz se contesta con "no he entendido" sin llamar al modelo.
+ASR_TRIM_SILENCE = True
+ASR_TRIM_MIN_DBFS = -50.0              # por debajo es silencio siempre (el VAD del cliente corta en ~-36)
+ASR_TRIM_MARGIN_DB = 10.0              # voz = tramos que superan así el ruido de fondo
+ASR_TRIM_MIN_SPEECH_MS = 120           # menos voz que esto => grabación vacía
+ASR_TRIM_PAD_MS = 200                  # margen que se deja antes y después de la voz
+
+# Lotes: las locuciones que llegan casi a la vez (varios clientes hablando)
+# se transcriben juntas, que en CPU rinde bastante más que una a una. La
+# primera espera como mucho WHISPER_BATCH_WINDOW_MS a que lleguen más.
+# Solo con WHISPER_LANGUAGE fijo y locuciones de hasta 30 s; para llenar
+# los lotes, ADMISSION_MAX_ACTIVE tiene que ser >= WHISPER_BATCH_MAX.
+WHISPER_BATCH_MAX = 4                  # locuciones por lote; 1 => sin lotes
+WHISPER_BATCH_WINDOW_MS = 40
+WHISPER_BATCH_TIMEOUT_S = 15           # espera máxima por el lote; muy por debajo de RECV_TIMEOUT_S
+
+# Subidas en streaming: se transcribe mientras el usuario habla.
+# "chunked": cuando hay STREAM_ASR_SEGMENT_S s sin transcribir, se corta en
+#   el punto más silencioso de los últimos STREAM_ASR_SEARCH_S s y ese trozo
+#   va a Whisper.
+# "incremental": cada STREAM_ASR_STEP_S s de audio nuevo se vuelve a
+#   decodificar lo no confirmado; lo que repiten dos pasadas seguidas queda
+#   confirmado. Al terminar solo falta el final (hipótesis parciales en el log
+#   de depuración y para quien las pida con on_partial).
+STREAM_ASR_MODE = "incremental"
+STREAM_ASR_SEGMENT_S = 5.0
+STREAM_ASR_SEARCH_S = 1.0
+STREAM_ASR_STEP_S = 1.0
+STREAM_ASR_WINDOW_S = 15.0             # ventana sin confirmar más larga => se fuerza el corte
+STREAM_ASR_THREADS = 2                 # hilos compartidos para las pasadas y los trozos
 
 # --- Ollama (LLM local) ---
 OLLAMA_URL = "http://127.0.0.1:11434"
 OLLAMA_MODEL = "llama3.2:latest"             # cambia al modelo que tengas descargado
 OLLAMA_TIMEOUT_S = 60                  # timeout HTTP
+OLLAMA_KEEP_ALIVE = "30m"              # cuánto deja Ollama el modelo en memoria tras cada uso; -1 => siempre
+# Respuesta del LLM token a token ("stream": true): cada frase va al TTS en
+# cuanto se completa, mientras el modelo sigue generando. Solo en respuestas
+# progresivas (PCM por tramas) y WAV en memoria; la ruta con ficheros espera
+# la respuesta entera.
+LLM_STREAM = True
 
 # Prompt del sistema
 SYSTEM_PROMPT = (
@@ -35,6 +173,13 @@ SYSTEM_PROMPT = (
     "Si te piden chistes o bromas puedes ser un poco colega pero respetuoso."
 )
 
+# Historial de conversación: uno por sesión (o por IP si el cliente no abre
+# sesión). Tokens estimados a ~4 caracteres por token.
+HISTORY_MAX_TOKENS = 2000              # por sesión; se quitan los turnos más antiguos
+HISTORY_TOTAL_MAX_TOKENS = 200_000     # entre todas; se olvidan las menos recientes (LRU)
+HISTORY_MAX_SESSIONS = 256
+HISTORY_IDLE_TTL_S = 6 * 3600          # historiales sin uso en este tiempo se borran
+
 # --- TTS ---
 USE_EDGE_TTS = True
 EDGE_TTS_VOICE = "es-ES-ElviraNeural"  # o "es-ES-AlvaroNeural"
@@ -45,6 +190,11 @@ EDGE_TTS_VOLUME = "+0%"
 # pyttsx3 (offline)
 PYTTSX3_RATE = 170
 
+# Respuesta progresiva (si el cliente la pide): una trama PCM por frase.
+# Las frases se sintetizan en paralelo y se envían en orden.
+TTS_STREAM_PARALLEL = 3
+TTS_STREAM_MIN_CHARS = 12              # frases más cortas se unen a la siguiente
+
 # --- Intenciones simples ---
 WAKE_WORD = "federico"
 INTENT_NEWS_KEYWORDS = ["noticias", "titulares", "resumen de noticias", "leer noticias"]
@@ -62,9 +212,72 @@ DEFAULT_CITY = "Bilbao"
 DEFAULT_LAT = 43.2630
 DEFAULT_LON = -2.9350
 
-# --- Logging ---
-LOG_LEVEL = "DEBUG"
+# --- Arranque en caliente (server/warmup.py) ---
+# Antes de abrir el puerto se carga Whisper y se transcribe un audio de
+# prueba, se pide a Ollama que cargue OLLAMA_MODEL y se sintetiza una frase
+# con edge-tts y con pyttsx3, en paralelo. Así el primer usuario tras un
+# reinicio no paga las cargas. Mientras tanto /ready (junto a /metrics)
+# responde 503; al terminar, 200. Un componente que falla no impide arrancar.
+WARMUP_ENABLED = True
+WARMUP_WHISPER = True
+WARMUP_OLLAMA = True
+WARMUP_TTS = True
+WARMUP_OLLAMA_TIMEOUT_S = 300          # cargar un modelo grande desde disco tarda más que una respuesta
+
+# --- Logging y trazas (server/tracing.py) ---
+# Cada turno lleva un request_id que aparece en sus mensajes y trazas.
+# Mensajes y trazas los escribe un hilo de fondo (no frenan las peticiones).
+LOG_LEVEL = "INFO"                     # consola: "DEBUG", "INFO", "WARNING" o "ERROR"
+# TRACE_FILE crece sin límite (un registro por tramo de cada turno): solo se
+# activa a propósito, p. ej. TRACE_FILE = "server_trace.jsonl" para medir.
+TRACE_FILE = None                      # tramos con tiempos y mensajes, JSON por línea; None => no
+TRACE_LEVEL = "INFO"                   # nivel mínimo de los mensajes que van a TRACE_FILE
+TRACE_QUEUE_MAX = 10000                # registros pendientes de escribir; si se llena se descartan
+TRACE_REPLY_TO_CLIENT = True           # el cliente puede pedir su request_id y ms por etapa
+
+# --- Métricas (server/metrics.py) ---
+# Latencia por etapa (histograma + p50/p95/p99) y qué backend atendió cada
+# petición, en formato Prometheus en http://METRICS_HOST:METRICS_PORT/metrics.
+# En modo prefork cada proceso sirve las suyas en METRICS_PORT + 1 + nº de worker.
+METRICS_ENABLED = True
+METRICS_HOST = "127.0.0.1"             # solo local; "0.0.0.0" para leerlas desde otra máquina
+METRICS_PORT = 9108
+METRICS_WINDOW = 1024                  # últimas muestras por etapa para los percentiles
+
+# --- Captura de peticiones (server/capture.py) ---
+# Guarda cada turno (audio recibido, transcripción, decisión, texto de la
+# respuesta y ms por etapa) para repetirlo con benchmarks/replay_capture.py.
+# Es la voz de los usuarios: solo se activa a propósito. None => desactivada.
+CAPTURE_DIR = None
+CAPTURE_SEGMENT_BYTES = 16 * 1024 * 1024   # fichero nuevo al llegar a este tamaño
+CAPTURE_MAX_BYTES = 512 * 1024 * 1024      # tope de la carpeta; se borran los ficheros más antiguos
+CAPTURE_QUEUE_MAX = 64                     # turnos pendientes de escribir; si se llena no se capturan
+
+# --- Ajustes medidos de Whisper (benchmarks/tune_asr.py) ---
+# Si existe, este JSON sustituye los valores de arriba que eligió el afinador
+# en esta máquina (solo los de ASR_TUNABLE). None => no se carga.
+ASR_TUNED_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "asr_tuned.json")
+ASR_TUNABLE = (
+    "WHISPER_MODEL_SIZE", "WHISPER_COMPUTE_TYPE", "WHISPER_BEAM_SIZE",
+    "WHISPER_VAD_MIN_SILENCE_MS", "WHISPER_VAD_THRESHOLD", "WHISPER_CPU_THREADS",
+)
+
+
+def _load_tuned(path):
+    if not path or not os.path.isfile(path):
+        return
+    try:
+        with open(path, encoding="utf-8") as f:
+            settings = json.load(f).get("settings", {})
+    except (OSError, ValueError) as e:
+        print(f"[CFG] No se pudo leer {path}: {e}")
+        return
+    for name, value in settings.items():
+        if name in ASR_TUNABLE:
+            globals()[name] = value
+
 
+_load_tuned(ASR_TUNED_FILE)
 
 
 def debug_enabled() -> bool:
@@ -0,0 +1,56 @@
+# server/cpu_budget.py
+# ====================================
+# Reparto de núcleos entre Whisper, pyttsx3 y Ollama (CPU_* en config.py)
+#  - split(): núcleos de cada uno en esta máquina
+#  - whisper_threads(): hilos de CTranslate2 para cada réplica de Whisper
+#  - ollama_num_thread(): "num_thread" para las peticiones a Ollama, o None
+# En prefork, los núcleos de Whisper se reparten además entre los procesos.
+# ====================================
+
+from __future__ import annotations
+
+import os
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+try:
+    from .config import (
+        CPU_BUDGET, CPU_TTS_CORES, CPU_OLLAMA_SHARE, OLLAMA_NUM_THREAD, OLLAMA_URL,
+        WHISPER_WORKERS, WHISPER_CPU_THREADS,
+    )
+except ImportError:
+    from config import (
+        CPU_BUDGET, CPU_TTS_CORES, CPU_OLLAMA_SHARE, OLLAMA_NUM_THREAD, OLLAMA_URL,
+        WHISPER_WORKERS, WHISPER_CPU_THREADS,
+    )
+
+_LOCAL_HOSTS = {"127.0.0.1", "localhost", "::1", "0.0.0.0"}
+
+
+def ollama_is_local() -> bool:
+    return (urlsplit(OLLAMA_URL).hostname or "") in _LOCAL_HOSTS
+
+
+def split() -> Dict[str, int]:
+    """Núcleos para "whisper", "tts" y "ollama" (0 = no se le reserva nada)."""
+    total = CPU_BUDGET or os.cpu_count() or 1
+    tts = min(CPU_TTS_CORES, total - 1) if total > 1 else 0
+    ollama = 0
+    if ollama_is_local():
+        ollama = OLLAMA_NUM_THREAD if OLLAMA_NUM_THREAD is not None else int((total - tts) * CPU_OLLAMA_SHARE)
+        ollama = min(ollama, total - tts - 1) if total - tts > 1 else 0
+    return {"whisper": max(1, total - tts - ollama), "tts": tts, "ollama": ollama}
+
+
+def whisper_threads(processes: int = 1) -> int:
+    """Hilos de CTranslate2 por réplica: WHISPER_CPU_THREADS o el reparto."""
+    if WHISPER_CPU_THREADS:
+        return WHISPER_CPU_THREADS
+    return max(1, split()["whisper"] // max(1, processes) // max(1, WHISPER_WORKERS))
+
+
+def ollama_num_thread() -> Optional[int]:
+    """num_thread para Ollama, o None si no hay que mandarlo."""
+    if OLLAMA_NUM_THREAD is not None:
+        return OLLAMA_NUM_THREAD or None
+    return split()["ollama"] or None
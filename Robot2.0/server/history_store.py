@@ -0,0 +1,150 @@
+# server/history_store.py
+# ====================================
+# Historial de conversación por sesión
+#  - Cada clave (ID de sesión, o IP del cliente si no abrió sesión) tiene su
+#    propio historial: dos personas hablando no se mezclan el contexto
+#  - Se acota por tokens, no por número de mensajes: al pasarse de
+#    HISTORY_MAX_TOKENS se quitan los turnos más antiguos
+#  - Tope global (HISTORY_TOTAL_MAX_TOKENS / HISTORY_MAX_SESSIONS): se olvidan
+#    primero las sesiones que llevan más tiempo sin hablar (LRU), y del todo
+#    las que pasan HISTORY_IDLE_TTL_S sin uso
+#  - Seguro entre hilos; get() devuelve una copia, así la llamada al LLM no
+#    bloquea a nadie
+# Los tokens se estiman (~4 caracteres por token): para acotar memoria y
+# contexto no hace falta el tokenizador del modelo.
+# ====================================
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+try:
+    from .config import (
+        HISTORY_MAX_TOKENS, HISTORY_TOTAL_MAX_TOKENS, HISTORY_MAX_SESSIONS, HISTORY_IDLE_TTL_S,
+    )
+    from .tracing import log
+except ImportError:
+    from config import (
+        HISTORY_MAX_TOKENS, HISTORY_TOTAL_MAX_TOKENS, HISTORY_MAX_SESSIONS, HISTORY_IDLE_TTL_S,
+    )
+    from tracing import log
+
+Message = Dict[str, str]
+
+
+def estimate_tokens(text: str) -> int:
+    """Tokens aproximados de un mensaje: ~4 caracteres por token + formato del chat."""
+    return len(text) // 4 + 4
+
+
+class _Conversation:
+    __slots__ = ("messages", "tokens", "last_used")
+
+    def __init__(self):
+        self.messages: List[Message] = []
+        self.tokens = 0
+        self.last_used = time.monotonic()
+
+
+class HistoryStore:
+    """
+    Historiales por clave con presupuesto de tokens y desalojo LRU.
+    Las conversaciones se guardan en un OrderedDict del menos al más
+    reciente: desalojar es sacar por el principio.
+    """
+
+    def __init__(self, max_tokens: int = HISTORY_MAX_TOKENS,
+                 total_max_tokens: int = HISTORY_TOTAL_MAX_TOKENS,
+                 max_sessions: int = HISTORY_MAX_SESSIONS,
+                 idle_ttl_s: Optional[float] = HISTORY_IDLE_TTL_S):
+        self.max_tokens = max_tokens
+        self.total_max_tokens = total_max_tokens
+        self.max_sessions = max_sessions
+        self.idle_ttl_s = idle_ttl_s
+        self._convs: "OrderedDict[str, _Conversation]" = OrderedDict()
+        self._total_tokens = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> List[Message]:
+        """Copia del historial de 'key' (lista vacía si no hay)."""
+        with self._lock:
+            self._expire()
+            conv = self._convs.get(key)
+            if conv is None:
+                return []
+            self._touch(key, conv)
+            return list(conv.messages)
+
+    def append_turn(self, key: str, user_text: str, reply_text: str):
+        """Añade un turno (usuario + asistente) y recorta lo que sobre."""
+        turn = [{"role": "user", "content": user_text},
+                {"role": "assistant", "content": reply_text}]
+        with self._lock:
+            conv = self._convs.get(key)
+            if conv is None:
+                conv = self._convs[key] = _Conversation()
+            self._touch(key, conv)
+            for msg in turn:
+                conv.messages.append(msg)
+                self._add_tokens(conv, estimate_tokens(msg["content"]))
+
+            # Presupuesto por sesión: fuera turnos antiguos (el último se queda siempre)
+            while conv.tokens > self.max_tokens and len(conv.messages) > 2:
+                for msg in conv.messages[:2]:
+                    self._add_tokens(conv, -estimate_tokens(msg["content"]))
+                del conv.messages[:2]
+
+            self._expire()
+            self._evict(keep=key)
+
+    def forget(self, key: str):
+        """Borra el historial de 'key'."""
+        with self._lock:
+            self._drop(key)
+
+    def stats(self) -> Dict[str, int]:
+        """Sesiones y tokens guardados (para logs/métricas)."""
+        with self._lock:
+            return {"sessions": len(self._convs), "tokens": self._total_tokens}
+
+    def __len__(self) -> int:
+        return len(self._convs)
+
+    # --- internos (con el lock tomado) ---
+    def _touch(self, key: str, conv: _Conversation):
+        conv.last_used = time.monotonic()
+        self._convs.move_to_end(key)
+
+    def _add_tokens(self, conv: _Conversation, n: int):
+        conv.tokens += n
+        self._total_tokens += n
+
+    def _drop(self, key: str):
+        conv = self._convs.pop(key, None)
+        if conv is not None:
+            self._total_tokens -= conv.tokens
+
+    def _expire(self):
+        """Fuera las conversaciones sin uso en idle_ttl_s (están al principio)."""
+        if not self.idle_ttl_s:
+            return
+        limit = time.monotonic() - self.idle_ttl_s
+        while self._convs:
+            key, conv = next(iter(self._convs.items()))
+            if conv.last_used > limit:
+                break
+            self._drop(key)
+            log.debug(f"[HIST] Historial de {key} caducado.")
+
+    def _evict(self, keep: str):
+        """Respeta los topes globales sacando las menos recientes (nunca 'keep')."""
+        while (self._total_tokens > self.total_max_tokens
+               or len(self._convs) > self.max_sessions):
+            key = next(iter(self._convs))
+            if key == keep:
+                break
+            self._drop(key)
+            log.debug(f"[HIST] Historial de {key} descartado (tope global).")
@@ -0,0 +1,83 @@
+# server/language_cache.py
+# ====================================
+# Idioma de cada hablante, para no detectarlo en cada turno (solo con
+# WHISPER_LANGUAGE = None; ASR_LANG_* en config.py)
+#  - Clave: la sesión, o la IP del cliente si no abrió sesión (la misma que
+#    el historial): una persona con un dispositivo casi nunca cambia de idioma
+#  - lookup(): idioma a forzar en este turno, o None si toca detectarlo (no
+#    se conoce, o han pasado ASR_LANG_PROBE_EVERY turnos: sondeo periódico)
+#  - learn(): apunta lo detectado si la probabilidad llega a
+#    ASR_LANG_CACHE_MIN_PROB; si no, lo olvida y el siguiente turno detecta
+#  - forget(): el idioma forzado dio una transcripción de poca confianza
+#  - Se recuerdan ASR_LANG_CACHE_MAX hablantes; se olvida el menos reciente
+# ====================================
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+try:
+    from .config import ASR_LANG_CACHE_MIN_PROB, ASR_LANG_PROBE_EVERY, ASR_LANG_CACHE_MAX
+    from .tracing import log
+except ImportError:
+    from config import ASR_LANG_CACHE_MIN_PROB, ASR_LANG_PROBE_EVERY, ASR_LANG_CACHE_MAX
+    from tracing import log
+
+
+class _Entry:
+    __slots__ = ("language", "probability", "turns")
+
+    def __init__(self, language: str, probability: float):
+        self.language = language
+        self.probability = probability
+        self.turns = 0  # turnos forzados desde la última detección
+
+
+class LanguageCache:
+    """Idioma detectado por clave, LRU y seguro entre hilos."""
+
+    def __init__(self, min_prob: float = ASR_LANG_CACHE_MIN_PROB,
+                 probe_every: int = ASR_LANG_PROBE_EVERY,
+                 max_entries: int = ASR_LANG_CACHE_MAX):
+        self.min_prob = min_prob
+        self.probe_every = probe_every
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Idioma a forzar para 'key', o None si hay que detectarlo."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            if self.probe_every and entry.turns >= self.probe_every:
+                return None
+            entry.turns += 1
+            return entry.language
+
+    def learn(self, key: str, language: Optional[str], probability: float):
+        """Resultado de una detección para 'key'."""
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if not language or probability < self.min_prob:
+                if old is not None:
+                    log.debug(f"[ASR] Idioma de {key} dudoso ({language}, p={probability:.2f}); "
+                              f"se volverá a detectar.")
+                return
+            if old is not None and old.language != language:
+                log.debug(f"[ASR] {key} cambió de idioma: {old.language} -> {language}")
+            self._entries[key] = _Entry(language, probability)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def forget(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries)}
@@ -1,19 +1,30 @@
 # server/llm_ollama.py
 # ====================================
 # Llamada a Ollama (LLM local)
-# Provee ask_llm(text, history=[])
+# Provee ask_llm(text, history=[]) y preload() (cargar el modelo al arrancar)
+# stream_llm()/stream_llm_async(): la misma respuesta token a token
 # ====================================
 
 from __future__ import annotations
+import asyncio
+import json
 import requests
-from typing import List, Dict
+from typing import AsyncIterator, Callable, Dict, Iterator, List
+from urllib.parse import urlsplit
 
 try:
     # cuando se ejecuta como paquete
-    from .config import OLLAMA_URL, OLLAMA_MODEL, OLLAMA_TIMEOUT_S, SYSTEM_PROMPT, debug_enabled
+    from .config import OLLAMA_URL, OLLAMA_MODEL, OLLAMA_TIMEOUT_S, OLLAMA_KEEP_ALIVE, SYSTEM_PROMPT
+    from .tracing import log, span
+    from . import metrics, cpu_budget
 except ImportError:
     # cuando se ejecuta como script
-    from config import OLLAMA_URL, OLLAMA_MODEL, OLLAMA_TIMEOUT_S, SYSTEM_PROMPT, debug_enabled
+    from config import OLLAMA_URL, OLLAMA_MODEL, OLLAMA_TIMEOUT_S, OLLAMA_KEEP_ALIVE, SYSTEM_PROMPT
+    from tracing import log, span
+    import metrics, cpu_budget
+
+
+NO_REPLY = "Ahora mismo no puedo consultar el modelo local."
 
 
 def _messages_to_prompt(messages: List[Dict[str, str]]) -> str:
@@ -31,43 +42,36 @@ def _messages_to_prompt(messages: List[Dict[str, str]]) -> str:
     return "\n".join(parts)
 
 
-def _call_chat(messages: List[Dict[str, str]]) -> str:
-    url = OLLAMA_URL.rstrip("/") + "/api/chat"
-    payload = {
+def _options() -> dict:
+    options = {"temperature": 0.5}
+    num_thread = cpu_budget.ollama_num_thread()
+    if num_thread:
+        options["num_thread"] = num_thread  # su parte de CPU_BUDGET
+    return options
+
+
+def _chat_payload(messages: List[Dict[str, str]]) -> dict:
+    return {
         "model": OLLAMA_MODEL,
         "messages": messages,
         "stream": False,
-        "options": {"temperature": 0.5},
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": _options(),
     }
-    if debug_enabled():
-        print(f"[LLM] POST {url} (modelo={OLLAMA_MODEL})")
-    r = requests.post(url, json=payload, timeout=OLLAMA_TIMEOUT_S)
-    r.raise_for_status()
-    data = r.json()
-    return (data.get("message") or {}).get("content", "") or ""
 
 
-def _call_generate(messages: List[Dict[str, str]]) -> str:
-    url = OLLAMA_URL.rstrip("/") + "/api/generate"
-    payload = {
+def _generate_payload(messages: List[Dict[str, str]]) -> dict:
+    return {
         "model": OLLAMA_MODEL,
         "prompt": _messages_to_prompt(messages),
         "stream": False,
-        "options": {"temperature": 0.5},
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": _options(),
     }
-    if debug_enabled():
-        print(f"[LLM] POST {url} (modelo={OLLAMA_MODEL})")
-    r = requests.post(url, json=payload, timeout=OLLAMA_TIMEOUT_S)
-    r.raise_for_status()
-    data = r.json()
-    return data.get("response", "") or ""
 
 
-def ask_llm(user_text: str, history: List[Dict[str, str]] | None = None) -> str:
-    """
-    Devuelve la respuesta del LLM. Acepta 'history' (lista de turnos anteriores).
-    Añade un system prompt al inicio si no existe.
-    """
+def _build_messages(user_text: str, history: List[Dict[str, str]] | None) -> List[Dict[str, str]]:
+    """System prompt (si el historial no lo trae) + historial + turno actual."""
     msgs: List[Dict[str, str]] = []
     # System prompt
     if not history or (history and history[0].get("role") != "system"):
@@ -77,27 +81,372 @@ def ask_llm(user_text: str, history: List[Dict[str, str]] | None = None) -> str:
         msgs.extend(history)
 
     msgs.append({"role": "user", "content": user_text})
+    return msgs
+
+
+def _ollama_span(endpoint: str):
+    return span("ollama", endpoint=endpoint, model=OLLAMA_MODEL)
+
+
+def _note_usage(sp: dict, data: dict):
+    """Tokens que informa Ollama, al span de la llamada."""
+    sp["prompt_tokens"] = data.get("prompt_eval_count")
+    sp["output_tokens"] = data.get("eval_count")
+
+
+def _call_chat(messages: List[Dict[str, str]]) -> str:
+    url = OLLAMA_URL.rstrip("/") + "/api/chat"
+    payload = _chat_payload(messages)
+    log.debug(f"[LLM] POST {url} (modelo={OLLAMA_MODEL})")
+    with _ollama_span("chat") as sp:
+        r = requests.post(url, json=payload, timeout=OLLAMA_TIMEOUT_S)
+        r.raise_for_status()
+        data = r.json()
+        _note_usage(sp, data)
+    return (data.get("message") or {}).get("content", "") or ""
+
+
+def _call_generate(messages: List[Dict[str, str]]) -> str:
+    url = OLLAMA_URL.rstrip("/") + "/api/generate"
+    payload = _generate_payload(messages)
+    log.debug(f"[LLM] POST {url} (modelo={OLLAMA_MODEL})")
+    with _ollama_span("generate") as sp:
+        r = requests.post(url, json=payload, timeout=OLLAMA_TIMEOUT_S)
+        r.raise_for_status()
+        data = r.json()
+        _note_usage(sp, data)
+    return data.get("response", "") or ""
+
+
+def preload(timeout: float = OLLAMA_TIMEOUT_S):
+    """
+    Pide a Ollama que cargue OLLAMA_MODEL y lo mantenga OLLAMA_KEEP_ALIVE
+    (/api/generate sin prompt solo carga el modelo). Lanza excepción si falla.
+    """
+    url = OLLAMA_URL.rstrip("/") + "/api/generate"
+    log.debug(f"[LLM] Cargando {OLLAMA_MODEL} en {OLLAMA_URL} (keep_alive={OLLAMA_KEEP_ALIVE})")
+    with _ollama_span("load"):
+        # Mismas opciones que las peticiones: un num_thread distinto obligaría a recargar
+        r = requests.post(url, json={"model": OLLAMA_MODEL, "keep_alive": OLLAMA_KEEP_ALIVE,
+                                     "options": _options()},
+                          timeout=timeout)
+        r.raise_for_status()
+
+
+def _chat_piece(data: dict) -> str:
+    return (data.get("message") or {}).get("content", "") or ""
+
+
+def _generate_piece(data: dict) -> str:
+    return data.get("response", "") or ""
+
+
+def _streams(msgs: List[Dict[str, str]]):
+    """(endpoint, payload con "stream": true, texto de cada línea), en orden de preferencia."""
+    return (
+        ("chat", dict(_chat_payload(msgs), stream=True), _chat_piece),
+        ("generate", dict(_generate_payload(msgs), stream=True), _generate_piece),
+    )
+
+
+def _log_stream_usage(endpoint: str, data: dict):
+    # Sin span: no puede envolver los yield del generador (ver tracing.span)
+    log.debug(f"[LLM] /api/{endpoint} (stream): {data.get('prompt_eval_count')} tokens de entrada, "
+              f"{data.get('eval_count')} de salida")
+
+
+def _stream_call(endpoint: str, payload: dict, piece: Callable[[dict], str]) -> Iterator[str]:
+    """Trozos de texto de una respuesta NDJSON de Ollama (una línea por token)."""
+    url = OLLAMA_URL.rstrip("/") + "/api/" + endpoint
+    log.debug(f"[LLM] POST {url} (stream, modelo={OLLAMA_MODEL})")
+    with requests.post(url, json=payload, timeout=OLLAMA_TIMEOUT_S, stream=True) as r:
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if not line:
+                continue
+            data = json.loads(line)
+            if data.get("error"):
+                raise RuntimeError(data["error"])
+            text = piece(data)
+            if text:
+                yield text
+            if data.get("done"):
+                _log_stream_usage(endpoint, data)
+                return
+
+
+def stream_llm(user_text: str, history: List[Dict[str, str]] | None = None) -> Iterator[str]:
+    """
+    Como ask_llm() pero devuelve el texto según lo genera Ollama. Si
+    /api/chat falla antes del primer token se prueba /api/generate; si se
+    corta a mitad, la respuesta se queda en lo que llegó.
+    """
+    msgs = _build_messages(user_text, history)
+    for endpoint, payload, piece in _streams(msgs):
+        sent = False
+        try:
+            for text in _stream_call(endpoint, payload, piece):
+                sent = True
+                yield text
+        except Exception as e:
+            if sent:
+                log.warning(f"[LLM] /api/{endpoint} se cortó a mitad de la respuesta:", e)
+            else:
+                log.debug(f"[LLM] Error en /api/{endpoint} (stream):", e)
+                continue
+        if sent:
+            metrics.count("llm_backend", endpoint=endpoint)
+            return
+
+    metrics.count("llm_backend", endpoint="none")
+    log.warning(f"[LLM] Ollama no respondió en {OLLAMA_URL}.")
+    yield NO_REPLY
+
+
+def ask_llm(user_text: str, history: List[Dict[str, str]] | None = None) -> str:
+    """
+    Devuelve la respuesta del LLM. Acepta 'history' (lista de turnos anteriores).
+    Añade un system prompt al inicio si no existe.
+    """
+    msgs = _build_messages(user_text, history)
 
     # Intentamos /api/chat; si el servidor no lo soporta, probamos /api/generate
     try:
         reply = _call_chat(msgs).strip()
         if reply:
+            metrics.count("llm_backend", endpoint="chat")
             return reply
     except requests.HTTPError as e:
         # 404 u otro -> fallback
-        if debug_enabled():
-            print("[LLM] /api/chat falló, pruebo /api/generate:", e)
+        log.debug("[LLM] /api/chat falló, pruebo /api/generate:", e)
     except Exception as e:
-        if debug_enabled():
-            print("[LLM] Error en /api/chat:", e)
+        log.debug("[LLM] Error en /api/chat:", e)
 
     # Fallback
     try:
         reply = _call_generate(msgs).strip()
         if reply:
+            metrics.count("llm_backend", endpoint="generate")
             return reply
     except Exception as e:
-        if debug_enabled():
-            print("[LLM] Error en /api/generate:", e)
+        log.debug("[LLM] Error en /api/generate:", e)
+
+    metrics.count("llm_backend", endpoint="none")
+    log.warning(f"[LLM] Ollama no respondió en {OLLAMA_URL}.")
+    return NO_REPLY
+
+
+# -------------------------------------------------------------------
+# Versión asíncrona (para server/async_main.py)
+# HTTP/1.0 sobre asyncio.open_connection: sin dependencias nuevas y sin
+# "chunked" (Ollama responde el cuerpo entero y cierra la conexión).
+# -------------------------------------------------------------------
+class _AsyncHTTPError(Exception):
+    pass
+
+
+def _dechunk(body: bytes) -> bytes:
+    """Decodifica Transfer-Encoding: chunked por si el servidor lo usa igualmente."""
+    out = bytearray()
+    pos = 0
+    while True:
+        eol = body.find(b"\r\n", pos)
+        if eol < 0:
+            break
+        size = int(body[pos:eol].split(b";")[0] or b"0", 16)
+        if size == 0:
+            break
+        start = eol + 2
+        out += body[start:start + size]
+        pos = start + size + 2
+    return bytes(out)
+
+
+def _http_request(url: str, payload: dict):
+    """(host, port, petición HTTP/1.0 con 'payload' en JSON)."""
+    parts = urlsplit(url)
+    host = parts.hostname or "127.0.0.1"
+    port = parts.port or 80
+    body = json.dumps(payload).encode("utf-8")
+    request = (
+        f"POST {parts.path or '/'} HTTP/1.0\r\n"
+        f"Host: {host}:{port}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n"
+    ).encode("ascii") + body
+    return host, port, request
+
+
+def _parse_head(head: bytes, url: str) -> bool:
+    """Comprueba el estado de la respuesta; devuelve si el cuerpo va "chunked"."""
+    lines = head.decode("iso-8859-1").split("\r\n")
+    status = int(lines[0].split()[1]) if lines and len(lines[0].split()) > 1 else 0
+    headers = {k.strip().lower(): v.strip() for k, _, v in (ln.partition(":") for ln in lines[1:])}
+    if status >= 400 or status == 0:
+        raise _AsyncHTTPError(f"HTTP {status} en {url}")
+    return headers.get("transfer-encoding", "").lower() == "chunked"
+
+
+async def _close(writer: asyncio.StreamWriter):
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except Exception:
+        pass
+
+
+async def _post_json_async(url: str, payload: dict) -> dict:
+    host, port, request = _http_request(url, payload)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(request)
+        await writer.drain()
+        raw = await reader.read()  # hasta EOF
+    finally:
+        await _close(writer)
+
+    head, _, data = raw.partition(b"\r\n\r\n")
+    if _parse_head(head, url):
+        data = _dechunk(data)
+    return json.loads(data.decode("utf-8"))
+
+
+async def _body_blocks(reader: asyncio.StreamReader, chunked: bool) -> AsyncIterator[bytes]:
+    """El cuerpo según llega (cada bloque espera como mucho OLLAMA_TIMEOUT_S)."""
+    while True:
+        if not chunked:
+            block = await asyncio.wait_for(reader.read(65536), OLLAMA_TIMEOUT_S)
+            if not block:
+                return
+            yield block
+            continue
+        size_line = await asyncio.wait_for(reader.readline(), OLLAMA_TIMEOUT_S)
+        size = int(size_line.split(b";")[0].strip() or b"0", 16)
+        if size == 0:
+            return
+        block = await asyncio.wait_for(reader.readexactly(size + 2), OLLAMA_TIMEOUT_S)
+        yield block[:-2]  # sin el \r\n final del trozo
+
+
+async def _post_ndjson_async(url: str, payload: dict) -> AsyncIterator[dict]:
+    """Las líneas JSON de una respuesta en streaming, según llegan."""
+    host, port, request = _http_request(url, payload)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(request)
+        await writer.drain()
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), OLLAMA_TIMEOUT_S)
+        chunked = _parse_head(head[:-4], url)
+        buf = b""
+        async for block in _body_blocks(reader, chunked):
+            *lines, buf = (buf + block).split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+        if buf.strip():
+            yield json.loads(buf)
+    finally:
+        await _close(writer)
+
+
+async def ask_llm_async(user_text: str, history: List[Dict[str, str]] | None = None) -> str:
+    """
+    Igual que ask_llm() pero sin bloquear el bucle de eventos.
+    Si OLLAMA_URL no es http:// plano, delega en ask_llm() en un hilo.
+    """
+    if urlsplit(OLLAMA_URL).scheme != "http":
+        return await asyncio.to_thread(ask_llm, user_text, history)
+
+    msgs = _build_messages(user_text, history)
+    base = OLLAMA_URL.rstrip("/")
+
+    try:
+        log.debug(f"[LLM] POST {base}/api/chat (async, modelo={OLLAMA_MODEL})")
+        with _ollama_span("chat") as sp:
+            data = await asyncio.wait_for(
+                _post_json_async(base + "/api/chat", _chat_payload(msgs)), OLLAMA_TIMEOUT_S
+            )
+            _note_usage(sp, data)
+        reply = ((data.get("message") or {}).get("content", "") or "").strip()
+        if reply:
+            metrics.count("llm_backend", endpoint="chat")
+            return reply
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        log.debug("[LLM] /api/chat (async) falló, pruebo /api/generate:", e)
+
+    try:
+        log.debug(f"[LLM] POST {base}/api/generate (async, modelo={OLLAMA_MODEL})")
+        with _ollama_span("generate") as sp:
+            data = await asyncio.wait_for(
+                _post_json_async(base + "/api/generate", _generate_payload(msgs)), OLLAMA_TIMEOUT_S
+            )
+            _note_usage(sp, data)
+        reply = (data.get("response", "") or "").strip()
+        if reply:
+            metrics.count("llm_backend", endpoint="generate")
+            return reply
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        log.debug("[LLM] Error en /api/generate (async):", e)
+
+    metrics.count("llm_backend", endpoint="none")
+    log.warning(f"[LLM] Ollama no respondió en {OLLAMA_URL}.")
+    return NO_REPLY
+
+
+async def _stream_call_async(endpoint: str, payload: dict, piece: Callable[[dict], str]) -> AsyncIterator[str]:
+    url = OLLAMA_URL.rstrip("/") + "/api/" + endpoint
+    log.debug(f"[LLM] POST {url} (async, stream, modelo={OLLAMA_MODEL})")
+    lines = _post_ndjson_async(url, payload)
+    try:
+        async for data in lines:
+            if data.get("error"):
+                raise RuntimeError(data["error"])
+            text = piece(data)
+            if text:
+                yield text
+            if data.get("done"):
+                _log_stream_usage(endpoint, data)
+                return
+    finally:
+        await lines.aclose()
+
+
+async def stream_llm_async(user_text: str, history: List[Dict[str, str]] | None = None) -> AsyncIterator[str]:
+    """
+    stream_llm() sin bloquear el bucle de eventos. Si OLLAMA_URL no es
+    http:// plano, se pide la respuesta entera con ask_llm_async().
+    """
+    if urlsplit(OLLAMA_URL).scheme != "http":
+        yield await ask_llm_async(user_text, history)
+        return
+
+    msgs = _build_messages(user_text, history)
+    for endpoint, payload, piece in _streams(msgs):
+        sent = False
+        pieces = _stream_call_async(endpoint, payload, piece)
+        try:
+            async for text in pieces:
+                sent = True
+                yield text
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if sent:
+                log.warning(f"[LLM] /api/{endpoint} (async) se cortó a mitad de la respuesta:", e)
+            else:
+                log.debug(f"[LLM] Error en /api/{endpoint} (async, stream):", e)
+                continue
+        finally:
+            await pieces.aclose()
+        if sent:
+            metrics.count("llm_backend", endpoint=endpoint)
+            return
 
-    return "Ahora mismo no puedo consultar el modelo local."
+    metrics.count("llm_backend", endpoint="none")
+    log.warning(f"[LLM] Ollama no respondió en {OLLAMA_URL}.")
+    yield NO_REPLY
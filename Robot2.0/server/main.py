@@ -7,109 +7,494 @@
 #    Si no -> consulta a Ollama
 # 4) Sintetiza a WAV con TTS
 # 5) Devuelve el WAV al cliente
+# Con LLM_STREAM y respuesta progresiva, 3b) y 4) se solapan: cada frase del
+# LLM va al TTS en cuanto se completa.
+# Con PIPELINE_IN_MEMORY el audio no pasa por disco en ningún paso.
 # ====================================
 
 from __future__ import annotations
 
+import math
 import os
+import shutil
+import signal
 import socket
+import struct
 import sys
-import traceback
-from typing import List, Dict
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Dict
 
 # --- Imports robustos (permiten ejecutar como módulo o script) ---
 try:
     from .config import (
-        HOST, PORT, ACCEPT_BACKLOG, IN_AUDIO_WAV, OUT_TTS_WAV,
-        debug_enabled,
+        HOST, PORT, ACCEPT_BACKLOG, IN_AUDIO_WAV, OUT_TTS_WAV, PIPELINE_IN_MEMORY,
+        SERVER_MODE, SERVER_WORKERS, SHUTDOWN_GRACE_S, REQUEST_TMP_DIR,
+        PREFORK_PROCESSES, PREFORK_THREADS, PREFORK_RESTART_DELAY_S,
+        SOCKET_BUFFER_BYTES, SESSION_IDLE_TIMEOUT_S, RECV_TIMEOUT_S, METRICS_PORT,
+        LLM_STREAM,
     )
-    from . import utils_net, asr_whisper, llm_ollama, tts_engine, commands
+    from . import transport, utils_net, asr_whisper, llm_ollama, tts_engine, commands, metrics, tracing
+    from . import capture, cpu_budget, warmup
+    from .tracing import log
+    from .admission import AdmissionController, Busy, PRIORITY_ASR, PRIORITY_LLM, log_busy
+    from .history_store import HistoryStore
+    from .wav_utils import make_wav_bytes, silent_wav_bytes
 except ImportError:
     # Ejecutado como script: añadir carpeta actual al path
     sys.path.append(os.path.dirname(__file__))
     from config import (
-        HOST, PORT, ACCEPT_BACKLOG, IN_AUDIO_WAV, OUT_TTS_WAV,
-        debug_enabled,
+        HOST, PORT, ACCEPT_BACKLOG, IN_AUDIO_WAV, OUT_TTS_WAV, PIPELINE_IN_MEMORY,
+        SERVER_MODE, SERVER_WORKERS, SHUTDOWN_GRACE_S, REQUEST_TMP_DIR,
+        PREFORK_PROCESSES, PREFORK_THREADS, PREFORK_RESTART_DELAY_S,
+        SOCKET_BUFFER_BYTES, SESSION_IDLE_TIMEOUT_S, RECV_TIMEOUT_S, METRICS_PORT,
+        LLM_STREAM,
     )
-    import utils_net, asr_whisper, llm_ollama, tts_engine, commands
+    import transport, utils_net, asr_whisper, llm_ollama, tts_engine, commands, metrics, tracing
+    import capture, cpu_budget, warmup
+    from tracing import log
+    from admission import AdmissionController, Busy, PRIORITY_ASR, PRIORITY_LLM, log_busy
+    from history_store import HistoryStore
+    from wav_utils import make_wav_bytes, silent_wav_bytes
 
 
-def handle_client(conn: socket.socket, addr, history: List[Dict[str, str]]):
+REPLY_NOT_UNDERSTOOD = "No he entendido nada, ¿puedes repetirlo más claro?"
+REPLY_LLM_ERROR = "Perdona, ahora mismo no puedo pensar bien."
+REPLY_BUSY = "Ahora mismo estoy ocupado. Repítemelo en unos segundos, por favor."
+# 1 s de silencio (16 kHz mono) si el TTS no produce nada
+SILENT_PCM_CHUNK = (b"\x00\x00" * 16000, 16000, 1)
+
+# Plazas para Whisper y el LLM (compartidas por todos los hilos del proceso)
+admission = AdmissionController()
+
+
+def _beeps_pcm(freq: float = 880.0, sr: int = 16000) -> bytes:
+    """Dos pitidos cortos: aviso de ocupado si no se pudo pregrabar la voz."""
+    beep = [int(8000 * math.sin(2 * math.pi * freq * i / sr)) for i in range(int(sr * 0.15))]
+    gap = [0] * int(sr * 0.1)
+    return struct.pack(f"<{2 * len(beep) + len(gap)}h", *(beep + gap + beep))
+
+
+# Aviso de "ocupado" ya sintetizado: cuando no hay plaza no se gasta TTS en decirlo
+_busy_chunk = (_beeps_pcm(), 16000, 1)
+
+
+def prerender_busy_reply():
+    """Sintetiza REPLY_BUSY una vez al arrancar (si el TTS falla, quedan los pitidos)."""
+    global _busy_chunk
+    try:
+        chunk = tts_engine.tts_to_pcm(REPLY_BUSY)
+    except Exception:
+        chunk = None
+    if chunk:
+        _busy_chunk = (bytes(chunk[0]), chunk[1], chunk[2])
+        log.debug(f"[SERV] Aviso de ocupado pregrabado ({len(_busy_chunk[0])} bytes).")
+    else:
+        log.warning("[SERV] No se pudo pregrabar el aviso de ocupado; se usarán pitidos.")
+
+
+def busy_reply_chunk():
+    """(pcm, sample_rate, canales) del aviso de ocupado."""
+    return _busy_chunk
+
+
+def busy_reply_wav() -> bytes:
+    return make_wav_bytes(*_busy_chunk)
+
+
+def _send_busy_reply(conn: socket.socket, stream_fmt: dict | None) -> bool:
+    """Responde al momento con el aviso pregrabado, en el formato que pidió el cliente."""
+    _count_reply("busy")
+    if utils_net.wants_pcm_stream(stream_fmt):
+        return utils_net.send_pcm_stream(conn, [busy_reply_chunk()],
+                                         utils_net.response_codec(stream_fmt))
+    return utils_net.send_bytes(conn, busy_reply_wav())
+
+
+def _count_reply(source: str):
+    """De dónde salió la respuesta (atajo, LLM, ocupado...): métricas y captura."""
+    metrics.count("reply", source=source)
+    capture.note(decision=source)
+
+
+def _history_key(addr, session_id: str | None) -> str:
+    """Clave del historial: la sesión, o la IP del cliente si no abrió sesión."""
+    if session_id:
+        return session_id
+    return str(addr[0]) if isinstance(addr, tuple) and addr else str(addr)
+
+
+def _remember_turn(histories: HistoryStore, key: str, text: str, reply_text: str):
+    """Añade el turno al historial de 'key' (el almacén recorta por tokens)."""
+    histories.append_turn(key, text, reply_text)
+
+
+class _StreamedReply:
+    """
+    Respuesta del LLM que se va generando (llm_ollama.stream_llm()), frase a
+    frase. Quien la recorre (el TTS) sostiene la plaza PRIORITY_LLM, que se
+    libera al acabar la generación; 'text' es lo que se llegó a generar.
+    """
+
+    def __init__(self, pieces, user_text: str):
+        self._pieces = pieces
+        self.user_text = user_text
+        self.sentences: list[str] = []
+        self._released = False
+        self._lock = threading.Lock()
+
+    @property
+    def text(self) -> str:
+        return " ".join(self.sentences)
+
+    def release(self):
+        """Devuelve la plaza del LLM (una sola vez, la llame quien la llame)."""
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        admission.release()
+
+    def _took(self, t0: float):
+        # "llm" abarca la generación entera; stage() no puede envolver un yield
+        tracing.observe("llm", time.perf_counter() - t0)
+
+    def _failed(self):
+        log.exception("[SERV] Error llamando al LLM:")
+        if not self.sentences:
+            self.sentences.append(REPLY_LLM_ERROR)
+            return True
+        return False
+
+    def __iter__(self):
+        t0 = time.perf_counter()
+        try:
+            for sentence in tts_engine.iter_sentences(self._pieces):
+                if not self.sentences:
+                    tracing.observe("llm_first_sentence", time.perf_counter() - t0)
+                self.sentences.append(sentence)
+                yield sentence
+        except Exception:
+            if self._failed():
+                yield REPLY_LLM_ERROR
+        finally:
+            self._took(t0)
+            self.release()
+
+    async def __aiter__(self):
+        t0 = time.perf_counter()
+        try:
+            async for sentence in tts_engine.iter_sentences_async(self._pieces):
+                if not self.sentences:
+                    tracing.observe("llm_first_sentence", time.perf_counter() - t0)
+                self.sentences.append(sentence)
+                yield sentence
+        except Exception:
+            if self._failed():
+                yield REPLY_LLM_ERROR
+        finally:
+            self._took(t0)
+            self.release()
+
+
+def _state_samples(histories: HistoryStore):
+    """Estado de la admisión y de los historiales para /metrics."""
+    a = admission.stats()
+    h = histories.stats()
+    return [
+        ("admission_active", "gauge", "Plazas de Whisper/LLM ocupadas.", a["active"]),
+        ("admission_queued", "gauge", "Peticiones esperando plaza.", a["queued"]),
+        ("admission_admitted_total", "counter", "Plazas concedidas.", a["admitted"]),
+        ("admission_shed_full_total", "counter", "Descartadas por cola llena.", a["shed_full"]),
+        ("admission_shed_timeout_total", "counter", "Descartadas por espera agotada.", a["shed_timeout"]),
+        ("admission_wait_seconds_total", "counter", "Tiempo total esperando plaza.", a["wait_s_total"]),
+        ("history_sessions", "gauge", "Historiales de conversación en memoria.", h["sessions"]),
+        ("history_tokens", "gauge", "Tokens estimados en los historiales.", h["tokens"]),
+    ]
+
+
+def start_metrics(histories: HistoryStore, port: int = METRICS_PORT):
+    """Sirve /metrics (latencias por etapa, backends, admisión e historiales)."""
+    metrics.register_collector(lambda: _state_samples(histories))
+    metrics.start_http_server(port)
+
+
+def warm_up(whisper_model: bool = True, backends: bool = True):
+    """
+    Arranque en caliente (warmup.py) + aviso de ocupado pregrabado, antes de
+    aceptar conexiones. 'backends' incluye Ollama, TTS y el aviso.
+    """
+    if backends:
+        cores = cpu_budget.split()
+        log.info(f"[CPU] Núcleos: whisper {cores['whisper']} · tts {cores['tts']} · "
+                 f"ollama {cores['ollama'] or '-'}")
+    todo = warmup.steps(whisper_model, backends)
+    if backends:
+        todo.append(("busy_reply", prerender_busy_reply))
+    warmup.run(todo)
+
+
+def _transcribe_upload(upload: utils_net.Upload, speaker: str | None = None) -> str:
+    """ASR de una subida recibida en memoria ('speaker': para recordar su idioma)."""
+    _, audio, fmt = upload
+    if fmt is None:
+        return asr_whisper.transcribe_wav_bytes(audio, speaker=speaker)
+    return asr_whisper.transcribe_pcm(audio, int(fmt["sample_rate"]), int(fmt["channels"]),
+                                      speaker=speaker)
+
+
+def handle_client(conn: socket.socket, addr, histories: HistoryStore,
+                  in_wav: str = IN_AUDIO_WAV, out_wav: str = OUT_TTS_WAV,
+                  in_memory: bool = PIPELINE_IN_MEMORY,
+                  header: bytes | None = None, session_id: str | None = None) -> bool:
     """
     Maneja una petición completa de un cliente:
-      - recibe WAV -> input_server.wav
+      - recibe WAV o streaming -> memoria (o in_wav si in_memory=False)
       - ASR -> texto
       - atajos o LLM -> reply_text
-      - TTS -> output_server.wav
-      - envía WAV de salida
+      - TTS -> WAV en memoria (o out_wav si in_memory=False)
+      - envía WAV de salida (o PCM frase a frase si el cliente lo pidió)
+    'header' son los 8 primeros bytes si ya se leyeron (turnos de una sesión).
+    Cada turno tiene su request_id (tracing.py); si el cliente lo pidió, tras
+    la respuesta se le envía con los ms de cada etapa.
+    Devuelve True si la respuesta llegó a enviarse (la conexión sigue usable).
     """
-    if debug_enabled():
-        print(f"[SERV] Conexión de {addr}")
+    with tracing.request(client=str(addr), session=session_id) as req, capture.turn(req):
+        ok = _handle_turn(conn, addr, histories, in_wav, out_wav, in_memory, header, session_id)
+        if ok and req.reply_trace:
+            ok = utils_net.send_trace(conn, req.summary())
+        metrics.observe("turn", req.elapsed_ms() / 1000)
+        return ok
 
-    # 1) Recibir WAV del cliente
-    ok = utils_net.receive_file(conn, IN_AUDIO_WAV)
-    if not ok:
-        print("[SERV] Error recibiendo audio. Cerrando conexión.")
-        return
 
-    # 2) Transcribir
+def _handle_turn(conn: socket.socket, addr, histories: HistoryStore, in_wav: str, out_wav: str,
+                 in_memory: bool, header: bytes | None, session_id: str | None) -> bool:
+    """Cuerpo de handle_client(), dentro del contexto de traza del turno."""
+    log.debug(f"[SERV] Petición de {addr}" + (f" (sesión {session_id})" if session_id else ""))
+    history_key = _history_key(addr, session_id)
+
+    # 1) Recibir audio del cliente (WAV clásico o streaming por tramas).
+    # En streaming la transcripción empieza mientras el usuario habla.
+    transcriber = None
+    stream_fmt = None
+
+    def _on_stream(fmt):
+        nonlocal transcriber, stream_fmt
+        stream_fmt = fmt
+        tracing.current().reply_trace = utils_net.wants_trace(fmt)
+        transcriber = asr_whisper.open_stream(fmt["sample_rate"], fmt["channels"],
+                                              speaker=history_key, admission=admission)
+        return transcriber.feed
+
+    upload = None
+    with tracing.stage("receive"):  # en streaming incluye lo que dura la locución
+        if in_memory:
+            upload = utils_net.receive_upload_buffer(conn, on_stream=_on_stream, header=header)
+            mode = upload[0] if upload else None
+        else:
+            mode = utils_net.receive_upload(conn, in_wav, on_stream=_on_stream, header=header)
+    t_received = time.perf_counter()
+    if not mode:
+        log.warning("[SERV] Error recibiendo audio. Cerrando conexión.")
+        if transcriber is not None:
+            transcriber.close()
+        return False
+    if capture.enabled():
+        if upload is not None:
+            capture.note_upload(upload)
+        else:
+            capture.note_wav_file(mode, in_wav)
+
+    # 2) Transcribir (en streaming solo queda el último trozo).
+    # Whisper y el LLM pasan por el control de admisión: sin plaza, aviso de ocupado.
     try:
-        text = asr_whisper.transcribe_wav(IN_AUDIO_WAV)
+        with admission.slot(PRIORITY_ASR), tracing.stage("asr"):
+            if mode == "stream" and transcriber is not None:
+                text = transcriber.finish()
+            elif upload is not None:
+                text = _transcribe_upload(upload, history_key)
+            else:
+                text = asr_whisper.transcribe_wav(in_wav, speaker=history_key)
+    except Busy as e:
+        log_busy(admission, e, addr)
+        if transcriber is not None:
+            transcriber.close()  # sin plaza: que sus pasadas no gasten CPU
+        return _send_busy_reply(conn, stream_fmt)
     except Exception:
-        print("[SERV] Error en transcripción:")
-        traceback.print_exc()
+        log.exception("[SERV] Error en transcripción:")
         text = ""
+    capture.note(transcript=text)
 
     if not text.strip():
-        reply_text = "No he entendido nada, ¿puedes repetirlo más claro?"
+        reply_text = REPLY_NOT_UNDERSTOOD
+        _count_reply("not_understood")
     else:
-        if debug_enabled():
-            print(f"[SERV] Usuario dijo: {text}")
+        log.debug(f"[SERV] Usuario dijo: {text}")
 
         # 3) Atajos / intenciones simples
-        handled, short_reply = commands.handle_intents(text)
+        with tracing.stage("intents"):
+            handled, short_reply = commands.handle_intents(text)
         if handled and short_reply:
             reply_text = short_reply
+            _count_reply("intent")
         else:
-            # 3b) Conversación con LLM (manteniendo historial de turno)
+            # 3b) Conversación con LLM (con el historial de esta sesión)
+            # get() da una copia: no bloqueamos a otros hilos durante la llamada
+            history_snapshot = histories.get(history_key)
             reply_text = ""
+            if LLM_STREAM and (in_memory or utils_net.wants_pcm_stream(stream_fmt)):
+                # La plaza se queda hasta que el TTS acabe de leer la respuesta
+                try:
+                    admission.acquire(PRIORITY_LLM)
+                except Busy as e:
+                    log_busy(admission, e, addr)
+                    return _send_busy_reply(conn, stream_fmt)
+                streamed = _StreamedReply(llm_ollama.stream_llm(text, history=history_snapshot), text)
+                _count_reply("llm")
+                try:
+                    ok = _send_streamed_reply(conn, streamed, stream_fmt, t_received)
+                finally:
+                    streamed.release()
+                capture.note(reply_text=streamed.text)
+                _remember_turn(histories, history_key, text, streamed.text)
+                return _finish_turn(ok)
             try:
-                reply_text = llm_ollama.ask_llm(text, history=history)
+                with admission.slot(PRIORITY_LLM), tracing.stage("llm"):
+                    reply_text = llm_ollama.ask_llm(text, history=history_snapshot)
+                _count_reply("llm")
+            except Busy as e:
+                log_busy(admission, e, addr)
+                return _send_busy_reply(conn, stream_fmt)
             except Exception:
-                print("[SERV] Error llamando al LLM:")
-                traceback.print_exc()
-                reply_text = "Perdona, ahora mismo no puedo pensar bien."
-
-    # Actualizar historial (recortando para no crecer sin límite)
-    history.append({"role": "user", "content": text})
-    history.append({"role": "assistant", "content": reply_text})
-    if len(history) > 20:
-        # conservar solo los últimos 18 mensajes + (opcionalmente un system en llm_ollama)
-        history[:] = history[-18:]
-
-    # 4) TTS a WAV
+                log.exception("[SERV] Error llamando al LLM:")
+                reply_text = REPLY_LLM_ERROR
+                _count_reply("llm_error")
+
+    capture.note(reply_text=reply_text)
+
+    # Actualizar historial
+    _remember_turn(histories, history_key, text, reply_text)
+
+    # first_audio: desde que acabó la subida hasta que sale el primer audio
+    if utils_net.wants_pcm_stream(stream_fmt):
+        # 4-5) Respuesta progresiva: cada frase sale en cuanto está sintetizada
+        # (TTS y envío se solapan: se miden juntos como "stream_reply")
+        chunks = _pcm_or_silence(tts_engine.iter_tts_pcm(reply_text))
+        with tracing.stage("stream_reply"):
+            ok = utils_net.send_pcm_stream(
+                conn, tracing.observe_first(chunks, "first_audio", t_received),
+                utils_net.response_codec(stream_fmt),
+            )
+    elif in_memory:
+        # 4-5) TTS a WAV en memoria y envío directo
+        with tracing.stage("tts"):
+            wav = _synthesize_wav_bytes(reply_text)
+        tracing.observe("first_audio", time.perf_counter() - t_received)
+        with tracing.stage("send"):
+            ok = utils_net.send_bytes(conn, wav)
+    else:
+        # 4) TTS a WAV
+        with tracing.stage("tts"):
+            _synthesize_wav(reply_text, out_wav)
+        tracing.observe("first_audio", time.perf_counter() - t_received)
+
+        # 5) Enviar WAV de vuelta
+        with tracing.stage("send"):
+            ok = utils_net.send_file(conn, out_wav)
+    return _finish_turn(ok)
+
+
+def _finish_turn(ok: bool) -> bool:
+    if not ok:
+        log.warning("[SERV] Error enviando respuesta al cliente.")
+    log.debug("[SERV] Petición completada.")
+    return ok
+
+
+def _send_streamed_reply(conn: socket.socket, streamed: _StreamedReply,
+                         stream_fmt: dict | None, t_received: float) -> bool:
+    """4-5) con la respuesta del LLM aún generándose (LLM_STREAM)."""
+    if utils_net.wants_pcm_stream(stream_fmt):
+        # LLM, TTS y envío se solapan: todo cuenta como "stream_reply"
+        chunks = _pcm_or_silence(tts_engine.iter_tts_pcm_stream(streamed))
+        with tracing.stage("stream_reply"):
+            return utils_net.send_pcm_stream(
+                conn, tracing.observe_first(chunks, "first_audio", t_received),
+                utils_net.response_codec(stream_fmt),
+            )
+    # WAV en memoria: el TTS de cada frase empieza mientras el LLM sigue
+    with tracing.stage("tts"):
+        wav = _synthesize_streamed_wav(streamed)
+    tracing.observe("first_audio", time.perf_counter() - t_received)
+    with tracing.stage("send"):
+        return utils_net.send_bytes(conn, wav)
+
+
+def _synthesize_wav(reply_text: str, out_wav: str):
+    """TTS a 'out_wav'; si falla deja 1 s de silencio para no romper el protocolo."""
     try:
-        if os.path.exists(OUT_TTS_WAV):
+        if os.path.exists(out_wav):
             try:
-                os.remove(OUT_TTS_WAV)
+                os.remove(out_wav)
             except Exception:
                 pass
-        wav = tts_engine.tts_to_wav(reply_text, OUT_TTS_WAV)
-        if not wav or not os.path.exists(OUT_TTS_WAV) or os.path.getsize(OUT_TTS_WAV) == 0:
+        wav = tts_engine.tts_to_wav(reply_text, out_wav)
+        if not wav or not os.path.exists(out_wav) or os.path.getsize(out_wav) == 0:
             # Fallback ultra simple: generar un WAV "vacío" de 1s para no romper protocolo
-            print("[SERV] TTS falló; devolviendo WAV vacío con texto impreso en consola.")
-            _make_silent_wav(OUT_TTS_WAV, 16000, 1, 1.0)
+            log.warning("[SERV] TTS falló; devolviendo WAV vacío con texto impreso en consola.")
+            _make_silent_wav(out_wav, 16000, 1, 1.0)
     except Exception:
-        print("[SERV] Error en TTS:")
-        traceback.print_exc()
-        _make_silent_wav(OUT_TTS_WAV, 16000, 1, 1.0)
+        log.exception("[SERV] Error en TTS:")
+        _make_silent_wav(out_wav, 16000, 1, 1.0)
+
+
+def _synthesize_wav_bytes(reply_text: str) -> bytes:
+    """TTS a WAV en memoria; si falla, 1 s de silencio para no romper el protocolo."""
+    try:
+        wav = tts_engine.tts_to_wav_bytes(reply_text)
+        if wav:
+            return wav
+        log.warning("[SERV] TTS falló; devolviendo WAV vacío con texto impreso en consola.")
+    except Exception:
+        log.exception("[SERV] Error en TTS:")
+    return silent_wav_bytes(1.0)
 
-    # 5) Enviar WAV de vuelta
-    ok = utils_net.send_file(conn, OUT_TTS_WAV)
-    if not ok:
-        print("[SERV] Error enviando respuesta al cliente.")
-    if debug_enabled():
-        print("[SERV] Petición completada.")
+
+def _synthesize_streamed_wav(streamed: _StreamedReply) -> bytes:
+    """Une en un WAV el PCM de cada frase; si falla, 1 s de silencio."""
+    pcm = []
+    fmt = None
+    try:
+        for data, sr, ch in tts_engine.iter_tts_pcm_stream(streamed):
+            if fmt is None:
+                fmt = (sr, ch)
+            if (sr, ch) == fmt:
+                pcm.append(data)
+            else:
+                log.warning(f"[SERV] Frase descartada: el TTS cambió de formato ({sr} Hz, {ch} canales).")
+    except Exception:
+        log.exception("[SERV] Error en TTS:")
+    if pcm:
+        return make_wav_bytes(b"".join(pcm), *fmt)
+    log.warning("[SERV] TTS falló; devolviendo WAV vacío con texto impreso en consola.")
+    return silent_wav_bytes(1.0)
+
+
+def _pcm_or_silence(chunks):
+    """Reenvía las tramas del TTS; si no sale ninguna, 1 s de silencio."""
+    sent = False
+    try:
+        for chunk in chunks:
+            sent = True
+            yield chunk
+    except Exception:
+        log.exception("[SERV] Error en TTS:")
+    if not sent:
+        log.warning("[SERV] TTS falló; devolviendo silencio con texto impreso en consola.")
+        yield SILENT_PCM_CHUNK
 
 
 def _make_silent_wav(path: str, sr: int, ch: int, seconds: float):
@@ -125,33 +510,350 @@ def _make_silent_wav(path: str, sr: int, ch: int, seconds: float):
             wf.writeframesraw(silence_frame)
 
 
-def main():
-    print("=== Servidor Asistente de Voz ===")
-    print(f"Escuchando en {HOST}:{PORT} (Ctrl+C para salir)")
+@contextmanager
+def _request_tmp_paths():
+    """
+    Rutas de entrada/salida propias de una petición, en una carpeta temporal
+    que se borra al terminar. Evita que dos peticiones pisen el mismo WAV.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix="federico_", dir=REQUEST_TMP_DIR)
+    try:
+        yield (os.path.join(tmp_dir, IN_AUDIO_WAV),
+               os.path.join(tmp_dir, OUT_TTS_WAV))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
 
-    # Historial de conversación en memoria (por servidor)
-    history: List[Dict[str, str]] = []
 
-    # Preparar socket
+def _run_turn(conn: socket.socket, addr, histories: HistoryStore, private_files: bool,
+              header: bytes | None = None, session_id: str | None = None) -> bool:
+    """Un turno (subida + respuesta), con ficheros propios si hacen falta."""
+    if private_files and not PIPELINE_IN_MEMORY:
+        with _request_tmp_paths() as (in_wav, out_wav):
+            return handle_client(conn, addr, histories, in_wav, out_wav,
+                                 header=header, session_id=session_id)
+    return handle_client(conn, addr, histories, header=header, session_id=session_id)
+
+
+# Avisa a los hilos de sesión de que el servidor se está parando
+_stop_sessions = threading.Event()
+
+
+def _serve_session(conn: socket.socket, addr, histories: HistoryStore,
+                   session_id: str, private_files: bool, submit=None):
+    """
+    Turnos de una sesión persistente hasta que el cliente cierra, pasa
+    SESSION_IDLE_TIMEOUT_S sin hablar o el servidor se para. Esperar entre
+    turnos no ocupa un hilo del pool: cada turno se manda con 'submit'
+    (o se atiende aquí mismo en modo serie).
+    """
+    turns = 0
+    try:
+        while True:
+            header = utils_net.wait_next_turn(conn, SESSION_IDLE_TIMEOUT_S, _stop_sessions)
+            if header is None:
+                break
+            if submit is None:
+                ok = _run_turn(conn, addr, histories, private_files, header, session_id)
+            else:
+                ok = submit(_run_turn, conn, addr, histories, private_files, header, session_id).result()
+            if not ok:
+                break  # protocolo a medias: mejor cerrar y que el cliente reconecte
+            turns += 1
+    except Exception:
+        log.exception(f"[SERV] Excepción en la sesión {session_id}:")
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        log.debug(f"[SERV] Sesión {session_id} cerrada tras {turns} turno(s).")
+
+
+def _serve_connection(conn: socket.socket, addr, histories: HistoryStore,
+                      private_files: bool, submit=None):
+    """
+    Atiende una conexión y la cierra siempre, pase lo que pase. Si el cliente
+    abre una sesión persistente, la conexión pasa a un hilo propio
+    (_serve_session) y este hilo del pool queda libre.
+    """
+    keep_open = False
+    try:
+        transport.tune_socket(conn, buffer_bytes=SOCKET_BUFFER_BYTES)
+        conn.settimeout(RECV_TIMEOUT_S)
+        header = utils_net.recvall(conn, 8)
+        if not header:
+            log.debug("[SERV] Conexión cerrada sin datos.")
+            return
+
+        if header == utils_net.SESSION_MAGIC:
+            session_id = utils_net.accept_session(conn, SESSION_IDLE_TIMEOUT_S)
+            if session_id is None:
+                return
+            if submit is None:
+                _serve_session(conn, addr, histories, session_id, private_files)
+            else:
+                threading.Thread(
+                    target=_serve_session,
+                    args=(conn, addr, histories, session_id, private_files, submit),
+                    name=f"federico-sess-{session_id[:8]}", daemon=True,
+                ).start()
+            keep_open = True
+            return
+
+        _run_turn(conn, addr, histories, private_files, header)
+    except Exception:
+        log.exception("[SERV] Excepción manejando cliente:")
+    finally:
+        if not keep_open:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+def _accept(srv: socket.socket):
+    """
+    accept() con timeout corto: así Ctrl+C se atiende enseguida también en
+    Windows. Devuelve (conn, addr) o None si venció el timeout.
+    """
+    try:
+        return srv.accept()
+    except socket.timeout:
+        return None
+
+
+def serve_serial(srv: socket.socket, histories: HistoryStore):
+    """
+    Bucle original: una conexión cada vez (con ficheros, usa las rutas fijas
+    de config). Una sesión persistente ocupa el servidor hasta que se cierra.
+    """
+    while True:
+        accepted = _accept(srv)
+        if accepted is None:
+            continue
+        conn, addr = accepted
+        _serve_connection(conn, addr, histories, private_files=False)
+
+
+def serve_pool(srv: socket.socket, histories: HistoryStore, workers: int):
+    """
+    Acepta conexiones y las reparte en un pool de 'workers' hilos.
+    Al parar (Ctrl+C) deja de aceptar y espera a las peticiones en curso
+    hasta SHUTDOWN_GRACE_S segundos.
+    """
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="federico-req")
+    in_flight = set()
+    in_flight_lock = threading.Lock()
+
+    def _done(fut):
+        with in_flight_lock:
+            in_flight.discard(fut)
+
+    def _submit(fn, *args):
+        # Conexiones nuevas y turnos de sesiones persistentes pasan por aquí
+        fut = pool.submit(fn, *args)
+        with in_flight_lock:
+            in_flight.add(fut)
+        fut.add_done_callback(_done)
+        return fut
+
+    _stop_sessions.clear()
+    try:
+        while True:
+            accepted = _accept(srv)
+            if accepted is None:
+                continue
+            conn, addr = accepted
+            _submit(_serve_connection, conn, addr, histories, True, _submit)
+            log.debug(f"[SERV] Peticiones en curso/en cola: {len(in_flight)}; "
+                  f"admisión: {admission.describe()}")
+    finally:
+        # Dejar de aceptar (y de esperar turnos de sesiones) antes de drenar
+        _stop_sessions.set()
+        try:
+            srv.close()
+        except Exception:
+            pass
+        with in_flight_lock:
+            pending = set(in_flight)
+        if pending:
+            log.info(f"[SERV] Esperando a {len(pending)} petición(es) en curso "
+                  f"(máx {SHUTDOWN_GRACE_S} s)…")
+            _, not_done = wait(pending, timeout=SHUTDOWN_GRACE_S)
+            if not_done:
+                log.warning(f"[SERV] {len(not_done)} petición(es) sin terminar; se abandonan.")
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _listen_socket(reuse_port: bool = False) -> socket.socket:
+    """Crea el socket de escucha. reuse_port=True permite varios procesos en el mismo puerto."""
     srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     # Reusar puerto rápidamente tras reinicios
     srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     srv.bind((HOST, PORT))
     srv.listen(ACCEPT_BACKLOG)
+    srv.settimeout(1.0)
+    return srv
+
+
+def _prefork_supported() -> bool:
+    return hasattr(os, "fork") and hasattr(socket, "SO_REUSEPORT")
+
+
+def _prefork_child(slot: int, threads: int) -> int:
+    """
+    Cuerpo de un proceso hijo: su propio socket SO_REUSEPORT y su propio pool.
+    Devuelve el código de salida.
+    """
+    def _stop(signum, frame):
+        # Solo la primera señal interrumpe; durante el drenaje se ignoran
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
 
+    histories = HistoryStore()
+    # Cada proceso tiene sus propias métricas, en su propio puerto
+    start_metrics(histories, METRICS_PORT + 1 + slot)
     try:
-        while True:
-            conn, addr = srv.accept()
+        # El modelo se crea aquí, tras el fork; hasta tenerlo no se abre el
+        # socket y el kernel reparte las conexiones entre los hermanos listos
+        warm_up(backends=False)
+        srv = _listen_socket(reuse_port=True)
+        metrics.set_ready()
+        log.debug(f"[PREFORK] Worker {slot} (pid {os.getpid()}) escuchando.")
+        serve_pool(srv, histories, threads)
+    except KeyboardInterrupt:
+        return 0
+    except Exception:
+        log.exception(f"[PREFORK] Worker {slot} terminó con error:")
+        return 1
+    return 0
+
+
+def serve_prefork(processes: int, threads: int):
+    """
+    Modo pre-fork: el padre prepara el modelo de Whisper, lanza 'processes'
+    hijos que aceptan en el mismo puerto (SO_REUSEPORT, el kernel reparte las
+    conexiones) y los vigila: si uno muere, lo relanza. Ctrl+C/SIGTERM en el
+    padre se propaga a los hijos, que drenan sus peticiones en curso.
+    """
+    # Ficheros del modelo en caché antes del fork: los hijos no pagan la descarga
+    # ni la lectura de disco. Los núcleos de Whisper se reparten entre los hijos.
+    t0 = time.time()
+    asr_whisper.preload_model_files()
+    asr_whisper.set_cpu_threads(cpu_budget.whisper_threads(processes))
+    log.info(f"[PREFORK] Modelos preparados en {time.time() - t0:.1f} s; "
+          f"lanzando {processes} procesos x {threads} hilos")
+    # Ollama y TTS una vez para todos (los hijos heredan el aviso de ocupado)
+    warm_up(whisper_model=False)
+
+    children: Dict[int, int] = {}   # pid -> slot
+    started: Dict[int, float] = {}  # slot -> instante de arranque
+    stopping = False
+
+    def _spawn(slot: int):
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
             try:
-                handle_client(conn, addr, history)
-            except Exception:
-                print("[SERV] Excepción manejando cliente:")
-                traceback.print_exc()
+                code = _prefork_child(slot, threads)
             finally:
-                try:
-                    conn.close()
-                except Exception:
-                    pass
+                tracing.flush()  # os._exit() no pasa por atexit
+                capture.flush()
+                sys.stdout.flush()
+                os._exit(code)
+        children[pid] = slot
+        started[slot] = time.time()
+
+    def _terminate(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, _terminate)
+
+    try:
+        for slot in range(processes):
+            _spawn(slot)
+
+        while children:
+            pid, status = os.wait()
+            slot = children.pop(pid, None)
+            if slot is None or stopping:
+                continue
+            log.warning(f"[PREFORK] Worker {slot} (pid {pid}) salió con estado {status}; relanzando.")
+            # Si muere nada más arrancar, no entrar en bucle de relanzamientos
+            if time.time() - started.get(slot, 0.0) < 5.0:
+                time.sleep(PREFORK_RESTART_DELAY_S)
+            _spawn(slot)
+
+    except KeyboardInterrupt:
+        stopping = True
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        print(f"\n[PREFORK] Parando {len(children)} worker(s)…")
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                children.pop(pid, None)
+        deadline = time.time() + SHUTDOWN_GRACE_S + 5
+        while children and time.time() < deadline:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                time.sleep(0.1)
+                continue
+            children.pop(pid, None)
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        raise
+
+
+def main():
+    print("=== Servidor Asistente de Voz ===")
+    print(f"Escuchando en {HOST}:{PORT} (Ctrl+C para salir)")
+
+    if SERVER_MODE == "async":
+        try:
+            from . import async_main
+        except ImportError:
+            import async_main
+        async_main.run()
+        return
+
+    if SERVER_MODE == "prefork":
+        if _prefork_supported():
+            processes = PREFORK_PROCESSES or (os.cpu_count() or 1)
+            try:
+                serve_prefork(processes, PREFORK_THREADS)
+            except KeyboardInterrupt:
+                print("\n👋 Servidor detenido por usuario.")
+            return
+        log.warning("[SERV] Prefork no disponible en este sistema; uso modo pool.")
+
+    # Historiales de conversación en memoria (uno por sesión)
+    histories = HistoryStore()
+    start_metrics(histories)
+
+    # Modelos cargados antes de abrir el puerto (mientras, /ready da 503)
+    warm_up()
+
+    # Preparar socket
+    srv = _listen_socket()
+    metrics.set_ready()
+
+    try:
+        if SERVER_MODE in ("pool", "prefork"):
+            print(f"Modo pool: {SERVER_WORKERS} peticiones en paralelo")
+            serve_pool(srv, histories, SERVER_WORKERS)
+        else:
+            serve_serial(srv, histories)
 
     except KeyboardInterrupt:
         print("\n👋 Servidor detenido por usuario.")
@@ -0,0 +1,231 @@
+# server/metrics.py
+# ====================================
+# Métricas del servidor en formato Prometheus (sin dependencias)
+#  - observe()/timed(): latencia por etapa (receive, asr, intents, llm, tts,
+#    send, ...) en un histograma con buckets fijos + las últimas
+#    METRICS_WINDOW muestras para p50/p95/p99
+#  - count(): contadores con etiquetas (qué backend atendió: /api/chat o
+#    /api/generate, edge-tts o pyttsx3, atajo o LLM, ...)
+#  - register_collector(): valores que se leen al consultar (admisión, historial)
+#  - start_http_server(): http://METRICS_HOST:METRICS_PORT/metrics en un hilo
+#  - set_ready(): /ready en el mismo puerto, 503 hasta que el servidor acepta
+#    peticiones (tras el arranque en caliente, server/warmup.py) y luego 200
+# Coste por medida: un lock, un bisect y un append; se puede dejar siempre activo.
+# ====================================
+
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    from .config import METRICS_ENABLED, METRICS_HOST, METRICS_WINDOW
+except ImportError:
+    from config import METRICS_ENABLED, METRICS_HOST, METRICS_WINDOW
+
+PREFIX = "federico"
+
+# Segundos: de decenas de ms (atajos, red en LAN) a un minuto (LLM lento)
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# (nombre, tipo, ayuda, valor) que devuelve un colector
+Sample = Tuple[str, str, str, float]
+
+
+class _Histogram:
+    __slots__ = ("buckets", "sum", "count", "window")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)  # el último es +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.window = deque(maxlen=METRICS_WINDOW)
+
+    def observe(self, value: float):
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.window.append(value)
+
+
+_lock = threading.Lock()
+_stages: Dict[str, _Histogram] = {}
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], int] = {}
+_collectors: List[Callable[[], Iterable[Sample]]] = []
+_ready = False
+
+
+def _log():
+    # tracing importa este módulo: su log se importa al usarlo
+    try:
+        from .tracing import log
+    except ImportError:
+        from tracing import log
+    return log
+
+
+def observe(stage: str, seconds: float):
+    """Apunta lo que tardó una etapa."""
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        hist = _stages.get(stage)
+        if hist is None:
+            hist = _stages[stage] = _Histogram()
+        hist.observe(seconds)
+
+
+@contextmanager
+def timed(stage: str):
+    """with timed("asr"): ... -> observe("asr", duración), también si hay excepción."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - t0)
+
+
+
+def count(name: str, **labels: str):
+    """Suma 1 al contador 'name' con esas etiquetas (p. ej. count("llm_backend", backend="chat"))."""
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + 1
+
+
+def register_collector(fn: Callable[[], Iterable[Sample]]):
+    """'fn' se llama en cada consulta y devuelve (nombre, tipo, ayuda, valor)."""
+    _collectors.append(fn)
+
+
+def set_ready(ready: bool = True):
+    """Marca si el servidor ya acepta peticiones (lo que responde /ready)."""
+    global _ready
+    _ready = bool(ready)
+
+
+def _quantile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[idx]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs: Iterable[Tuple[str, str]]) -> str:
+    inner = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + inner + "}" if inner else ""
+
+
+def _fmt(value: float) -> str:
+    if value != value:
+        return "NaN"
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def render() -> str:
+    """Todas las métricas en el formato de texto de Prometheus (0.0.4)."""
+    with _lock:
+        stages = {name: (list(h.buckets), h.sum, h.count, sorted(h.window))
+                  for name, h in _stages.items()}
+        counters = dict(_counters)
+
+    lines: List[str] = []
+    hist_name = f"{PREFIX}_stage_duration_seconds"
+    lines.append(f"# HELP {hist_name} Duración de cada etapa de un turno.")
+    lines.append(f"# TYPE {hist_name} histogram")
+    for stage, (buckets, total, n, _) in sorted(stages.items()):
+        acc = 0
+        for bound, c in zip(BUCKETS + (float("inf"),), buckets):
+            acc += c
+            lines.append(f"{hist_name}_bucket{_labels([('stage', stage), ('le', _fmt(bound))])} {acc}")
+        lines.append(f"{hist_name}_sum{_labels([('stage', stage)])} {_fmt(total)}")
+        lines.append(f"{hist_name}_count{_labels([('stage', stage)])} {n}")
+
+    sum_name = f"{PREFIX}_stage_latency_seconds"
+    lines.append(f"# HELP {sum_name} p50/p95/p99 de cada etapa sobre las últimas {METRICS_WINDOW} muestras.")
+    lines.append(f"# TYPE {sum_name} summary")
+    for stage, (_, total, n, window) in sorted(stages.items()):
+        for q in QUANTILES:
+            lines.append(f"{sum_name}{_labels([('stage', stage), ('quantile', _fmt(q))])} "
+                         f"{_fmt(_quantile(window, q))}")
+        lines.append(f"{sum_name}_sum{_labels([('stage', stage)])} {_fmt(total)}")
+        lines.append(f"{sum_name}_count{_labels([('stage', stage)])} {n}")
+
+    by_name: Dict[str, List[Tuple[Tuple[Tuple[str, str], ...], int]]] = {}
+    for (name, labels), value in counters.items():
+        by_name.setdefault(name, []).append((labels, value))
+    for name, samples in sorted(by_name.items()):
+        full = f"{PREFIX}_{name}_total"
+        lines.append(f"# TYPE {full} counter")
+        for labels, value in sorted(samples):
+            lines.append(f"{full}{_labels(labels)} {value}")
+
+    lines.append(f"# HELP {PREFIX}_ready 1 si el servidor ya acepta peticiones (arranque terminado).")
+    lines.append(f"# TYPE {PREFIX}_ready gauge")
+    lines.append(f"{PREFIX}_ready {int(_ready)}")
+
+    for fn in list(_collectors):
+        try:
+            samples = list(fn())
+        except Exception as e:
+            _log().debug("[MET] Error en un colector:", e)
+            continue
+        for name, kind, help_text, value in samples:
+            full = f"{PREFIX}_{name}"
+            lines.append(f"# HELP {full} {help_text}")
+            lines.append(f"# TYPE {full} {kind}")
+            lines.append(f"{full} {_fmt(value)}")
+
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/ready":
+            self._reply(200 if _ready else 503, b"ready\n" if _ready else b"warming up\n",
+                        "text/plain; charset=utf-8")
+            return
+        if path != "/metrics":
+            self.send_error(404)
+            return
+        self._reply(200, render().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8")
+
+    def _reply(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass  # una línea por consulta de Prometheus sobra
+
+
+def start_http_server(port: int, host: str = METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """Sirve /metrics y /ready en un hilo daemon. None si está desactivado o el puerto está ocupado."""
+    if not METRICS_ENABLED:
+        return None
+    try:
+        httpd = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        _log().warning(f"[MET] No se pudo abrir {host}:{port} para /metrics:", e)
+        return None
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="federico-metrics", daemon=True).start()
+    _log().info(f"[MET] Métricas en http://{host}:{port}/metrics")
+    return httpd
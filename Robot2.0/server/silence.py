@@ -0,0 +1,57 @@
+# server/silence.py
+# ====================================
+# Recorte de silencio por energía, antes de Whisper (ASR_TRIM_* en config.py)
+# Los clientes mandan todo lo que grabaron: la calibración del micro, el
+# silencio previo y la cola de silencio con la que su VAD decide que se
+# acabó la locución. speech_bounds() localiza la voz por energía en tramos
+# de 20 ms (NumPy, sin copiar el audio):
+#  - voz = tramo por encima del ruido de fondo (percentil 10) + ASR_TRIM_MARGIN_DB
+#    y por encima de ASR_TRIM_MIN_DBFS
+#  - sin contraste (todo al mismo nivel: todo voz o todo ruido) no se recorta
+#    nada; solo se descarta si todo queda por debajo de ASR_TRIM_MIN_DBFS
+#  - menos de ASR_TRIM_MIN_SPEECH_MS de voz => None: no hay nada que transcribir
+#  - si no, (inicio, fin) en muestras con ASR_TRIM_PAD_MS de margen a cada lado
+# ====================================
+
+from __future__ import annotations
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+try:
+    from .config import ASR_TRIM_MIN_DBFS, ASR_TRIM_MARGIN_DB, ASR_TRIM_MIN_SPEECH_MS, ASR_TRIM_PAD_MS
+except ImportError:
+    from config import ASR_TRIM_MIN_DBFS, ASR_TRIM_MARGIN_DB, ASR_TRIM_MIN_SPEECH_MS, ASR_TRIM_PAD_MS
+
+FRAME_MS = 20
+
+
+def frame_dbfs(audio: np.ndarray, sample_rate: int = 16000) -> np.ndarray:
+    """Energía (dBFS) de cada tramo de FRAME_MS de 'audio' (float32 en [-1, 1])."""
+    frame = max(1, sample_rate * FRAME_MS // 1000)
+    n = len(audio) // frame
+    if n == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = audio[: n * frame].reshape(n, frame)
+    power = np.einsum("ij,ij->i", frames, frames) / frame  # sin el cuadrado intermedio
+    return 10.0 * np.log10(np.maximum(power, 1e-12))
+
+
+def speech_bounds(audio: np.ndarray, sample_rate: int = 16000) -> Optional[Tuple[int, int]]:
+    """(inicio, fin) en muestras de la voz de 'audio', o None si no la hay."""
+    db = frame_dbfs(audio, sample_rate)
+    if len(db) == 0:
+        return None
+    floor, top = float(np.percentile(db, 10)), float(db.max())
+    if top - floor < ASR_TRIM_MARGIN_DB:
+        return (0, len(audio)) if top > ASR_TRIM_MIN_DBFS else None
+    threshold = max(ASR_TRIM_MIN_DBFS, floor + ASR_TRIM_MARGIN_DB)
+    voiced = np.flatnonzero(db > threshold)
+    if len(voiced) * FRAME_MS < ASR_TRIM_MIN_SPEECH_MS:
+        return None
+    frame = sample_rate * FRAME_MS // 1000
+    pad = sample_rate * ASR_TRIM_PAD_MS // 1000
+    start = max(0, int(voiced[0]) * frame - pad)
+    end = min(len(audio), (int(voiced[-1]) + 1) * frame + pad)
+    return start, end
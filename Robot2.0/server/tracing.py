@@ -0,0 +1,361 @@
+# server/tracing.py
+# ====================================
+# Trazas estructuradas por petición
+#  - request(): cada turno recibe un ID (request_id) que viaja en un
+#    contextvars.ContextVar: lo ven asr_whisper, commands, llm_ollama,
+#    tts_engine y utils_net sin pasarlo como parámetro. En asyncio lo heredan
+#    las tareas y asyncio.to_thread; a los pools de hilos se pasa con bind()
+#  - span(): tramo con su duración (y padre, para anidarlos)
+#  - stage(): span de una etapa del turno; además alimenta las métricas
+#    (metrics.py) y los tiempos que se devuelven al cliente si los pide
+#  - log.debug/info/warning/error(): en lugar de print(); llevan el
+#    request_id y salen por consola desde LOG_LEVEL
+# Todo se encola y lo escribe un hilo de fondo: a TRACE_FILE en JSON por
+# línea y a la consola. El hilo que atiende la petición nunca espera a
+# stdout ni al disco; si la cola se llena, se descarta (y se cuenta).
+# ====================================
+
+from __future__ import annotations
+
+import atexit
+import contextvars
+import itertools
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+try:
+    from .config import LOG_LEVEL, TRACE_FILE, TRACE_LEVEL, TRACE_QUEUE_MAX
+    from . import metrics
+except ImportError:
+    from config import LOG_LEVEL, TRACE_FILE, TRACE_LEVEL, TRACE_QUEUE_MAX
+    import metrics
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+_LEVEL_NAMES = {v: k for k, v in LEVELS.items()}
+
+_console_level = LEVELS.get(LOG_LEVEL.upper(), 20)
+_file_level = LEVELS.get(TRACE_LEVEL.upper(), 20) if TRACE_FILE else 99
+_min_level = min(_console_level, _file_level)
+_spans_on = bool(TRACE_FILE)
+
+
+# ---------------------------------------------------------------
+# Contexto de la petición
+# ---------------------------------------------------------------
+class RequestTrace:
+    """Estado de un turno: su ID, cuándo empezó y cuánto tardó cada etapa."""
+    __slots__ = ("id", "attrs", "wall", "t0", "timings", "reply_trace")
+
+    def __init__(self, request_id: str, attrs: Dict[str, Any]):
+        self.id = request_id
+        self.attrs = attrs
+        self.wall = time.time()
+        self.t0 = time.perf_counter()
+        self.timings: Dict[str, float] = {}  # etapa -> ms (se suman si se repite)
+        self.reply_trace = False  # el cliente pidió su ID y tiempos al final de la respuesta
+
+    def add_timing(self, stage_name: str, ms: float):
+        self.timings[stage_name] = self.timings.get(stage_name, 0.0) + ms
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.t0) * 1000
+
+    def summary(self) -> Dict[str, Any]:
+        """Lo que se devuelve al cliente: ID, total y ms por etapa hasta ahora."""
+        return {"request_id": self.id, "total_ms": round(self.elapsed_ms(), 1),
+                "timings_ms": {k: round(v, 1) for k, v in self.timings.items()}}
+
+
+_request: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar(
+    "federico_request", default=None)
+_span: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar(
+    "federico_span", default=None)
+_span_ids = itertools.count(1)
+
+
+def new_request_id() -> str:
+    return os.urandom(6).hex()
+
+
+def current() -> Optional[RequestTrace]:
+    """La petición en curso en este contexto (None fuera de un turno)."""
+    return _request.get()
+
+
+def current_request_id() -> Optional[str]:
+    req = _request.get()
+    return req.id if req is not None else None
+
+
+@contextmanager
+def request(request_id: Optional[str] = None, **attrs):
+    """Abre el contexto de un turno; al cerrarlo se escribe su registro 'request'."""
+    req = RequestTrace(request_id or new_request_id(), attrs)
+    token = _request.set(req)
+    span_token = _span.set(None)
+    error = None
+    try:
+        yield req
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _span.reset(span_token)
+        _request.reset(token)
+        if _spans_on:
+            rec = {"type": "request", "rid": req.id, "ts": round(req.wall, 6),
+                   "ms": round(req.elapsed_ms(), 3),
+                   "timings_ms": {k: round(v, 3) for k, v in req.timings.items()}}
+            if attrs:
+                rec["attrs"] = attrs
+            if error:
+                rec["error"] = error
+            _emit(rec, to_file=True)
+
+
+def bind(fn: Callable) -> Callable:
+    """
+    'fn' con el contexto actual (request_id, span padre), para ejecutarla en
+    otro hilo (ThreadPoolExecutor.submit, loop.run_in_executor).
+    """
+    ctx = contextvars.copy_context()
+
+    def _bound(*args, **kwargs):
+        # copy(): un mismo Context no puede estar activo en dos hilos a la vez
+        return ctx.copy().run(fn, *args, **kwargs)
+    return _bound
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Tramo con duración. Devuelve 'attrs' para añadir datos por el camino
+    (p. ej. bytes enviados). No envolver un 'yield' de un generador con él.
+    """
+    if not _spans_on:
+        yield attrs
+        return
+    sid = next(_span_ids)
+    parent = _span.get()
+    token = _span.set(sid)
+    wall = time.time()
+    t0 = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        _span.reset(token)
+        rec = {"type": "span", "rid": current_request_id(), "id": sid, "parent": parent,
+               "name": name, "ts": round(wall, 6), "ms": round(ms, 3)}
+        if attrs:
+            rec["attrs"] = attrs
+        if error:
+            rec["error"] = error
+        _emit(rec, to_file=True)
+
+
+def observe(stage_name: str, seconds: float):
+    """Duración de una etapa medida a mano: métricas y tiempos de la petición."""
+    metrics.observe(stage_name, seconds)
+    req = _request.get()
+    if req is not None:
+        req.add_timing(stage_name, seconds * 1000)
+
+
+@contextmanager
+def stage(name: str, **attrs):
+    """span() de una etapa del turno (receive, asr, llm, tts, send...) + observe()."""
+    t0 = time.perf_counter()
+    try:
+        with span(name, **attrs) as a:
+            yield a
+    finally:
+        observe(name, time.perf_counter() - t0)
+
+
+def observe_first(chunks, stage_name: str, since: float):
+    """Reenvía 'chunks' y apunta en 'stage_name' cuánto tardó el primero desde 'since'."""
+    first = True
+    for chunk in chunks:
+        if first:
+            observe(stage_name, time.perf_counter() - since)
+            first = False
+        yield chunk
+
+
+async def observe_first_async(chunks, stage_name: str, since: float):
+    """Como observe_first() para iteradores asíncronos."""
+    first = True
+    async for chunk in chunks:
+        if first:
+            observe(stage_name, time.perf_counter() - since)
+            first = False
+        yield chunk
+
+
+# ---------------------------------------------------------------
+# Mensajes (sustituyen a print)
+# ---------------------------------------------------------------
+class _Log:
+    """log.debug("[NET] ...", valor) con los mismos argumentos que print()."""
+
+    def debug(self, *parts, **attrs):
+        self._log(10, parts, attrs)
+
+    def info(self, *parts, **attrs):
+        self._log(20, parts, attrs)
+
+    def warning(self, *parts, **attrs):
+        self._log(30, parts, attrs)
+
+    def error(self, *parts, **attrs):
+        self._log(40, parts, attrs)
+
+    def exception(self, *parts, **attrs):
+        """error() con el traceback de la excepción en curso."""
+        self._log(40, parts, attrs, tb=traceback.format_exc())
+
+    @staticmethod
+    def enabled(level: str) -> bool:
+        """Para no preparar mensajes caros que nadie va a ver."""
+        return LEVELS.get(level.upper(), 20) >= _min_level
+
+    @staticmethod
+    def _log(level: int, parts, attrs, tb: Optional[str] = None):
+        if level < _min_level:
+            return
+        rec = {"type": "log", "ts": round(time.time(), 6), "level": _LEVEL_NAMES[level],
+               "msg": " ".join(str(p) for p in parts)}
+        rid = current_request_id()
+        if rid:
+            rec["rid"] = rid
+        if attrs:
+            rec["attrs"] = attrs
+        if tb:
+            rec["traceback"] = tb
+        _emit(rec, to_file=level >= _file_level, console=level >= _console_level)
+
+
+log = _Log()
+
+
+# ---------------------------------------------------------------
+# Escritura en segundo plano
+# ---------------------------------------------------------------
+_queue: "queue.Queue" = queue.Queue(maxsize=TRACE_QUEUE_MAX)
+_writer: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+_dropped = 0
+_STOP = object()
+
+
+def _emit(rec: dict, to_file: bool = False, console: bool = False):
+    if not (to_file or console):
+        return
+    if _writer is None:
+        _start_writer()
+    try:
+        _queue.put_nowait((rec, to_file, console))
+    except queue.Full:
+        global _dropped
+        _dropped += 1
+
+
+def _console_line(rec: dict) -> str:
+    rid = rec.get("rid")
+    line = f"[{rid}] {rec['msg']}" if rid else rec["msg"]
+    if rec.get("traceback"):
+        line += "\n" + rec["traceback"].rstrip()
+    return line
+
+
+def _write_loop(q: "queue.Queue"):
+    out = None
+    if TRACE_FILE:
+        try:
+            out = open(TRACE_FILE, "a", encoding="utf-8")
+        except OSError as e:
+            print(f"[TRACE] No se pudo abrir {TRACE_FILE}: {e}", file=sys.stderr)
+    while True:
+        batch = [q.get()]
+        # Lo que haya acumulado se escribe de una vez
+        while len(batch) < 512:
+            try:
+                batch.append(q.get_nowait())
+            except queue.Empty:
+                break
+        stop = False
+        lines, console = [], []
+        for item in batch:
+            if item is _STOP:
+                stop = True
+                continue
+            rec, to_file, to_console = item
+            if to_file and out is not None:
+                lines.append(json.dumps(rec, ensure_ascii=False, default=str))
+            if to_console:
+                console.append(_console_line(rec))
+        try:
+            if lines:
+                out.write("\n".join(lines) + "\n")
+                out.flush()
+            if console:
+                sys.stdout.write("\n".join(console) + "\n")
+                sys.stdout.flush()
+        except Exception as e:
+            print(f"[TRACE] Error escribiendo trazas: {e}", file=sys.stderr)
+        if stop:
+            if out is not None:
+                out.close()
+            return
+
+
+def _start_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_loop, args=(_queue,),
+                                       name="federico-trace", daemon=True)
+            _writer.start()
+
+
+def flush(timeout: float = 2.0):
+    """Escribe lo pendiente y para el hilo (al salir; se relanza si llega algo más)."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is None:
+        return
+    try:
+        _queue.put(_STOP, timeout=timeout)
+    except queue.Full:
+        return
+    writer.join(timeout)
+
+
+def _after_fork_in_child():
+    # El hilo de escritura no sobrevive al fork: cola y hilo nuevos en el hijo
+    global _queue, _writer, _writer_lock, _dropped
+    _queue = queue.Queue(maxsize=TRACE_QUEUE_MAX)
+    _writer = None
+    _writer_lock = threading.Lock()
+    _dropped = 0
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+atexit.register(flush)
+metrics.register_collector(lambda: [
+    ("trace_dropped_total", "counter", "Registros de traza descartados por cola llena.", _dropped),
+])
@@ -3,15 +3,31 @@
 # Síntesis de voz a WAV:
 #  - Preferente: Microsoft Edge TTS (online) vía subprocess (formato WAV PCM)
 #  - Fallback: pyttsx3 (offline) a WAV
+# tts_to_wav_bytes() devuelve el WAV en memoria (edge-tts escribe en stdout);
+# tts_to_wav() lo deja en un fichero (ruta de depuración).
+# Para la respuesta progresiva: iter_tts_pcm() trocea por frases y entrega
+# el PCM de cada una en cuanto está listo; iter_tts_pcm_stream() hace lo
+# mismo con frases que todavía se están generando (LLM token a token,
+# iter_sentences()).
+# warm_up() arranca los dos motores al iniciar el servidor.
 # ====================================
 
 from __future__ import annotations
 
+import asyncio
+import queue
+import re
 import subprocess
 import sys
 import os
-from typing import Optional
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, List, Optional, Tuple
 
+from . import metrics
+from .tracing import bind, log, span
+from .wav_utils import parse_wav_pcm16
 from .config import (
     USE_EDGE_TTS,
     EDGE_TTS_VOICE,
@@ -19,9 +35,23 @@ from .config import (
     EDGE_TTS_PITCH,
     EDGE_TTS_VOLUME,
     PYTTSX3_RATE,
-    debug_enabled,
+    TTS_STREAM_PARALLEL,
+    TTS_STREAM_MIN_CHARS,
 )
 
+# (pcm16, sample_rate, channels); el PCM puede ser una memoryview sobre el WAV
+PcmChunk = Tuple[bytes, int, int]
+
+# pyttsx3 no es seguro entre hilos: una síntesis cada vez
+_pyttsx3_lock = threading.Lock()
+
+
+def _counted(result, engine: str):
+    """Apunta en las métricas qué motor sintetizó ("none" si no salió nada)."""
+    metrics.count("tts_backend", engine=engine if result else "none")
+    return result
+
+
 def tts_to_wav(text: str, out_wav_path: str) -> Optional[str]:
     """
     Sintetiza 'text' a un WAV (16kHz, 16-bit mono) en 'out_wav_path'.
@@ -33,41 +63,70 @@ def tts_to_wav(text: str, out_wav_path: str) -> Optional[str]:
 
     # 1) Intento Edge TTS (online) si está habilitado en config
     if USE_EDGE_TTS:
-        if debug_enabled():
-            print(f"[TTS] Edge TTS -> WAV: {len(text)} chars -> {out_wav_path}")
-        ok = _edge_tts_wav(text, out_wav_path)
+        log.debug(f"[TTS] Edge TTS -> WAV: {len(text)} chars -> {out_wav_path}")
+        with span("tts", engine="edge", chars=len(text)):
+            ok = _edge_tts_wav(text, out_wav_path)
         if ok:
-            return out_wav_path
+            return _counted(out_wav_path, "edge")
         else:
-            print("[TTS] Edge TTS falló; usando pyttsx3 (offline).")
+            log.warning("[TTS] Edge TTS falló; usando pyttsx3 (offline).")
 
     # 2) Fallback: pyttsx3 (offline)
-    if debug_enabled():
-        print(f"[TTS] pyttsx3 -> WAV: {len(text)} chars -> {out_wav_path}")
-    ok = _pyttsx3_wav(text, out_wav_path)
-    return out_wav_path if ok else None
+    log.debug(f"[TTS] pyttsx3 -> WAV: {len(text)} chars -> {out_wav_path}")
+    with span("tts", engine="pyttsx3", chars=len(text)):
+        ok = _pyttsx3_wav(text, out_wav_path)
+    return _counted(out_wav_path if ok else None, "pyttsx3")
+
+
+def tts_to_wav_bytes(text: str) -> Optional[bytes]:
+    """
+    Como tts_to_wav() pero devuelve el WAV en memoria, o None si falló.
+    """
+    text = (text or "").strip()
+    if not text:
+        return None
+
+    if USE_EDGE_TTS:
+        log.debug(f"[TTS] Edge TTS -> memoria: {len(text)} chars")
+        with span("tts", engine="edge", chars=len(text)):
+            data = _edge_tts_bytes(text)
+        if data:
+            return _counted(data, "edge")
+        log.warning("[TTS] Edge TTS falló; usando pyttsx3 (offline).")
+
+    log.debug(f"[TTS] pyttsx3 -> memoria: {len(text)} chars")
+    with span("tts", engine="pyttsx3", chars=len(text)):
+        data = _pyttsx3_bytes(text)
+    return _counted(data, "pyttsx3")
 
 
 # -------------------------------------------------------------------
 # Edge TTS (vía subprocess -m edge_tts) -> WAV PCM 16kHz 16-bit mono
 # -------------------------------------------------------------------
+def _edge_tts_cmd(text: str, out_wav_path: Optional[str]) -> list[str]:
+    # edge-tts soporta salida WAV PCM con --format riff-16khz-16bit-mono-pcm.
+    # Sin --write-media el audio sale por stdout.
+    cmd = [
+        sys.executable, "-m", "edge_tts",
+        "--voice", EDGE_TTS_VOICE,
+        "--text", text,
+        "--format", "riff-16khz-16bit-mono-pcm",
+        "--rate", EDGE_TTS_RATE,
+        "--pitch", EDGE_TTS_PITCH,
+        "--volume", EDGE_TTS_VOLUME,
+    ]
+    if out_wav_path:
+        cmd += ["--write-media", out_wav_path]
+    return cmd
+
+
 def _edge_tts_wav(text: str, out_wav_path: str) -> bool:
     """
     Usa el binario de Python para llamar al módulo edge_tts y guardar WAV PCM.
     Requiere conexión a Internet.
     """
     try:
-        # edge-tts soporta salida WAV PCM con --format riff-16khz-16bit-mono-pcm
-        cmd = [
-            sys.executable, "-m", "edge_tts",
-            "--voice", EDGE_TTS_VOICE,
-            "--text", text,
-            "--format", "riff-16khz-16bit-mono-pcm",
-            "--write-media", out_wav_path,
-            "--rate", EDGE_TTS_RATE,
-            "--pitch", EDGE_TTS_PITCH,
-            "--volume", EDGE_TTS_VOLUME,
-        ]
+        cmd = _edge_tts_cmd(text, out_wav_path)
         # Capturamos stdout/stderr para diagnóstico sin ensuciar consola
         res = subprocess.run(
             cmd,
@@ -78,37 +137,66 @@ def _edge_tts_wav(text: str, out_wav_path: str) -> bool:
             errors="ignore",
         )
         if res.returncode != 0:
-            if debug_enabled():
-                print("[TTS][edge-tts] returncode:", res.returncode)
-                print("[TTS][edge-tts] stderr:", (res.stderr or "").strip()[:500])
+            log.debug("[TTS][edge-tts] returncode:", res.returncode)
+            log.debug("[TTS][edge-tts] stderr:", (res.stderr or "").strip()[:500])
             return False
 
         if not os.path.isfile(out_wav_path) or os.path.getsize(out_wav_path) == 0:
-            if debug_enabled():
-                print("[TTS][edge-tts] No se generó WAV.")
+            log.debug("[TTS][edge-tts] No se generó WAV.")
             return False
 
         return True
 
     except FileNotFoundError:
         # edge-tts no instalado
-        if debug_enabled():
-            print("[TTS][edge-tts] Módulo no encontrado (instala: pip install edge-tts).")
+        log.debug("[TTS][edge-tts] Módulo no encontrado (instala: pip install edge-tts).")
         return False
     except Exception as e:
-        if debug_enabled():
-            print("[TTS][edge-tts] Excepción:", e)
+        log.debug("[TTS][edge-tts] Excepción:", e)
         return False
 
 
+def _edge_tts_bytes(text: str) -> Optional[bytes]:
+    """Como _edge_tts_wav() pero recogiendo el WAV de stdout."""
+    try:
+        res = subprocess.run(
+            _edge_tts_cmd(text, None),
+            check=False,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        if res.returncode != 0:
+            log.debug("[TTS][edge-tts] returncode:", res.returncode)
+            log.debug("[TTS][edge-tts] stderr:", res.stderr.decode("utf-8", "ignore").strip()[:500])
+            return None
+
+        if not res.stdout:
+            log.debug("[TTS][edge-tts] No se generó audio.")
+            return None
+
+        return res.stdout
+
+    except FileNotFoundError:
+        log.debug("[TTS][edge-tts] Módulo no encontrado (instala: pip install edge-tts).")
+        return None
+    except Exception as e:
+        log.debug("[TTS][edge-tts] Excepción:", e)
+        return None
+
+
 # ---------------------------------------
 # pyttsx3 (offline) -> WAV (bloqueante)
 # ---------------------------------------
 def _pyttsx3_wav(text: str, out_wav_path: str) -> bool:
+    with _pyttsx3_lock:
+        return _pyttsx3_wav_locked(text, out_wav_path)
+
+
+def _pyttsx3_wav_locked(text: str, out_wav_path: str) -> bool:
     try:
         import pyttsx3
     except Exception as e:
-        print("[TTS][pyttsx3] No disponible:", e)
+        log.error("[TTS][pyttsx3] No disponible:", e)
         return False
 
     try:
@@ -125,10 +213,376 @@ def _pyttsx3_wav(text: str, out_wav_path: str) -> bool:
         engine.runAndWait()
 
         ok = os.path.isfile(out_wav_path) and os.path.getsize(out_wav_path) > 0
-        if debug_enabled() and not ok:
-            print("[TTS][pyttsx3] WAV no generado.")
+        if not ok:
+            log.debug("[TTS][pyttsx3] WAV no generado.")
         return ok
 
     except Exception as e:
-        print("[TTS][pyttsx3] Error sintetizando:", e)
+        log.error("[TTS][pyttsx3] Error sintetizando:", e)
         return False
+
+
+def _pyttsx3_bytes(text: str) -> Optional[bytes]:
+    """
+    pyttsx3 solo sabe escribir a fichero: se usa uno temporal que se lee y se
+    borra enseguida. Es el camino de emergencia, así que no importa el disco.
+    """
+    fd, path = tempfile.mkstemp(prefix="federico_tts_", suffix=".wav")
+    os.close(fd)
+    try:
+        os.remove(path)  # que el motor lo cree; así "no existe" = falló
+        if not _pyttsx3_wav(text, path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def warm_up(text: str = "Hola.") -> list:
+    """
+    Sintetiza 'text' con edge-tts (si está activado) y con pyttsx3 (si está
+    instalado) para pagar al arrancar el primer proceso, la primera conexión y
+    la carga del driver de voz. Devuelve los motores que respondieron.
+    """
+    ready = []
+    if USE_EDGE_TTS:
+        if _edge_tts_bytes(text):
+            ready.append("edge")
+        else:
+            log.warning("[TTS] Edge TTS no respondió al arrancar.")
+    try:
+        import pyttsx3  # noqa: F401
+    except Exception:
+        log.debug("[TTS] pyttsx3 no instalado; no hay motor offline.")
+        return ready
+    if _pyttsx3_bytes(text):
+        ready.append("pyttsx3")
+    return ready
+
+
+# ---------------------------------------------------------------
+# Respuesta progresiva: una trama PCM por frase
+# ---------------------------------------------------------------
+_SENTENCE_RE = re.compile(r"(?<=[.!?;:…])\s+")
+_stream_executor = ThreadPoolExecutor(max_workers=TTS_STREAM_PARALLEL, thread_name_prefix="federico-tts")
+
+
+def split_sentences(text: str, min_chars: int = TTS_STREAM_MIN_CHARS) -> list[str]:
+    """
+    Parte el texto en frases. Las muy cortas se unen a la siguiente para no
+    lanzar un edge-tts por cada "Vale." suelto.
+    """
+    parts = [p.strip() for p in _SENTENCE_RE.split((text or "").strip()) if p.strip()]
+    out: list[str] = []
+    buf = ""
+    for p in parts:
+        buf = f"{buf} {p}" if buf else p
+        if len(buf) >= min_chars:
+            out.append(buf)
+            buf = ""
+    if buf:
+        if out:
+            out[-1] = f"{out[-1]} {buf}"
+        else:
+            out.append(buf)
+    return out
+
+
+class _SentenceSplitter:
+    """split_sentences() para texto que llega a trozos: feed() da las frases ya cerradas."""
+
+    def __init__(self, min_chars: int):
+        self.min_chars = min_chars
+        self._open = ""     # frase en curso (aún sin el espacio que la cierra)
+        self._short = ""    # frases cerradas demasiado cortas, esperando a la siguiente
+
+    def feed(self, piece: str) -> List[str]:
+        *closed, self._open = _SENTENCE_RE.split(self._open + piece)
+        out = []
+        for sentence in closed:
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            self._short = f"{self._short} {sentence}" if self._short else sentence
+            if len(self._short) >= self.min_chars:
+                out.append(self._short)
+                self._short = ""
+        return out
+
+    def flush(self) -> List[str]:
+        rest = " ".join(p for p in (self._short, self._open.strip()) if p)
+        self._short = self._open = ""
+        return [rest] if rest else []
+
+
+def iter_sentences(pieces: Iterable[str], min_chars: int = TTS_STREAM_MIN_CHARS) -> Iterator[str]:
+    """
+    Frases de un texto que llega a trozos (tokens del LLM): cada una sale en
+    cuanto llega el espacio que la cierra; al acabar, lo que quede.
+    """
+    splitter = _SentenceSplitter(min_chars)
+    for piece in pieces:
+        yield from splitter.feed(piece)
+    yield from splitter.flush()
+
+
+async def iter_sentences_async(pieces: AsyncIterable[str],
+                               min_chars: int = TTS_STREAM_MIN_CHARS) -> AsyncIterator[str]:
+    """Como iter_sentences() para iteradores asíncronos."""
+    splitter = _SentenceSplitter(min_chars)
+    async for piece in pieces:
+        for sentence in splitter.feed(piece):
+            yield sentence
+    for sentence in splitter.flush():
+        yield sentence
+
+
+def _wav_bytes_to_pcm(data: Optional[bytes]) -> Optional[PcmChunk]:
+    if not data:
+        return None
+    parsed = parse_wav_pcm16(data)
+    if parsed is None:
+        log.debug("[TTS] El audio sintetizado no es WAV PCM16; no se puede enviar por tramas.")
+    return parsed
+
+
+def tts_to_pcm(text: str) -> Optional[PcmChunk]:
+    """Sintetiza 'text' y devuelve (pcm16, sample_rate, channels) o None."""
+    return _wav_bytes_to_pcm(tts_to_wav_bytes(text))
+
+
+def iter_tts_pcm(text: str) -> Iterator[PcmChunk]:
+    """
+    Genera el PCM de la respuesta frase a frase, en orden.
+    Todas las frases se lanzan a la vez (hasta TTS_STREAM_PARALLEL en
+    paralelo), así que la primera llega en lo que tarda una frase y las
+    siguientes suelen estar listas cuando hacen falta.
+    """
+    sentences = split_sentences(text)
+    log.debug(f"[TTS] Respuesta progresiva: {len(sentences)} frase(s)")
+    # bind(): cada frase se sintetiza en otro hilo con el request_id del turno
+    futures = [_stream_executor.submit(bind(tts_to_pcm), s) for s in sentences]
+    try:
+        for fut in futures:
+            chunk = fut.result()
+            if chunk and chunk[0]:
+                yield chunk
+    finally:
+        for fut in futures:
+            fut.cancel()
+
+
+def iter_tts_pcm_stream(sentences: Iterable[str]) -> Iterator[PcmChunk]:
+    """
+    Como iter_tts_pcm() con frases que llegan poco a poco: un hilo las lee
+    y lanza cada una a sintetizar en cuanto existe, mientras la siguiente
+    aún se genera. Si se deja de leer (cliente desconectado), deja de pedir
+    frases y cierra 'sentences'.
+    """
+    pending: "queue.Queue" = queue.Queue()
+    stop = threading.Event()
+
+    def _feed():
+        it = iter(sentences)
+        try:
+            for sentence in it:
+                if stop.is_set():
+                    break
+                pending.put(_stream_executor.submit(bind(tts_to_pcm), sentence))
+        except Exception as e:
+            log.warning("[TTS] Las frases de la respuesta se cortaron:", e)
+        finally:
+            close = getattr(it, "close", None)
+            if close is not None:
+                close()
+            pending.put(None)
+
+    threading.Thread(target=bind(_feed), name="federico-tts-feed", daemon=True).start()
+    futures = []
+    try:
+        while True:
+            fut = pending.get()
+            if fut is None:
+                break
+            futures.append(fut)
+            chunk = fut.result()
+            if chunk and chunk[0]:
+                yield chunk
+    finally:
+        stop.set()
+        for fut in futures:
+            fut.cancel()
+        while not pending.empty():
+            fut = pending.get_nowait()
+            if fut is not None:
+                fut.cancel()
+
+
+# ---------------------------------------------------------------
+# Versión asíncrona (para server/async_main.py)
+# ---------------------------------------------------------------
+async def tts_to_wav_async(text: str, out_wav_path: str) -> Optional[str]:
+    """
+    Igual que tts_to_wav() pero sin bloquear el bucle de eventos.
+    Si la tarea se cancela (cliente desconectado) se mata el proceso edge-tts.
+    """
+    text = (text or "").strip()
+    if not text:
+        return None
+
+    if USE_EDGE_TTS:
+        log.debug(f"[TTS] Edge TTS (async) -> WAV: {len(text)} chars -> {out_wav_path}")
+        with span("tts", engine="edge", chars=len(text)):
+            ok = await _edge_tts_wav_async(text, out_wav_path)
+        if ok:
+            return _counted(out_wav_path, "edge")
+        log.warning("[TTS] Edge TTS falló; usando pyttsx3 (offline).")
+
+    # pyttsx3 no tiene API asíncrona: a un hilo
+    log.debug(f"[TTS] pyttsx3 -> WAV: {len(text)} chars -> {out_wav_path}")
+    with span("tts", engine="pyttsx3", chars=len(text)):
+        ok = await asyncio.to_thread(_pyttsx3_wav, text, out_wav_path)
+    return _counted(out_wav_path if ok else None, "pyttsx3")
+
+
+async def tts_to_wav_bytes_async(text: str) -> Optional[bytes]:
+    """Como tts_to_wav_bytes() sin bloquear el bucle (edge-tts se mata si se cancela)."""
+    text = (text or "").strip()
+    if not text:
+        return None
+
+    if USE_EDGE_TTS:
+        log.debug(f"[TTS] Edge TTS (async) -> memoria: {len(text)} chars")
+        with span("tts", engine="edge", chars=len(text)):
+            data = await _edge_tts_bytes_async(text)
+        if data:
+            return _counted(data, "edge")
+        log.warning("[TTS] Edge TTS falló; usando pyttsx3 (offline).")
+
+    log.debug(f"[TTS] pyttsx3 -> memoria: {len(text)} chars")
+    with span("tts", engine="pyttsx3", chars=len(text)):
+        data = await asyncio.to_thread(_pyttsx3_bytes, text)
+    return _counted(data, "pyttsx3")
+
+
+async def _run_edge_tts_async(text: str, out_wav_path: Optional[str]) -> Optional[bytes]:
+    """
+    Lanza edge-tts y espera a que termine. Devuelve su stdout (el WAV si no
+    hay 'out_wav_path') o None si falló. Si la tarea se cancela, mata el proceso.
+    """
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *_edge_tts_cmd(text, out_wav_path),
+            stdout=asyncio.subprocess.PIPE if out_wav_path is None else asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        log.debug("[TTS][edge-tts] Módulo no encontrado (instala: pip install edge-tts).")
+        return None
+    except Exception as e:
+        log.debug("[TTS][edge-tts] Excepción:", e)
+        return None
+
+    try:
+        stdout, stderr = await proc.communicate()
+    except asyncio.CancelledError:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+
+    if proc.returncode != 0:
+        log.debug("[TTS][edge-tts] returncode:", proc.returncode)
+        log.debug("[TTS][edge-tts] stderr:", (stderr or b"").decode("utf-8", "ignore").strip()[:500])
+        return None
+    return stdout or b""
+
+
+async def _edge_tts_bytes_async(text: str) -> Optional[bytes]:
+    data = await _run_edge_tts_async(text, None)
+    if data is not None and not data:
+        log.debug("[TTS][edge-tts] No se generó audio.")
+    return data or None
+
+
+async def _edge_tts_wav_async(text: str, out_wav_path: str) -> bool:
+    if await _run_edge_tts_async(text, out_wav_path) is None:
+        return False
+
+    if not os.path.isfile(out_wav_path) or os.path.getsize(out_wav_path) == 0:
+        log.debug("[TTS][edge-tts] No se generó WAV.")
+        return False
+    return True
+
+
+async def _tts_to_pcm_async(text: str) -> Optional[PcmChunk]:
+    return _wav_bytes_to_pcm(await tts_to_wav_bytes_async(text))
+
+
+async def iter_tts_pcm_async(text: str) -> AsyncIterator[PcmChunk]:
+    """Como iter_tts_pcm(): una tarea por frase, resultados en orden."""
+    sentences = split_sentences(text)
+    sem = asyncio.Semaphore(TTS_STREAM_PARALLEL)
+
+    async def _one(sentence: str):
+        async with sem:
+            return await _tts_to_pcm_async(sentence)
+
+    tasks = [asyncio.create_task(_one(s)) for s in sentences]
+    try:
+        for task in tasks:
+            chunk = await task
+            if chunk and chunk[0]:
+                yield chunk
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def iter_tts_pcm_stream_async(sentences: AsyncIterable[str]) -> AsyncIterator[PcmChunk]:
+    """Como iter_tts_pcm_stream(): una tarea lee las frases y lanza una por frase."""
+    sem = asyncio.Semaphore(TTS_STREAM_PARALLEL)
+    pending: asyncio.Queue = asyncio.Queue()
+
+    async def _one(sentence: str):
+        async with sem:
+            return await _tts_to_pcm_async(sentence)
+
+    async def _feed():
+        it = sentences.__aiter__()
+        try:
+            async for sentence in it:
+                pending.put_nowait(asyncio.create_task(_one(sentence)))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("[TTS] Las frases de la respuesta se cortaron:", e)
+        finally:
+            aclose = getattr(it, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            pending.put_nowait(None)
+
+    feeder = asyncio.create_task(_feed())
+    tasks = []
+    try:
+        while True:
+            task = await pending.get()
+            if task is None:
+                break
+            tasks.append(task)
+            chunk = await task
+            if chunk and chunk[0]:
+                yield chunk
+    finally:
+        feeder.cancel()
+        for task in tasks:
+            task.cancel()
+        while not pending.empty():
+            task = pending.get_nowait()
+            if task is not None:
+                task.cancel()
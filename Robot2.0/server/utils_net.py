@@ -1,32 +1,118 @@
 # server/utils_net.py
 # ====================================
 # Utilidades de red para el servidor (socket TCP)
+#
+# Protocolo de subida (cliente -> servidor), dos variantes:
+#  - Clásico:   !Q tamaño + WAV completo.
+#  - Streaming: STREAM_MAGIC (8 bytes, en lugar del tamaño)
+#               + !I longitud + cabecera JSON {"sample_rate", "channels", "sample_width",
+#                 "codec" (por defecto "pcm16"), "accept_codecs" (para la respuesta)}
+#               + tramas (!I longitud + audio en ese códec) según se graba
+#               + trama de longitud 0 = fin de locución.
+#    Ningún tamaño clásico real empieza por STREAM_MAGIC (serían exabytes),
+#    así que ambas variantes conviven en el mismo puerto.
+# Respuesta (servidor -> cliente), dos variantes:
+#  - WAV:       !Q tamaño + WAV (siempre para subidas clásicas).
+#  - Progresiva (si la cabecera de streaming trae "response": "pcm_stream"):
+#               RESP_STREAM_MAGIC + tramas (!IIH: bytes, sample_rate, canales
+#               + PCM16 de una frase) + trama de 0 bytes como terminador.
+#               Si el cliente trae "accept_codecs" y coincide alguno comprimido:
+#               RESP_CODEC_MAGIC + !I longitud + JSON {"codec"} y las mismas
+#               tramas, con el audio de cada frase en ese códec (bytes = comprimidos).
+#  - Traza (solo si la cabecera de streaming trae "trace": true), tras
+#    cualquiera de las dos: TRACE_MAGIC + !I longitud + JSON {"request_id",
+#    "total_ms", "timings_ms": {etapa: ms}} con lo que tardó el servidor.
+# Sesión persistente (opcional, al abrir la conexión):
+#  - Cliente:   SESSION_MAGIC + !I longitud + JSON {"session_id": id o null, "device"}
+#  - Servidor:  SESSION_MAGIC + !I longitud + JSON {"session_id", "resumed",
+#               "idle_timeout_s", "codecs", "trace"}
+#    "codecs" son los códecs (codec.py) que acepta el servidor: sin sesión no
+#    se sabe, así que el cliente sube en "pcm16". "trace": true si puede
+#    pedir la traza del turno (un servidor antiguo no la enviaría nunca).
+#    Después, por la misma conexión, tantos turnos (subida + respuesta) como
+#    quiera el cliente. Si no llega SESSION_MAGIC, la conexión es de un solo turno.
+#
+# Con PIPELINE_IN_MEMORY las subidas se leen con recv_into() a un bytearray
+# reservado de antemano y se devuelven como memoryview (sin ficheros), y la
+# respuesta se envía desde bytes con send_bytes().
+# Las lecturas/escrituras de socket van por transport.py (recv_into,
+# sendfile, TCP_NODELAY) y la (de)compresión del audio por codec.py, ambos
+# compartidos con los clientes.
 # ====================================
 
 from __future__ import annotations
 
+import asyncio
+import json
 import os
+import re
+import select
 import socket
 import struct
+import threading
+import time
+import uuid
+import wave
+from typing import AsyncIterable, Callable, Iterable, Optional, Tuple
 
 try:
     # cuando se ejecuta como paquete: python -m server.main
-    from .config import BUFFER_SIZE, RECV_TIMEOUT_S, SEND_TIMEOUT_S, debug_enabled
+    from .config import (
+        BUFFER_SIZE, RECV_TIMEOUT_S, SEND_TIMEOUT_S, UPLOAD_PREALLOC_BYTES, MAX_UPLOAD_BYTES,
+        AUDIO_CODECS, TRACE_REPLY_TO_CLIENT,
+    )
+    from .wav_utils import parse_wav_pcm16
+    from .tracing import log
+    from . import codec, transport
 except ImportError:
     # cuando se ejecuta como script: python server/main.py
-    from config import BUFFER_SIZE, RECV_TIMEOUT_S, SEND_TIMEOUT_S, debug_enabled
+    from config import (
+        BUFFER_SIZE, RECV_TIMEOUT_S, SEND_TIMEOUT_S, UPLOAD_PREALLOC_BYTES, MAX_UPLOAD_BYTES,
+        AUDIO_CODECS, TRACE_REPLY_TO_CLIENT,
+    )
+    from wav_utils import parse_wav_pcm16
+    from tracing import log
+    import codec
+    import transport
 
 HEADER_FMT = "!Q"  # uint64 big-endian (coincide con el cliente)
+STREAM_MAGIC = b"FDSTRM01"
+FRAME_FMT = "!I"   # longitud de trama / de cabecera JSON
+RESP_STREAM_MAGIC = b"FDPCM001"
+RESP_CODEC_MAGIC = b"FDENC001"
+SESSION_MAGIC = b"FDSESS01"
+TRACE_MAGIC = b"FDTRACE1"
+CHUNK_HDR_FMT = "!IIH"  # bytes PCM, sample_rate, canales (siempre 16 bits)
+MAX_FRAME = 16 * 1024 * 1024
 
-def recvall(sock: socket.socket, n: int) -> bytes | None:
+# on_stream(formato) -> función que recibe cada trama PCM (o None)
+StreamCallback = Callable[[dict], Optional[Callable[[bytes], None]]]
+
+# Subida en memoria: (modo, audio, formato).
+#  - formato con sample_rate/channels: 'audio' es PCM16 crudo
+#  - formato None: 'audio' es el fichero tal cual (WAV no PCM16 u otro contenedor)
+Upload = Tuple[str, memoryview, Optional[dict]]
+
+# IDs de sesión que aceptamos del cliente; si no encaja, se genera uno nuevo
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+# Formato por defecto si la cabecera JSON no lo indica
+_DEFAULT_AUDIO_FMT = {"sample_rate": 16000, "channels": 1, "sample_width": 2}
+
+def recvall(sock: socket.socket, n: int) -> bytearray | None:
     """Lee exactamente n bytes del socket o devuelve None si la conexión se corta."""
-    data = b""
-    while len(data) < n:
-        packet = sock.recv(n - len(data))
-        if not packet:
-            return None
-        data += packet
-    return data
+    return transport.recv_exactly(sock, n)
+
+def _receive_body(sock: socket.socket, out_path: str, total_size: int) -> bool:
+    """Datos de una subida clásica ('total_size' bytes) -> 'out_path'."""
+    log.debug(f"[NET] Tamaño entrante: {total_size} bytes -> {out_path}")
+
+    with open(out_path, "wb") as f:
+        bytes_recv = transport.recv_to_file(sock, f, total_size, BUFFER_SIZE)
+
+    ok = (bytes_recv == total_size)
+    log.debug(f"[NET] Archivo recibido: {bytes_recv}/{total_size} bytes (ok={ok})")
+    return ok
 
 def receive_file(sock: socket.socket, out_path: str) -> bool:
     """
@@ -39,30 +125,13 @@ def receive_file(sock: socket.socket, out_path: str) -> bool:
         # 1) Encabezado: tamaño
         raw = recvall(sock, struct.calcsize(HEADER_FMT))
         if not raw:
-            if debug_enabled():
-                print("[NET] No llegó el encabezado de tamaño.")
+            log.debug("[NET] No llegó el encabezado de tamaño.")
             return False
         total_size = struct.unpack(HEADER_FMT, raw)[0]
-        if debug_enabled():
-            print(f"[NET] Tamaño entrante: {total_size} bytes -> {out_path}")
-
-        # 2) Datos
-        bytes_recv = 0
-        with open(out_path, "wb") as f:
-            while bytes_recv < total_size:
-                chunk = sock.recv(min(BUFFER_SIZE, total_size - bytes_recv))
-                if not chunk:
-                    break
-                f.write(chunk)
-                bytes_recv += len(chunk)
-
-        ok = (bytes_recv == total_size)
-        if debug_enabled():
-            print(f"[NET] Archivo recibido: {bytes_recv}/{total_size} bytes (ok={ok})")
-        return ok
-
-    except Exception as e:
-        print("[NET] Error recibiendo archivo:", e)
+        return _receive_body(sock, out_path, total_size)
+
+    except Exception as e:
+        log.error("[NET] Error recibiendo archivo:", e)
         return False
 
 def send_file(sock: socket.socket, path: str) -> bool:
@@ -71,27 +140,646 @@ def send_file(sock: socket.socket, path: str) -> bool:
     """
     try:
         if not os.path.exists(path):
-            print(f"[NET] Archivo no existe: {path}")
+            log.warning(f"[NET] Archivo no existe: {path}")
             return False
 
         size = os.path.getsize(path)
-        if debug_enabled():
-            print(f"[NET] Enviando {path} ({size} bytes)…")
+        log.debug(f"[NET] Enviando {path} ({size} bytes)…")
 
         sock.settimeout(SEND_TIMEOUT_S)
 
         # 1) Encabezado: tamaño
         sock.sendall(struct.pack(HEADER_FMT, size))
 
-        # 2) Datos en bloques
+        # 2) Datos (sendfile del kernel donde se pueda)
+        with open(path, "rb") as f:
+            transport.send_file(sock, f, size)
+
+        log.debug("[NET] Envío completado.")
+        return True
+
+    except Exception as e:
+        log.error("[NET] Error enviando archivo:", e)
+        return False
+
+
+def _write_pcm_wav(out_path: str, pcm: bytes | bytearray, fmt: dict):
+    with wave.open(out_path, "wb") as wf:
+        wf.setnchannels(int(fmt["channels"]))
+        wf.setsampwidth(int(fmt["sample_width"]))
+        wf.setframerate(int(fmt["sample_rate"]))
+        wf.writeframes(bytes(pcm))
+
+
+def _parse_stream_header(raw: bytes) -> dict:
+    fmt = dict(_DEFAULT_AUDIO_FMT)
+    fmt.update(json.loads(bytes(raw).decode("utf-8")) if raw else {})
+    fmt.setdefault("codec", codec.PCM16)
+    if fmt["codec"] not in AUDIO_CODECS or fmt["codec"] not in codec.CODECS:
+        raise ValueError(f"códec de subida no admitido: {fmt['codec']!r}")
+    return fmt
+
+
+def _receive_stream(sock: socket.socket, out_path: str,
+                    on_stream: Optional[StreamCallback]) -> dict | None:
+    """Resto de una subida en streaming tras STREAM_MAGIC. Devuelve la cabecera o None."""
+    raw = recvall(sock, struct.calcsize(FRAME_FMT))
+    if not raw:
+        return None
+    hdr_len = struct.unpack(FRAME_FMT, raw)[0]
+    if hdr_len > MAX_FRAME:
+        log.warning(f"[NET] Cabecera de streaming demasiado grande: {hdr_len}")
+        return None
+    fmt = _parse_stream_header(recvall(sock, hdr_len) if hdr_len else b"")
+    log.debug(f"[NET] Subida en streaming: {fmt}")
+    on_audio = on_stream(fmt) if on_stream is not None else None
+
+    pcm = bytearray()
+    frames = 0
+    while True:
+        raw = recvall(sock, struct.calcsize(FRAME_FMT))
+        if not raw:
+            log.warning("[NET] Conexión cortada en mitad del streaming.")
+            return None
+        n = struct.unpack(FRAME_FMT, raw)[0]
+        if n == 0:
+            break  # fin de locución
+        if n > MAX_FRAME or len(pcm) + n > MAX_UPLOAD_BYTES:
+            log.warning(f"[NET] Trama demasiado grande: {n}")
+            return None
+        frame = recvall(sock, n)
+        if frame is None:
+            log.warning("[NET] Conexión cortada en mitad del streaming.")
+            return None
+        frame = codec.decode(fmt["codec"], frame, MAX_UPLOAD_BYTES - len(pcm))
+        pcm += frame
+        frames += 1
+        if on_audio is not None:
+            on_audio(frame)
+
+    _write_pcm_wav(out_path, pcm, fmt)
+    log.debug(f"[NET] Streaming completo: {frames} tramas, {len(pcm)} bytes PCM -> {out_path}")
+    return fmt
+
+
+def receive_upload(sock: socket.socket, out_path: str,
+                   on_stream: Optional[StreamCallback] = None,
+                   header: Optional[bytes] = None) -> str | None:
+    """
+    Recibe la locución del cliente en cualquiera de las dos variantes y la deja
+    como WAV en 'out_path'. En streaming llama a on_stream(formato) al leer la
+    cabecera; si devuelve una función, se la llama con el PCM de cada trama
+    según llega (para adelantar la transcripción).
+    'header': los 8 primeros bytes si ya se leyeron (sesiones persistentes).
+    Devuelve "legacy", "stream" o None si hubo error.
+    """
+    try:
+        sock.settimeout(RECV_TIMEOUT_S)
+        raw = header or recvall(sock, struct.calcsize(HEADER_FMT))
+        if not raw:
+            log.debug("[NET] No llegó el encabezado de tamaño.")
+            return None
+
+        if raw == STREAM_MAGIC:
+            return "stream" if _receive_stream(sock, out_path, on_stream) is not None else None
+
+        total_size = struct.unpack(HEADER_FMT, raw)[0]
+        return "legacy" if _receive_body(sock, out_path, total_size) else None
+
+    except Exception as e:
+        log.error("[NET] Error recibiendo audio:", e)
+        return None
+
+
+def wants_pcm_stream(fmt: dict | None) -> bool:
+    """True si la cabecera de streaming pide la respuesta progresiva."""
+    return bool(fmt) and fmt.get("response") == "pcm_stream"
+
+
+def response_codec(fmt: dict | None) -> str:
+    """Códec para la respuesta progresiva: el primero que acepta el cliente y admitimos."""
+    return codec.choose((fmt or {}).get("accept_codecs"), AUDIO_CODECS)
+
+
+def wants_trace(fmt: dict | None) -> bool:
+    """True si la cabecera de streaming pide la traza del turno tras la respuesta."""
+    return TRACE_REPLY_TO_CLIENT and bool(fmt) and bool(fmt.get("trace"))
+
+
+def _trace_trailer(info: dict) -> bytes:
+    body = json.dumps(info).encode("utf-8")
+    return TRACE_MAGIC + struct.pack(FRAME_FMT, len(body)) + body
+
+
+def send_trace(sock: socket.socket, info: dict) -> bool:
+    """Envía la traza del turno (request_id y ms por etapa) tras la respuesta."""
+    try:
+        sock.settimeout(SEND_TIMEOUT_S)
+        sock.sendall(_trace_trailer(info))
+        return True
+
+    except Exception as e:
+        log.error("[NET] Error enviando la traza:", e)
+        return False
+
+
+def _resp_stream_header(audio_codec: str) -> bytes:
+    if audio_codec == codec.PCM16:
+        return RESP_STREAM_MAGIC  # formato de siempre: lo entiende cualquier cliente
+    body = json.dumps({"codec": audio_codec}).encode("utf-8")
+    return RESP_CODEC_MAGIC + struct.pack(FRAME_FMT, len(body)) + body
+
+
+def send_pcm_stream(sock: socket.socket, chunks: Iterable[Tuple[bytes, int, int]],
+                    audio_codec: str = codec.PCM16) -> bool:
+    """
+    Envía la respuesta progresiva: cada (pcm, sample_rate, canales) sale en
+    cuanto el iterador lo entrega (codificado con 'audio_codec'), y al final
+    el terminador.
+    """
+    try:
+        sock.settimeout(SEND_TIMEOUT_S)
+        sock.sendall(_resp_stream_header(audio_codec))
+        n = 0
+        for pcm, sr, ch in chunks:
+            data = codec.encode(audio_codec, pcm)
+            transport.send_all(sock, struct.pack(CHUNK_HDR_FMT, len(data), sr, ch), data)
+            n += 1
+            log.debug(f"[NET] Trama de respuesta {n}: {len(data)}/{len(pcm)} bytes "
+                  f"({audio_codec}) @ {sr} Hz")
+        sock.sendall(struct.pack(CHUNK_HDR_FMT, 0, 0, 0))
+        log.debug(f"[NET] Respuesta progresiva completada ({n} tramas).")
+        return True
+
+    except Exception as e:
+        log.error("[NET] Error enviando respuesta progresiva:", e)
+        return False
+
+
+# ---------------------------------------------------------------
+# Subida y respuesta en memoria (PIPELINE_IN_MEMORY)
+# ---------------------------------------------------------------
+class PcmBuffer:
+    """
+    bytearray reservado de antemano al que se añaden tramas sin realojar en
+    cada una. Al crecer se pasa a un bytearray nuevo del doble (nunca se
+    redimensiona el actual), así las memoryview ya entregadas siguen válidas.
+    """
+
+    def __init__(self, capacity: int = UPLOAD_PREALLOC_BYTES):
+        self._buf = bytearray(max(1, capacity))
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def reserve(self, n: int) -> memoryview:
+        """Hueco de n bytes al final, para rellenarlo (recv_into) y luego commit(n)."""
+        need = self._len + n
+        if need > len(self._buf):
+            grown = bytearray(max(need, 2 * len(self._buf)))
+            grown[:self._len] = memoryview(self._buf)[:self._len]
+            self._buf = grown
+        return memoryview(self._buf)[self._len:need]
+
+    def commit(self, n: int):
+        self._len += n
+
+    def extend(self, data):
+        self.reserve(len(data))[:] = data
+        self.commit(len(data))
+
+    def view(self) -> memoryview:
+        return memoryview(self._buf)[:self._len]
+
+
+def _legacy_upload(data: memoryview) -> Upload:
+    """WAV clásico ya en memoria -> su bloque PCM (sin copiar) o el fichero tal cual."""
+    parsed = parse_wav_pcm16(data)
+    if parsed is None:
+        log.debug("[NET] El audio recibido no es WAV PCM16; se decodificará en ASR.")
+        return "legacy", data, None
+    pcm, sr, ch = parsed
+    return "legacy", pcm, {"sample_rate": sr, "channels": ch, "sample_width": 2}
+
+
+def _receive_stream_buffer(sock: socket.socket,
+                           on_stream: Optional[StreamCallback]) -> Upload | None:
+    raw = recvall(sock, struct.calcsize(FRAME_FMT))
+    if not raw:
+        return None
+    hdr_len = struct.unpack(FRAME_FMT, raw)[0]
+    if hdr_len > MAX_FRAME:
+        log.warning(f"[NET] Cabecera de streaming demasiado grande: {hdr_len}")
+        return None
+    fmt = _parse_stream_header(recvall(sock, hdr_len) if hdr_len else b"")
+    log.debug(f"[NET] Subida en streaming (memoria): {fmt}")
+    on_audio = on_stream(fmt) if on_stream is not None else None
+
+    pcm = PcmBuffer()
+    len_buf = memoryview(bytearray(struct.calcsize(FRAME_FMT)))
+    audio_codec = fmt["codec"]
+    scratch = bytearray()  # trama comprimida antes de decodificar (se reutiliza)
+    wire = 0
+    frames = 0
+    while True:
+        if not transport.recv_into_exactly(sock, len_buf):
+            log.warning("[NET] Conexión cortada en mitad del streaming.")
+            return None
+        n = struct.unpack(FRAME_FMT, len_buf)[0]
+        if n == 0:
+            break  # fin de locución
+        if n > MAX_FRAME or len(pcm) + n > MAX_UPLOAD_BYTES:
+            log.warning(f"[NET] Trama demasiado grande: {n}")
+            return None
+        if audio_codec == codec.PCM16:
+            # PCM crudo: directo al buffer final con recv_into
+            frame = pcm.reserve(n)
+            if not transport.recv_into_exactly(sock, frame):
+                log.warning("[NET] Conexión cortada en mitad del streaming.")
+                return None
+            pcm.commit(n)
+        else:
+            if len(scratch) < n:
+                scratch = bytearray(n)
+            data = memoryview(scratch)[:n]
+            if not transport.recv_into_exactly(sock, data):
+                log.warning("[NET] Conexión cortada en mitad del streaming.")
+                return None
+            decoded = codec.decode(audio_codec, data, MAX_UPLOAD_BYTES - len(pcm))
+            frame = pcm.reserve(len(decoded))
+            frame[:] = decoded
+            pcm.commit(len(decoded))
+        wire += n
+        frames += 1
+        if on_audio is not None:
+            on_audio(frame)
+
+    log.debug(f"[NET] Streaming completo: {frames} tramas, {len(pcm)} bytes PCM en memoria "
+          f"({wire} bytes en la red, {audio_codec})")
+    return "stream", pcm.view(), fmt
+
+
+def receive_upload_buffer(sock: socket.socket,
+                          on_stream: Optional[StreamCallback] = None,
+                          header: Optional[bytes] = None) -> Upload | None:
+    """
+    Como receive_upload() pero sin ficheros: devuelve (modo, audio, formato)
+    o None si hubo error. En una subida clásica el tamaño se conoce de
+    antemano, así que se reserva el bytearray entero y se llena con recv_into().
+    """
+    try:
+        sock.settimeout(RECV_TIMEOUT_S)
+        raw = header or recvall(sock, struct.calcsize(HEADER_FMT))
+        if not raw:
+            log.debug("[NET] No llegó el encabezado de tamaño.")
+            return None
+
+        if raw == STREAM_MAGIC:
+            return _receive_stream_buffer(sock, on_stream)
+
+        total_size = struct.unpack(HEADER_FMT, raw)[0]
+        if total_size > MAX_UPLOAD_BYTES:
+            log.warning(f"[NET] Subida demasiado grande: {total_size} bytes")
+            return None
+        data = memoryview(bytearray(total_size))
+        ok = transport.recv_into_exactly(sock, data)
+        log.debug(f"[NET] Archivo recibido en memoria: {total_size} bytes (ok={ok})")
+        return _legacy_upload(data) if ok else None
+
+    except Exception as e:
+        log.error("[NET] Error recibiendo audio:", e)
+        return None
+
+
+def send_bytes(sock: socket.socket, data) -> bool:
+    """Envía 'data' (bytes/memoryview) con el protocolo de send_file(), sin pasar por disco."""
+    try:
+        log.debug(f"[NET] Enviando {len(data)} bytes desde memoria…")
+        sock.settimeout(SEND_TIMEOUT_S)
+        transport.send_all(sock, struct.pack(HEADER_FMT, len(data)), data)
+        log.debug("[NET] Envío completado.")
+        return True
+
+    except Exception as e:
+        log.error("[NET] Error enviando respuesta:", e)
+        return False
+
+
+# ---------------------------------------------------------------
+# Sesiones persistentes
+# ---------------------------------------------------------------
+def _session_welcome(raw: bytes, idle_timeout_s: float) -> Tuple[str, bytes]:
+    """Saludo del cliente -> (session_id, respuesta a enviar)."""
+    hello = json.loads(raw.decode("utf-8")) if raw else {}
+    sid = hello.get("session_id")
+    resumed = isinstance(sid, str) and bool(_SESSION_ID_RE.match(sid))
+    if not resumed:
+        sid = uuid.uuid4().hex
+    log.debug(f"[NET] Sesión {sid} ({'reanudada' if resumed else 'nueva'}) "
+          f"desde {hello.get('device') or '?'}")
+    body = json.dumps({"session_id": sid, "resumed": resumed,
+                       "idle_timeout_s": idle_timeout_s,
+                       "codecs": [c for c in AUDIO_CODECS if c in codec.CODECS],
+                       "trace": TRACE_REPLY_TO_CLIENT}).encode("utf-8")
+    return sid, SESSION_MAGIC + struct.pack(FRAME_FMT, len(body)) + body
+
+
+def accept_session(sock: socket.socket, idle_timeout_s: float) -> str | None:
+    """
+    Tras leer SESSION_MAGIC: lee el saludo del cliente, responde con el ID de
+    sesión (el suyo si trae uno válido, o uno nuevo) y lo devuelve.
+    """
+    try:
+        sock.settimeout(RECV_TIMEOUT_S)
+        raw = recvall(sock, struct.calcsize(FRAME_FMT))
+        if not raw:
+            return None
+        n = struct.unpack(FRAME_FMT, raw)[0]
+        if n > MAX_FRAME:
+            log.warning(f"[NET] Saludo de sesión demasiado grande: {n}")
+            return None
+        sid, welcome = _session_welcome(recvall(sock, n) if n else b"", idle_timeout_s)
+        sock.settimeout(SEND_TIMEOUT_S)
+        sock.sendall(welcome)
+        return sid
+
+    except Exception as e:
+        log.error("[NET] Error abriendo sesión:", e)
+        return None
+
+
+def wait_next_turn(sock: socket.socket, idle_timeout_s: float,
+                   stop: Optional[threading.Event] = None) -> bytes | None:
+    """
+    Espera el siguiente turno de una sesión sin ocupar CPU. Devuelve sus
+    8 primeros bytes, o None si el cliente cerró, venció 'idle_timeout_s'
+    o se activó 'stop' (se mira cada segundo).
+    """
+    deadline = time.monotonic() + idle_timeout_s
+    try:
+        while stop is None or not stop.is_set():
+            left = deadline - time.monotonic()
+            if left <= 0:
+                log.debug("[NET] Sesión inactiva; se cierra.")
+                return None
+            ready, _, _ = select.select([sock], [], [], min(1.0, left))
+            if ready:
+                sock.settimeout(RECV_TIMEOUT_S)
+                return recvall(sock, struct.calcsize(HEADER_FMT))
+        return None
+
+    except Exception as e:
+        log.debug("[NET] Sesión cortada:", e)
+        return None
+
+
+# ---------------------------------------------------------------
+# Versión asyncio (server/async_main.py): mismo protocolo
+# ---------------------------------------------------------------
+async def _read_exactly_async(reader: asyncio.StreamReader, n: int) -> bytes:
+    return await asyncio.wait_for(reader.readexactly(n), RECV_TIMEOUT_S)
+
+
+async def _receive_body_async(reader: asyncio.StreamReader, out_path: str, total_size: int) -> bool:
+    log.debug(f"[NET] Tamaño entrante: {total_size} bytes -> {out_path}")
+
+    bytes_recv = 0
+    with open(out_path, "wb") as f:
+        while bytes_recv < total_size:
+            chunk = await asyncio.wait_for(
+                reader.read(min(BUFFER_SIZE, total_size - bytes_recv)), RECV_TIMEOUT_S
+            )
+            if not chunk:
+                break
+            f.write(chunk)
+            bytes_recv += len(chunk)
+
+    ok = (bytes_recv == total_size)
+    log.debug(f"[NET] Archivo recibido: {bytes_recv}/{total_size} bytes (ok={ok})")
+    return ok
+
+
+async def _receive_stream_async(reader: asyncio.StreamReader, out_path: str,
+                                on_stream: Optional[StreamCallback]) -> dict | None:
+    frame_len = struct.calcsize(FRAME_FMT)
+    hdr_len = struct.unpack(FRAME_FMT, await _read_exactly_async(reader, frame_len))[0]
+    if hdr_len > MAX_FRAME:
+        log.warning(f"[NET] Cabecera de streaming demasiado grande: {hdr_len}")
+        return None
+    fmt = _parse_stream_header(await _read_exactly_async(reader, hdr_len) if hdr_len else b"")
+    log.debug(f"[NET] Subida en streaming: {fmt}")
+    on_audio = on_stream(fmt) if on_stream is not None else None
+
+    pcm = bytearray()
+    while True:
+        n = struct.unpack(FRAME_FMT, await _read_exactly_async(reader, frame_len))[0]
+        if n == 0:
+            break
+        if n > MAX_FRAME or len(pcm) + n > MAX_UPLOAD_BYTES:
+            log.warning(f"[NET] Trama demasiado grande: {n}")
+            return None
+        frame = codec.decode(fmt["codec"], await _read_exactly_async(reader, n),
+                             MAX_UPLOAD_BYTES - len(pcm))
+        pcm += frame
+        if on_audio is not None:
+            on_audio(frame)
+
+    _write_pcm_wav(out_path, pcm, fmt)
+    log.debug(f"[NET] Streaming completo: {len(pcm)} bytes PCM -> {out_path}")
+    return fmt
+
+
+async def receive_upload_async(reader: asyncio.StreamReader, out_path: str,
+                               on_stream: Optional[StreamCallback] = None,
+                               header: Optional[bytes] = None) -> str | None:
+    """Como receive_upload(): "legacy", "stream" o None si hubo error."""
+    try:
+        raw = header or await _read_exactly_async(reader, struct.calcsize(HEADER_FMT))
+        if raw == STREAM_MAGIC:
+            fmt = await _receive_stream_async(reader, out_path, on_stream)
+            return "stream" if fmt is not None else None
+        total_size = struct.unpack(HEADER_FMT, raw)[0]
+        return "legacy" if await _receive_body_async(reader, out_path, total_size) else None
+
+    except asyncio.IncompleteReadError:
+        log.warning("[NET] Conexión cortada recibiendo audio.")
+        return None
+    except Exception as e:
+        log.error("[NET] Error recibiendo audio:", e)
+        return None
+
+
+async def receive_file_async(reader: asyncio.StreamReader, out_path: str) -> bool:
+    """Como receive_file(), leyendo de un StreamReader con timeout por lectura."""
+    try:
+        raw = await _read_exactly_async(reader, struct.calcsize(HEADER_FMT))
+        total_size = struct.unpack(HEADER_FMT, raw)[0]
+        return await _receive_body_async(reader, out_path, total_size)
+
+    except asyncio.IncompleteReadError:
+        log.debug("[NET] No llegó el encabezado de tamaño.")
+        return False
+    except Exception as e:
+        log.error("[NET] Error recibiendo archivo:", e)
+        return False
+
+
+async def send_file_async(writer: asyncio.StreamWriter, path: str) -> bool:
+    """Como send_file(), con drain() para respetar la contrapresión del cliente."""
+    try:
+        if not os.path.exists(path):
+            log.warning(f"[NET] Archivo no existe: {path}")
+            return False
+
+        size = os.path.getsize(path)
+        log.debug(f"[NET] Enviando {path} ({size} bytes)…")
+
+        writer.write(struct.pack(HEADER_FMT, size))
+        # loop.sendfile() usa sendfile del kernel (o lee por bloques si no puede)
         with open(path, "rb") as f:
-            for chunk in iter(lambda: f.read(BUFFER_SIZE), b""):
-                sock.sendall(chunk)
+            await asyncio.wait_for(
+                asyncio.get_running_loop().sendfile(writer.transport, f, count=size),
+                SEND_TIMEOUT_S,
+            )
+
+        log.debug("[NET] Envío completado.")
+        return True
+
+    except Exception as e:
+        log.error("[NET] Error enviando archivo:", e)
+        return False
+
+
+
+async def _receive_stream_buffer_async(reader: asyncio.StreamReader,
+                                       on_stream: Optional[StreamCallback]) -> Upload | None:
+    frame_len = struct.calcsize(FRAME_FMT)
+    hdr_len = struct.unpack(FRAME_FMT, await _read_exactly_async(reader, frame_len))[0]
+    if hdr_len > MAX_FRAME:
+        log.warning(f"[NET] Cabecera de streaming demasiado grande: {hdr_len}")
+        return None
+    fmt = _parse_stream_header(await _read_exactly_async(reader, hdr_len) if hdr_len else b"")
+    log.debug(f"[NET] Subida en streaming (memoria): {fmt}")
+    on_audio = on_stream(fmt) if on_stream is not None else None
+
+    pcm = PcmBuffer()
+    while True:
+        n = struct.unpack(FRAME_FMT, await _read_exactly_async(reader, frame_len))[0]
+        if n == 0:
+            break
+        if n > MAX_FRAME or len(pcm) + n > MAX_UPLOAD_BYTES:
+            log.warning(f"[NET] Trama demasiado grande: {n}")
+            return None
+        frame = codec.decode(fmt["codec"], await _read_exactly_async(reader, n),
+                             MAX_UPLOAD_BYTES - len(pcm))
+        pcm.extend(frame)
+        if on_audio is not None:
+            on_audio(frame)
 
-        if debug_enabled():
-            print("[NET] Envío completado.")
+    log.debug(f"[NET] Streaming completo: {len(pcm)} bytes PCM en memoria")
+    return "stream", pcm.view(), fmt
+
+
+async def receive_upload_buffer_async(reader: asyncio.StreamReader,
+                                      on_stream: Optional[StreamCallback] = None,
+                                      header: Optional[bytes] = None) -> Upload | None:
+    """Como receive_upload_buffer(), leyendo de un StreamReader."""
+    try:
+        raw = header or await _read_exactly_async(reader, struct.calcsize(HEADER_FMT))
+        if raw == STREAM_MAGIC:
+            return await _receive_stream_buffer_async(reader, on_stream)
+
+        total_size = struct.unpack(HEADER_FMT, raw)[0]
+        if total_size > MAX_UPLOAD_BYTES:
+            log.warning(f"[NET] Subida demasiado grande: {total_size} bytes")
+            return None
+        # StreamReader no tiene readinto(): se copia cada bloque al hueco reservado
+        data = memoryview(bytearray(total_size))
+        got = 0
+        while got < total_size:
+            chunk = await asyncio.wait_for(reader.read(total_size - got), RECV_TIMEOUT_S)
+            if not chunk:
+                log.warning("[NET] Conexión cortada recibiendo audio.")
+                return None
+            data[got:got + len(chunk)] = chunk
+            got += len(chunk)
+        log.debug(f"[NET] Archivo recibido en memoria: {total_size} bytes")
+        return _legacy_upload(data)
+
+    except asyncio.IncompleteReadError:
+        log.warning("[NET] Conexión cortada recibiendo audio.")
+        return None
+    except Exception as e:
+        log.error("[NET] Error recibiendo audio:", e)
+        return None
+
+
+async def send_bytes_async(writer: asyncio.StreamWriter, data) -> bool:
+    """Como send_bytes(), con drain() para respetar la contrapresión del cliente."""
+    try:
+        log.debug(f"[NET] Enviando {len(data)} bytes desde memoria…")
+        writer.write(struct.pack(HEADER_FMT, len(data)))
+        writer.write(data)
+        await asyncio.wait_for(writer.drain(), SEND_TIMEOUT_S)
+        log.debug("[NET] Envío completado.")
+        return True
+
+    except Exception as e:
+        log.error("[NET] Error enviando respuesta:", e)
+        return False
+
+
+async def send_trace_async(writer: asyncio.StreamWriter, info: dict) -> bool:
+    """Como send_trace()."""
+    try:
+        writer.write(_trace_trailer(info))
+        await asyncio.wait_for(writer.drain(), SEND_TIMEOUT_S)
+        return True
+
+    except Exception as e:
+        log.error("[NET] Error enviando la traza:", e)
+        return False
+
+
+async def accept_session_async(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                               idle_timeout_s: float) -> str | None:
+    """Como accept_session()."""
+    try:
+        n = struct.unpack(FRAME_FMT, await _read_exactly_async(reader, struct.calcsize(FRAME_FMT)))[0]
+        if n > MAX_FRAME:
+            log.warning(f"[NET] Saludo de sesión demasiado grande: {n}")
+            return None
+        sid, welcome = _session_welcome(
+            await _read_exactly_async(reader, n) if n else b"", idle_timeout_s
+        )
+        writer.write(welcome)
+        await asyncio.wait_for(writer.drain(), SEND_TIMEOUT_S)
+        return sid
+
+    except Exception as e:
+        log.error("[NET] Error abriendo sesión:", e)
+        return None
+
+
+async def send_pcm_stream_async(writer: asyncio.StreamWriter,
+                                chunks: AsyncIterable[Tuple[bytes, int, int]],
+                                audio_codec: str = codec.PCM16) -> bool:
+    """Como send_pcm_stream(), desde un iterador asíncrono."""
+    try:
+        writer.write(_resp_stream_header(audio_codec))
+        n = 0
+        async for pcm, sr, ch in chunks:
+            data = codec.encode(audio_codec, pcm)
+            writer.write(struct.pack(CHUNK_HDR_FMT, len(data), sr, ch))
+            writer.write(data)
+            await asyncio.wait_for(writer.drain(), SEND_TIMEOUT_S)
+            n += 1
+        writer.write(struct.pack(CHUNK_HDR_FMT, 0, 0, 0))
+        await asyncio.wait_for(writer.drain(), SEND_TIMEOUT_S)
+        log.debug(f"[NET] Respuesta progresiva completada ({n} tramas).")
         return True
 
     except Exception as e:
-        print("[NET] Error enviando archivo:", e)
+        log.error("[NET] Error enviando respuesta progresiva:", e)
         return False
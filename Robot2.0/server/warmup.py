@@ -0,0 +1,122 @@
+# server/warmup.py
+# ====================================
+# Arranque en caliente (WARMUP_* en config.py)
+# Antes de abrir el puerto se pagan las cargas que si no pagaría el primer
+# usuario: el modelo de Whisper (y una transcripción de prueba), el modelo
+# de Ollama (que queda cargado OLLAMA_KEEP_ALIVE) y los motores de TTS.
+#  - steps(): qué componentes calentar en este proceso
+#  - run(): los calienta en paralelo, apunta cuánto tardó cada uno (log,
+#    traza y /metrics) y deja /ready en 200 al terminar
+# Un componente que falla se avisa y no impide arrancar: el servidor
+# funciona igual, solo que esa carga la paga la primera petición.
+# ====================================
+
+from __future__ import annotations
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+try:
+    from .config import (
+        WARMUP_ENABLED, WARMUP_WHISPER, WARMUP_OLLAMA, WARMUP_TTS, WARMUP_OLLAMA_TIMEOUT_S,
+    )
+    from . import asr_whisper, llm_ollama, tts_engine, metrics
+    from .tracing import log, span
+except ImportError:
+    from config import (
+        WARMUP_ENABLED, WARMUP_WHISPER, WARMUP_OLLAMA, WARMUP_TTS, WARMUP_OLLAMA_TIMEOUT_S,
+    )
+    import asr_whisper, llm_ollama, tts_engine, metrics
+    from tracing import log, span
+
+Step = Tuple[str, Callable[[], object]]
+
+# Segundos que tardó cada componente en este proceso (para /metrics)
+_times: Dict[str, float] = {}
+
+
+def speech_clip(sr: int = 16000) -> np.ndarray:
+    """
+    Audio de prueba (float32, 16 kHz): silencio, ~1.5 s de una vocal sintética
+    que sube y baja de tono con sílabas marcadas, y silencio otra vez.
+    """
+    n = int(sr * 1.5)
+    t = np.arange(n) / sr
+    f0 = 130 + 25 * np.sin(2 * np.pi * 1.5 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    # Armónicos con más peso cerca de los formantes de una "a" (~700 y ~1200 Hz)
+    voice = sum(np.sin(k * phase) / k * (1 + 2 * np.exp(-((k * 130 - 700) / 300) ** 2))
+                for k in range(1, 20))
+    syllables = 0.5 - 0.5 * np.cos(2 * np.pi * 4 * t)
+    voice = 0.3 * voice * syllables / np.max(np.abs(voice))
+    silence = np.zeros(int(sr * 0.5))
+    return np.concatenate([silence, voice, silence]).astype(np.float32)
+
+
+def whisper():
+    asr_whisper.warm_up(speech_clip())
+
+
+def ollama():
+    llm_ollama.preload(timeout=WARMUP_OLLAMA_TIMEOUT_S)
+
+
+def tts():
+    return tts_engine.warm_up()
+
+
+def steps(whisper_model: bool = True, backends: bool = True) -> List[Step]:
+    """
+    Componentes a calentar según config. En prefork el padre calienta los
+    backends (Ollama, TTS) y cada hijo su propio Whisper, tras el fork.
+    """
+    if not WARMUP_ENABLED:
+        return []
+    out: List[Step] = []
+    if whisper_model and WARMUP_WHISPER:
+        out.append(("whisper", whisper))
+    if backends and WARMUP_OLLAMA:
+        out.append(("ollama", ollama))
+    if backends and WARMUP_TTS:
+        out.append(("tts", tts))
+    return out
+
+
+def _timed(name: str, fn: Callable[[], object]) -> Tuple[float, bool]:
+    t0 = time.perf_counter()
+    ok = True
+    try:
+        with span("warmup", component=name) as sp:
+            result = fn()
+            if result is not None:
+                sp["result"] = result
+    except Exception as e:
+        ok = False
+        log.warning(f"[WARM] {name} falló:", e)
+    return time.perf_counter() - t0, ok
+
+
+def run(todo: List[Step]) -> Dict[str, float]:
+    """Calienta 'todo' en paralelo y devuelve los segundos de cada componente."""
+    if not todo:
+        return {}
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(todo), thread_name_prefix="federico-warmup") as pool:
+        futures = {name: pool.submit(_timed, name, fn) for name, fn in todo}
+        results = {name: fut.result() for name, fut in futures.items()}
+
+    report = []
+    for name, (seconds, ok) in results.items():
+        _times[name] = seconds
+        report.append(f"{name} {seconds:.1f} s" + ("" if ok else " (falló)"))
+    log.info(f"[WARM] Listo en {time.perf_counter() - t0:.1f} s: " + " · ".join(report))
+    return {name: seconds for name, (seconds, _) in results.items()}
+
+
+metrics.register_collector(lambda: [
+    (f"warmup_{name}_seconds", "gauge", f"Segundos que tardó en calentarse {name} al arrancar.", s)
+    for name, s in sorted(_times.items())
+])
@@ -0,0 +1,67 @@
+# server/wav_utils.py
+# ====================================
+# WAV en memoria (sin pasar por disco)
+#  - parse_wav_pcm16(): localiza el bloque "data" de un WAV PCM16 y lo
+#    devuelve como memoryview (sin copiar) junto a su formato
+#  - make_wav_bytes(): envuelve PCM16 en una cabecera WAV
+# ====================================
+
+from __future__ import annotations
+
+import struct
+from typing import Optional, Tuple
+
+# (pcm16, sample_rate, channels)
+PcmView = Tuple[memoryview, int, int]
+
+
+def parse_wav_pcm16(buf) -> Optional[PcmView]:
+    """
+    Devuelve (pcm, sample_rate, channels) si 'buf' es un WAV PCM de 16 bits,
+    o None si no lo es (otro códec, otra profundidad, cabecera rota).
+    'pcm' es una vista sobre 'buf': no se copian los datos.
+    """
+    mv = memoryview(buf)
+    if len(mv) < 12 or mv[0:4] != b"RIFF" or mv[8:12] != b"WAVE":
+        return None
+
+    pos = 12
+    fmt = None
+    while pos + 8 <= len(mv):
+        cid = bytes(mv[pos:pos + 4])
+        size = struct.unpack_from("<I", mv, pos + 4)[0]
+        body = pos + 8
+        if cid == b"fmt ":
+            if size < 16:
+                return None
+            audio_fmt, channels, rate, _, _, bits = struct.unpack_from("<HHIIHH", mv, body)
+            # 1 = PCM; 0xFFFE = WAVE_FORMAT_EXTENSIBLE (PCM en la práctica con 16 bits)
+            if audio_fmt not in (1, 0xFFFE) or bits != 16:
+                return None
+            fmt = (rate, channels)
+        elif cid == b"data":
+            if fmt is None:
+                return None
+            # Algunos generadores en streaming dejan el tamaño a 0 o 0xFFFFFFFF
+            end = len(mv) if size in (0, 0xFFFFFFFF) else min(len(mv), body + size)
+            end -= (end - body) % (2 * fmt[1])
+            return mv[body:end], fmt[0], fmt[1]
+        pos = body + size + (size & 1)  # los bloques van alineados a 2 bytes
+    return None
+
+
+def make_wav_bytes(pcm, sample_rate: int, channels: int = 1) -> bytes:
+    """PCM16 -> WAV completo en memoria."""
+    data_len = len(pcm)
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_len, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, sample_rate * channels * 2, channels * 2, 16,
+        b"data", data_len,
+    )
+    return header + bytes(pcm)
+
+
+def silent_wav_bytes(seconds: float = 1.0, sample_rate: int = 16000) -> bytes:
+    """WAV de silencio, por si el TTS falla, para respetar el protocolo."""
+    return make_wav_bytes(b"\x00\x00" * int(sample_rate * seconds), sample_rate, 1)